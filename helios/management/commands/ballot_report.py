@@ -5,7 +5,7 @@ from django.core.management.base import BaseCommand
 
 from helios.models import Poll
 
-from zeus.core import gamma_decode, to_absolute_answers
+from zeus.core import gamma_decode_list
 
 
 def strforce(thing):
@@ -27,7 +27,6 @@ class Command(BaseCommand):
         nr_cand = len(candidates)
         results = '\n'.join(
                 '|'.join(strforce(candidates[x]).replace('|', '^')
-                         for x in to_absolute_answers(
-                                gamma_decode(ballot, nr_cand, nr_cand), nr_cand))
-                for ballot in ballots)
+                         for x in selection)
+                for selection in gamma_decode_list(ballots, nr_cand, nr_cand))
         print(results)
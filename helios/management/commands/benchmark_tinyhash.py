@@ -0,0 +1,73 @@
+"""
+Benchmark cast vote tinyhash allocation as helios_castvote grows.
+
+Grows the cast votes of a poll in steps with rows of random hashes and
+times saving new cast votes after each step. Everything is rolled back.
+"""
+
+import base64
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from helios.models import CastVote, Poll
+
+
+def random_vote_hash():
+    return base64.b64encode(os.urandom(32)).decode()[:-1]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark allocating cast vote tinyhashes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll', help="uuid of a poll with cast votes")
+        parser.add_argument('--steps', type=int, default=5,
+                            help="number of times to grow the table")
+        parser.add_argument('--step-size', type=int, default=100000,
+                            help="cast votes to add on each step")
+        parser.add_argument('--samples', type=int, default=200,
+                            help="cast votes to time after each step")
+
+    def handle(self, *args, **options):
+        try:
+            poll = Poll.objects.get(uuid=options['poll'])
+        except Poll.DoesNotExist:
+            raise CommandError("Poll %s does not exist" % options['poll'])
+        template = poll.cast_votes.select_related('voter').first()
+        if template is None:
+            raise CommandError("Poll %s has no cast votes" % poll.uuid)
+
+        def new_vote():
+            return CastVote(voter=template.voter, poll=poll,
+                            vote=template.vote, vote_hash=random_vote_hash(),
+                            fingerprint=template.fingerprint)
+
+        with transaction.atomic():
+            for step in range(options['steps'] + 1):
+                if step:
+                    filler = []
+                    for i in range(options['step_size']):
+                        vote = new_vote()
+                        # long enough to leave the short ones free
+                        vote.set_tinyhash(16)
+                        filler.append(vote)
+                    CastVote.objects.bulk_create(filler, batch_size=5000,
+                                                 ignore_conflicts=True)
+
+                nr_rows = CastVote.objects.count()
+                samples = options['samples']
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for i in range(samples):
+                        new_vote().save()
+                    elapsed = time.perf_counter() - start
+
+                self.stdout.write("%10d cast votes: %.3f ms, %.2f queries "
+                                  "per save" % (nr_rows,
+                                                1000 * elapsed / samples,
+                                                len(queries) / samples))
+            transaction.set_rollback(True)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0005_election_cast_consent_text'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='castvote',
+            index=models.Index(fields=['poll', 'fingerprint'],
+                               name='helios_castvote_fp_idx'),
+        ),
+    ]
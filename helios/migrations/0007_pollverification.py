@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0006_castvote_fingerprint_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollVerification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('digest', models.CharField(max_length=64)),
+                ('verifier_version', models.PositiveIntegerField()),
+                ('verified_at', models.DateTimeField(auto_now_add=True)),
+                ('poll', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='verifications', to='helios.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'kind', 'digest',
+                                     'verifier_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0007_pollverification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollmix',
+            name='digest',
+            field=models.CharField(max_length=64, null=True, default=None),
+        ),
+    ]
@@ -16,8 +16,9 @@ import zipfile
 import os
 import csv
 import tempfile
-import mmap
+import json
 import marshal
+import glob
 import itertools
 import six.moves.urllib.request
 import six.moves.urllib.parse
@@ -26,7 +27,7 @@ import six.moves.urllib.error
 from datetime import timedelta
 
 from django.template.loader import render_to_string
-from django.db import models, transaction
+from django.db import models, transaction, connection, IntegrityError
 from django.db.models.query import QuerySet
 from django.db.models import Count
 from django.conf import settings
@@ -49,8 +50,9 @@ from heliosauth.models import SMSBackendData, User
 from heliosauth.jsonfield import JSONField
 
 from zeus.core import (numbers_hash, gamma_encoding_max,
-                       gamma_decode, to_absolute_answers, to_canonical,
-                       from_canonical)
+                       gamma_decode, gamma_decode_list, to_absolute_answers,
+                       to_canonical, from_canonical, ZeusError)
+from zeus.mixfile import MixFile, dump_mix, load_mix, is_mix_file
 from zeus.slugify import slughifi
 from zeus.election_modules import ELECTION_MODULES_CHOICES, get_poll_module, \
     get_election_module
@@ -92,6 +94,12 @@ class PollMixQuerySet(QuerySet):
     def pending(self):
         return self.filter(status="pending")
 
+    def delete(self):
+        # the disk cache of the mixes goes with them
+        for mix in self.only('pk'):
+            mix.forget_cached_mix()
+        return super(PollMixQuerySet, self).delete()
+
 
 class PollMixManager(models.Manager):
 
@@ -102,6 +110,24 @@ class PollMixManager(models.Manager):
 default_mixes_path = settings.MEDIA_ROOT + "/zeus_mixes/"
 ZEUS_MIXES_PATH = getattr(settings, 'ZEUS_MIXES_PATH', default_mixes_path)
 zeus_mixes_storage = storage.FileSystemStorage(location=ZEUS_MIXES_PATH)
+ZEUS_MIXNET_STREAMING = getattr(settings, 'ZEUS_MIXNET_STREAMING', False)
+ZEUS_MIXES_FORMAT = getattr(settings, 'ZEUS_MIXES_FORMAT', 'canonical')
+ZEUS_MIXES_CACHE_SIZE = getattr(settings, 'ZEUS_MIXES_CACHE_SIZE', 4)
+ZEUS_MIXES_CACHE_PATH = getattr(settings, 'ZEUS_MIXES_CACHE_PATH', None)
+ZEUS_BOOTH_CACHE_PATH = getattr(settings, 'ZEUS_BOOTH_CACHE_PATH',
+                                os.path.join(settings.MEDIA_ROOT, 'booth'))
+
+# advisory lock namespace for serializing vote casting per poll
+CAST_VOTE_LOCK = 0x5a455553
+
+TINYHASH_LENGTH = 8
+
+MIX_PROOF_KEYS = ('cipher_collections', 'offset_collections',
+                  'random_collections', 'challenge')
+
+# PollMix pk -> (mix file mtime, mix without proof), least recently used
+# first
+_mixes_cache = {}
 
 
 def dummy_upload_to(x):
@@ -138,6 +164,8 @@ class PollMix(models.Model):
     mix_file = models.FileField(upload_to=dummy_upload_to,
                                 storage=zeus_mixes_storage,
                                 null=True, default=None)
+    # verification ledger digest of a mix validated on upload
+    digest = models.CharField(max_length=64, null=True, default=None)
 
     objects = PollMixManager()
 
@@ -149,6 +177,21 @@ class PollMix(models.Model):
         """
         Expects mix dict object
         """
+        if ZEUS_MIXES_FORMAT == 'binary':
+            fname = str(self.pk) + ".mix"
+            fpath = os.path.join(ZEUS_MIXES_PATH, fname)
+            try:
+                with open(fpath, "wb") as f:
+                    dump_mix(mix, f)
+            except ZeusError:
+                # not a well formed mix, e.g. a failed remote one,
+                # keep it as it is
+                os.unlink(fpath)
+            else:
+                self.mix_file = fname
+                self.save()
+                return
+
         fname = str(self.pk) + ".canonical"
         fpath = os.path.join(ZEUS_MIXES_PATH, fname)
         with open(fpath, "w") as f:
@@ -165,13 +208,104 @@ class PollMix(models.Model):
         self.second_mix = None
         self.status = 'pending'
         self.mix_error = None
+        self.digest = None
         self.save()
         self.parts.all().delete()
+        self.forget_cached_mix()
         return True
 
-    def zeus_mix(self):
-        with self.mix_file as f:
-            return from_canonical(f.read())
+    def zeus_mix(self, proof=True):
+        """
+        Load the mix dict. Without proof, the proof rounds are left out
+        and the mix is served from the mixes cache. The returned lists
+        are shared and must not be modified.
+        """
+        fpath = self.mix_file.path
+        if proof:
+            if is_mix_file(fpath):
+                return load_mix(fpath)
+            with open(fpath, "r") as f:
+                return from_canonical(f.read())
+
+        mtime = os.stat(fpath).st_mtime_ns
+        cached = _mixes_cache.pop(self.pk, None)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self._load_mix_without_proof(fpath, mtime))
+        if ZEUS_MIXES_CACHE_SIZE > 0:
+            while len(_mixes_cache) >= ZEUS_MIXES_CACHE_SIZE:
+                del _mixes_cache[next(iter(_mixes_cache))]
+            _mixes_cache[self.pk] = cached
+        return dict(cached[1])
+
+    def iter_zeus_mix(self):
+        """
+        Yield the mix dict once. Mix files are read one proof round at a
+        time, as the proof collections are consumed.
+        """
+        fpath = self.mix_file.path
+        if not is_mix_file(fpath):
+            yield self.zeus_mix()
+            return
+        with MixFile(fpath) as mix_file:
+            yield mix_file.to_dict(lazy=True)
+
+    def _mix_cache_file(self, mtime):
+        fname = "%d-%d.marshal" % (self.pk, mtime)
+        return os.path.join(ZEUS_MIXES_CACHE_PATH, fname)
+
+    def _load_mix_without_proof(self, fpath, mtime):
+        if is_mix_file(fpath):
+            return load_mix(fpath, proof=False)
+
+        cache_file = None
+        if ZEUS_MIXES_CACHE_PATH:
+            cache_file = self._mix_cache_file(mtime)
+            try:
+                with open(cache_file, "rb") as f:
+                    return marshal.load(f)
+            except FileNotFoundError:
+                pass
+            except (EOFError, ValueError, TypeError):
+                # truncated or corrupt, rebuilt below
+                logging.warning("Discarding bad mix cache file %s",
+                                cache_file)
+
+        with open(fpath, "r") as f:
+            mix = from_canonical(f.read())
+        for key in MIX_PROOF_KEYS:
+            mix.pop(key, None)
+
+        if cache_file:
+            # drops the bad file and those of older mix file versions
+            self._remove_cache_files()
+            os.makedirs(ZEUS_MIXES_CACHE_PATH, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=ZEUS_MIXES_CACHE_PATH)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    marshal.dump(mix, f)
+                os.replace(tmp_file, cache_file)
+            except Exception:
+                os.unlink(tmp_file)
+                raise
+        return mix
+
+    def _remove_cache_files(self):
+        pattern = "%d-*.marshal" % (self.pk,)
+        for cache_file in glob.glob(os.path.join(ZEUS_MIXES_CACHE_PATH,
+                                                 pattern)):
+            try:
+                os.unlink(cache_file)
+            except FileNotFoundError:
+                pass
+
+    def forget_cached_mix(self):
+        _mixes_cache.pop(self.pk, None)
+        if ZEUS_MIXES_CACHE_PATH:
+            self._remove_cache_files()
+
+    def delete(self, *args, **kwargs):
+        self.forget_cached_mix()
+        return super(PollMix, self).delete(*args, **kwargs)
 
     def mix_parts_iter(self, mix):
         size = len(mix)
@@ -184,15 +318,39 @@ class PollMix(models.Model):
         """
         mix is a dict object
         """
+        self.forget_cached_mix()
         self.parts.all().delete()
+        if ZEUS_MIXES_FORMAT == 'binary':
+            # the mix file is the only copy kept
+            return
         mix = marshal.dumps(mix)
 
         for part in self.mix_parts_iter(mix):
             self.parts.create(data=part)
 
+    def mix_to_file(self, ciphers):
+        """
+        Mix straight into the mix file, without holding the whole mix in
+        memory. No mix parts are stored.
+        """
+        binary = ZEUS_MIXES_FORMAT == 'binary'
+        fname = str(self.pk) + (".mix" if binary else ".canonical")
+        fpath = os.path.join(ZEUS_MIXES_PATH, fname)
+        with open(fpath, "wb" if binary else "w") as f:
+            self.poll.zeus.mix_to_file(ciphers, f, spill_dir=ZEUS_MIXES_PATH,
+                                       binary=binary)
+        self.mix_file = fname
+        self.save()
+
     @transaction.atomic
     def _do_mix(self):
         last_mix = self.poll.zeus.get_last_mix()
+        if ZEUS_MIXNET_STREAMING:
+            self.mix_to_file(last_mix)
+            self.status = 'finished'
+            self.save()
+            return
+
         new_mix = self.poll.zeus.mix(last_mix)
 
         self.store_mix(new_mix)
@@ -1002,6 +1160,60 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         }
         return data
 
+    def _booth_cache_file(self, lang):
+        return os.path.join(ZEUS_BOOTH_CACHE_PATH,
+                            "%s.%s.json" % (self.uuid, lang))
+
+    def _booth_cache_stamp(self):
+        # frozen polls cannot be edited, their election saves bump this
+        return self.election.modified_at.isoformat().encode()
+
+    def _booth_json(self):
+        from zeus.views.utils import common_json_handler
+        return json.dumps(self.get_booth_dict(),
+                          default=common_json_handler).encode()
+
+    def cache_booth_json(self, lang=None):
+        """
+        Serialize the booth dict of the frozen poll in lang, the active
+        language by default, and store it for get_booth_json, replacing
+        any previously stored copy. The module params carry translated
+        messages, hence a copy per language.
+        """
+        lang = lang or translation.get_language() or settings.LANGUAGE_CODE
+        with translation.override(lang):
+            data = self._booth_json()
+        os.makedirs(ZEUS_BOOTH_CACHE_PATH, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=ZEUS_BOOTH_CACHE_PATH)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._booth_cache_stamp() + b"\n" + data)
+            os.replace(tmp_file, self._booth_cache_file(lang))
+        except Exception:
+            os.unlink(tmp_file)
+            raise
+        return data
+
+    def get_booth_json(self):
+        """
+        Return the booth dict as JSON bytes in the active language.
+        Frozen polls serve it from the cache until their election is
+        saved again.
+        """
+        if not self.frozen_at:
+            return self._booth_json()
+
+        lang = translation.get_language() or settings.LANGUAGE_CODE
+        try:
+            with open(self._booth_cache_file(lang), "rb") as f:
+                stamp, data = f.read().split(b"\n", 1)
+        except (FileNotFoundError, ValueError):
+            return self.cache_booth_json(lang)
+
+        if stamp != self._booth_cache_stamp():
+            return self.cache_booth_json(lang)
+        return data
+
     @property
     def cast_votes_count(self):
         return self.voters.exclude(vote=None).count()
@@ -1172,8 +1384,9 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         status = 'finished'
         mix_order = int(self.mixes_count())
 
+        digest = None
         try:
-            self.zeus.add_mix(remote_mix)
+            digest = self.zeus.add_mix(remote_mix)
         except Exception:
             logging.exception("Remote mix failed")
             status = 'error'
@@ -1187,7 +1400,8 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
                                         mixing_started_at=datetime.datetime.now(),
                                         mixing_finished_at=datetime.datetime.now(),
                                         status=status,
-                                        mix_error=error if error else None)
+                                        mix_error=error if error else None,
+                                        digest=digest)
                 mix.store_mix(remote_mix)
                 mix.store_mix_in_file(remote_mix)
         except Exception as e:
@@ -1243,9 +1457,24 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
 
         return zeus_vote
 
-    def cast_vote(self, voter, enc_vote, audit_password=None):
+    def lock_for_casting(self):
+        """
+        Serialize vote casting in this poll until the current
+        transaction ends, so that cast votes get consecutive indexes.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)",
+                           [CAST_VOTE_LOCK, self.pk])
+
+    def verify_vote_proof(self, voter, enc_vote, audit_password=None):
         zeus_vote = self._get_zeus_vote(enc_vote, voter, audit_password)
-        return self.zeus.cast_vote(zeus_vote)
+        return self.zeus.verify_vote_proof(zeus_vote)
+
+    def cast_vote(self, voter, enc_vote, audit_password=None,
+                  verified_fingerprint=None):
+        zeus_vote = self._get_zeus_vote(enc_vote, voter, audit_password)
+        return self.zeus.cast_vote(zeus_vote,
+                                   verified_fingerprint=verified_fingerprint)
 
     def zeus_proofs_path(self):
         return os.path.join(settings.ZEUS_PROOFS_PATH, '%s-%s.zip' %
@@ -1259,28 +1488,32 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         if os.path.exists(zip_path):
             os.unlink(zip_path)
 
-        export_data = self.zeus.export()
-        self.zeus_fingerprint = export_data[0]['election_fingerprint']
-        self.save()
-
-        zf = zipfile.ZipFile(zip_path, mode='w')
         data_info = zipfile.ZipInfo('%s_proofs.txt' % self.short_name)
         data_info.compress_type = zipfile.ZIP_DEFLATED
-        data_info.comment = (
-            "Election %s (%s-%s) zeus proofs" % (self.zeus_fingerprint,
-                                                 self.election.uuid, self.uuid)
-        ).encode()
         data_info.date_time = datetime.datetime.now().timetuple()
         data_info.external_attr = 0o777 << 16
 
-        tmpf = tempfile.TemporaryFile(mode="w", suffix='.zeus',
-                                      prefix='tmp', dir='/tmp')
-        to_canonical(export_data[0], out=tmpf)
-        tmpf.flush()
-        zeus_data = mmap.mmap(tmpf.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
-        zf.writestr(data_info, zeus_data)
-        zf.close()
-        tmpf.close()
+        # the export is streamed into the archive, which is only moved
+        # into place once complete
+        tmp_path = zip_path + '.tmp'
+        try:
+            with zipfile.ZipFile(tmp_path, mode='w') as zf:
+                with zf.open(data_info, mode='w', force_zip64=True) as f:
+                    stage, fingerprint = self.zeus.export_to_file(
+                        f, tmpdir='/tmp')
+                # the comment goes into the central directory,
+                # written when the archive is closed
+                data_info.comment = (
+                    "Election %s (%s-%s) zeus proofs" % (
+                        fingerprint, self.election.uuid, self.uuid)
+                ).encode()
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        os.replace(tmp_path, zip_path)
+
+        self.zeus_fingerprint = fingerprint
+        self.save()
 
     @property
     def pretty_result(self):
@@ -1292,10 +1525,14 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         answer_selections = []
         selections = []
 
-        for vote in self.result[0]:
+        relative = gamma_decode_list(self.result[0], cands_count, cands_count,
+                                     absolute=False)
+        absolute = gamma_decode_list(self.result[0], cands_count, cands_count)
+        for vote, selection, abs_selection in zip(self.result[0], relative,
+                                                  absolute):
             decoded = vote
-            selection = gamma_decode(vote, cands_count, cands_count)
-            abs_selection = to_absolute_answers(selection, cands_count)
+            selection = list(selection)
+            abs_selection = list(abs_selection)
             cands = [answers[i] for i in abs_selection]
             cands_objs = []
             for i in abs_selection:
@@ -1982,6 +2219,8 @@ class CastVote(HeliosModel):
     class Meta:
         unique_together = (('poll', 'index'),)
         ordering = ('-cast_at',)
+        indexes = [models.Index(fields=['poll', 'fingerprint'],
+                                name='helios_castvote_fp_idx')]
 
     @property
     def datatype(self):
@@ -1999,7 +2238,7 @@ class CastVote(HeliosModel):
     def is_quarantined(self):
         return self.quarantined_p and not self.released_from_quarantine_at
 
-    def set_tinyhash(self):
+    def set_tinyhash(self, length=TINYHASH_LENGTH):
         """
         find a tiny version of the hash for a URL slug.
         """
@@ -2007,24 +2246,32 @@ class CastVote(HeliosModel):
         for c in ['/', '+']:
             safe_hash = safe_hash.replace(c, '')
 
-        length = 8
-        while True:
-            vote_tinyhash = safe_hash[:length]
-            if CastVote.objects.filter(vote_tinyhash=vote_tinyhash).count() == 0:
-                break
-            length += 1
-
-        self.vote_tinyhash = vote_tinyhash
+        self.vote_tinyhash = safe_hash[:length]
 
     def save(self, *args, **kwargs):
         """
         override this just to get a hook
         """
-        # not saved yet? then we generate a tiny hash
-        if not self.vote_tinyhash:
-            self.set_tinyhash()
+        if self.vote_tinyhash:
+            super(CastVote, self).save(*args, **kwargs)
+            return
 
-        super(CastVote, self).save(*args, **kwargs)
+        # not saved yet? then we generate a tiny hash, trusting the
+        # unique constraint instead of looking for taken ones first
+        length = TINYHASH_LENGTH
+        while True:
+            self.set_tinyhash(length)
+            try:
+                with transaction.atomic():
+                    super(CastVote, self).save(*args, **kwargs)
+                return
+            except IntegrityError:
+                taken = CastVote.objects.filter(
+                    vote_tinyhash=self.vote_tinyhash).exists()
+                if not taken or length >= len(self.vote_hash):
+                    self.vote_tinyhash = None
+                    raise
+            length += 1
 
 
 class AuditedBallotQuerySet(QuerySet):
@@ -2132,6 +2379,24 @@ class TrusteeDecryptionFactors(models.Model):
         unique_together = (('trustee', 'poll'),)
 
 
+class PollVerification(models.Model):
+    """
+    Verification ledger entry: a mix or a set of decryption factors of
+    the poll whose proof the verifier of verifier_version accepted,
+    keyed by the SHA-256 of its canonical form.
+    """
+
+    poll = models.ForeignKey('Poll', on_delete=models.CASCADE,
+                             related_name='verifications')
+    kind = models.CharField(max_length=32)
+    digest = models.CharField(max_length=64)
+    verifier_version = models.PositiveIntegerField()
+    verified_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('poll', 'kind', 'digest', 'verifier_version'),)
+
+
 class TrusteeQuerySet(QuerySet):
 
     def no_secret(self):
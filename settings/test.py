@@ -47,9 +47,10 @@ ZEUS_ELECTION_LOG_DIR = os.path.join(PROJECT_ROOT, 'election_logs')
 ZEUS_PROOFS_PATH = os.path.join(PROJECT_ROOT, 'proofs')
 ZEUS_RESULTS_PATH = os.path.join(PROJECT_ROOT, 'results')
 ZEUS_MIXES_PATH = os.path.join(PROJECT_ROOT, 'mixes')
+ZEUS_MIXNET_POOL_PATH = os.path.join(PROJECT_ROOT, 'mixpools')
 
 dirs = [ZEUS_ELECTION_LOG_DIR, ZEUS_PROOFS_PATH,
-        ZEUS_RESULTS_PATH, ZEUS_MIXES_PATH]
+        ZEUS_RESULTS_PATH, ZEUS_MIXES_PATH, ZEUS_MIXNET_POOL_PATH]
 for dir in dirs:
     mkdir_p(dir)
 
@@ -5,6 +5,9 @@
 import sys
 import os
 import ssl
+import time
+import math
+import asyncio
 
 from zeus.core import (c2048, get_random_selection,
                        gamma_encode, gamma_decode, gamma_encoding_max,
@@ -16,6 +19,10 @@ from zeus.core import (c2048, get_random_selection,
                        verify_vote_signature,
                        parties_from_candidates,
                        FormatError)
+from zeus.mixpool import ReencryptionPool
+
+from Crypto import Random
+from loky import get_reusable_executor
 
 from six.moves.http_client import HTTPConnection, HTTPSConnection
 from six.moves.urllib.parse import urlparse, parse_qsl
@@ -29,6 +36,8 @@ from base64 import b64encode
 
 p, g, q, x, y = c2048()
 
+LOAD_TEST_REQUESTS = ('login', 'to_json', 'cast', 'cast_done')
+
 
 def get_http_connection(url):
     parsed = urlparse(url)
@@ -148,6 +157,35 @@ def get_poll_info(url):
     return conn, headers, poll_info
 
 
+def random_party_choices(candidates):
+    """
+    Return random choices valid for the party lists of candidates,
+    or None if the candidates are not party lists.
+    """
+    parties = None
+    try:
+        parties, nr_groups = parties_from_candidates(candidates)
+    except FormatError:
+        pass
+
+    if not parties:
+        return None
+
+    if randint(0, 19) == 0:
+        return []
+
+    party_choice = choice(list(parties.keys()))
+    party = parties[party_choice]
+    party_candidates = [k for k in list(party.keys()) if isinstance(k, int)]
+    min_choices = party['opt_min_choices']
+    max_choices = party['opt_max_choices']
+    shuffle(party_candidates)
+    nr_choices = randint(min_choices, max_choices)
+    choices = party_candidates[:nr_choices]
+    choices.sort()
+    return choices
+
+
 def do_cast_vote(conn, cast_path, token, headers, vote):
     body = urlencode({'encrypted_vote': dumps(vote), 'csrfmiddlewaretoken': token})
     conn.request('POST', cast_path, headers=headers, body=body)
@@ -173,35 +211,12 @@ def cast_vote(voter_url, choices=None):
     candidates = poll_data['questions'][0]['answers']
     cast_path = poll_data['cast_url']
 
-    parties = None
-    try:
-        parties, nr_groups = parties_from_candidates(candidates)
-    except FormatError:
-        pass
-
-    if parties:
-        if randint(0, 19) == 0:
-            choices = []
-        else:
-            party_choice = choice(list(parties.keys()))
-            party = parties[party_choice]
-            party_candidates = [k for k in list(party.keys()) if isinstance(k, int)]
-            min_choices = party['opt_min_choices']
-            max_choices = party['opt_max_choices']
-            shuffle(party_candidates)
-            nr_choices = randint(min_choices, max_choices)
-            choices = party_candidates[:nr_choices]
-            choices.sort()
-        vote, encoded, rand = generate_vote(p, g, q, y, choices)
-        #for c in choices:
-        #    print "Voting for", c, party[c]
-        #ballot = gamma_decode_to_party_ballot(encoded, candidates,
-        #                                      parties, nr_groups)
-        #print "valid", ballot['valid'], ballot['invalid_reason']
-        #print " "
-    else:
-        choices = choices if choices is not None else len(candidates)
-        vote, encoded, rand = generate_vote(p, g, q, y, choices)
+    party_choices = random_party_choices(candidates)
+    if party_choices is not None:
+        choices = party_choices
+    elif choices is None:
+        choices = len(candidates)
+    vote, encoded, rand = generate_vote(p, g, q, y, choices)
 
     do_cast_vote(conn, cast_path, csrf_token, headers, vote)
     return encoded, rand
@@ -252,13 +267,367 @@ def main_random_cast(voter_url_file, plaintexts_file, nr_threads=2):
         t.start()
 
     plaintexts = [outqueue.get() for _ in range(total)]
-    with open(plaintexts, 'w') as f:
+    with open(plaintexts_file, 'w') as f:
         f.write(repr(plaintexts))
 
     for t in threads:
         t.join()
 
 
+class AsyncConnection(object):
+    """
+    Keep-alive HTTP/1.1 client connection for asyncio.
+    """
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.ssl = None
+        default_port = 80
+        if parsed.scheme == 'https':
+            default_port = 443
+            self.ssl = ssl._create_unverified_context()
+        self.host = parsed.hostname
+        self.port = parsed.port or default_port
+        self.netloc = parsed.netloc
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        reused = self.writer is not None
+        if not reused:
+            await self.connect()
+        try:
+            return await self._request(method, path, headers or {}, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        # the server closed the idle connection, try once more
+        await self.connect()
+        return await self._request(method, path, headers or {}, body)
+
+    async def _request(self, method, path, headers, body):
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: %s' % (self.netloc,),
+                 'Content-Length: %d' % (len(body),)]
+        lines.extend('%s: %s' % header for header in headers.items())
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+
+        reader = self.reader
+        status_line = await reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        response_headers = []
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, sep, value = line.decode('latin-1').partition(':')
+            response_headers.append((name.strip().lower(), value.strip()))
+
+        header = dict(response_headers)
+        if header.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size_line = await reader.readuntil(b'\r\n')
+                size = int(size_line.split(b';')[0], 16)
+                if not size:
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in header:
+            data = await reader.readexactly(int(header['content-length']))
+        elif status in (204, 304):
+            data = b''
+        else:
+            data = await reader.read()
+            self.close()
+
+        if header.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+
+def update_cookies(cookies, response_headers):
+    for name, value in response_headers:
+        if name == 'set-cookie':
+            key, sep, val = value.split(';', 1)[0].partition('=')
+            cookies[key.strip()] = val.strip()
+
+
+def cookie_header(cookies):
+    return '; '.join('%s=%s' % item for item in cookies.items())
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of the sorted values.
+    """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+async def timed_request(stats, name, conn, expected, method, path,
+                        headers=None, body=b''):
+    """
+    Send a request and record its latency under name.
+    Return the response, or None if it failed or had another
+    status than expected.
+    """
+    start = time.perf_counter()
+    try:
+        response = await conn.request(method, path, headers, body)
+    except (OSError, ValueError, asyncio.IncompleteReadError):
+        conn.close()
+        response = None
+    elapsed = time.perf_counter() - start
+
+    stat = stats[name]
+    stat['latencies'].append(elapsed)
+    if response is None or response[0] != expected:
+        stat['errors'] += 1
+        if response is not None:
+            status = str(response[0])
+            stat['statuses'][status] = stat['statuses'].get(status, 0) + 1
+        return None
+    return response
+
+
+def response_fields(stats, name, response, *fields):
+    """
+    Return the fields of the JSON body of response, or None after
+    recording an error under name if the body is not JSON or lacks
+    one of them.
+    """
+    try:
+        data = loads(response[2])
+        return [data[field] for field in fields]
+    except (ValueError, KeyError, TypeError):
+        stats[name]['errors'] += 1
+        return None
+
+
+async def load_cast_vote(conn, stats, voter_url, vote):
+    """
+    Log in with voter_url, load the booth JSON, cast vote and load
+    the cast done page, like a voter's browser.
+    Return whether the vote was cast.
+    """
+    cookies = {}
+    login_path = urlparse(voter_url).path
+    response = await timed_request(stats, 'login', conn, 302,
+                                   'GET', login_path)
+    if response is None:
+        return False
+    update_cookies(cookies, response[1])
+
+    json_path = poll_json_path(voter_url)
+    headers = {'Cookie': cookie_header(cookies)}
+    response = await timed_request(stats, 'to_json', conn, 200,
+                                   'GET', json_path, headers)
+    if response is None:
+        return False
+    update_cookies(cookies, response[1])
+    poll_data = response_fields(stats, 'to_json', response,
+                                'token', 'cast_url')
+    if poll_data is None:
+        return False
+    token, cast_url = poll_data
+    cookies.setdefault('csrftoken', token)
+
+    body = urlencode({'encrypted_vote': dumps(vote),
+                      'csrfmiddlewaretoken': token}).encode()
+    headers = {
+        'Cookie': cookie_header(cookies),
+        'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+        'Referer': voter_url,
+    }
+    response = await timed_request(stats, 'cast', conn, 200,
+                                   'POST', cast_url, headers, body)
+    if response is None:
+        return False
+    update_cookies(cookies, response[1])
+    cast_data = response_fields(stats, 'cast', response, 'cast_url')
+    if cast_data is None:
+        return False
+
+    cast_done = urlparse(cast_data[0])
+    cast_done_path = cast_done.path + '?' + cast_done.query
+    headers = {'Cookie': cookie_header(cookies)}
+    response = await timed_request(stats, 'cast_done', conn, 200,
+                                   'GET', cast_done_path, headers)
+    return response is not None
+
+
+async def run_load_test(voter_urls, votes, concurrency):
+    stats = dict((name, {'latencies': [], 'errors': 0, 'statuses': {}})
+                 for name in LOAD_TEST_REQUESTS)
+    cast = [False] * len(voter_urls)
+    jobs = iter(range(len(voter_urls)))
+
+    async def worker():
+        conn = AsyncConnection(voter_urls[0])
+        try:
+            for i in jobs:
+                cast[i] = await load_cast_vote(conn, stats, voter_urls[i],
+                                               votes[i])
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+    return stats, cast, duration
+
+
+def load_test_report(stats, cast, duration, concurrency):
+    nr_cast = sum(cast)
+    report = {
+        'voters': len(cast),
+        'cast': nr_cast,
+        'concurrency': concurrency,
+        'duration': duration,
+        'casts_per_second': nr_cast / duration if duration else None,
+        'requests': {},
+    }
+    for name in LOAD_TEST_REQUESTS:
+        stat = stats[name]
+        latencies = sorted(1000 * t for t in stat['latencies'])
+        count = len(latencies)
+        report['requests'][name] = {
+            'count': count,
+            'errors': stat['errors'],
+            'error_rate': stat['errors'] / count if count else 0.0,
+            'statuses': stat['statuses'],
+            'mean_ms': sum(latencies) / count if count else None,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+        }
+    return report
+
+
+def poll_json_path(voter_url):
+    # voter urls are <poll url>/l/<voter uuid>/<voter secret>
+    return urlparse(voter_url).path.rsplit('/l/', 1)[0] + '.json'
+
+
+def get_poll_data(voter_url):
+    conn = get_http_connection(voter_url)
+    conn.request('GET', poll_json_path(voter_url))
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status != 200:
+        m = "Cannot load poll data for %s: %d" % (voter_url, response.status)
+        raise RuntimeError(m)
+    return loads(data)
+
+
+def _generate_votes(data):
+    p, g, q, y, choices_list = data
+    return [generate_vote(p, g, q, y, choices)[:2]
+            for choices in choices_list]
+
+
+def generate_load_test_votes(voter_urls, nr_procs=2, chunk_size=64):
+    """
+    Generate a random vote for each voter url in a process pool.
+    Return the votes and their encoded plaintexts.
+    """
+    polls = {}
+    jobs = {}
+    for i, voter_url in enumerate(voter_urls):
+        path = poll_json_path(voter_url)
+        if path not in polls:
+            polls[path] = get_poll_data(voter_url)
+        candidates = polls[path]['questions'][0]['answers']
+        choices = random_party_choices(candidates)
+        if choices is None:
+            choices = len(candidates)
+        jobs.setdefault(path, []).append((i, choices))
+
+    args = []
+    indexes = []
+    for path, poll_jobs in jobs.items():
+        pk = polls[path]['public_key']
+        key = (int(pk['p']), int(pk['g']), int(pk['q']), int(pk['y']))
+        for start in range(0, len(poll_jobs), chunk_size):
+            chunk = poll_jobs[start:start + chunk_size]
+            args.append(key + ([choices for i, choices in chunk],))
+            indexes.append([i for i, choices in chunk])
+
+    if nr_procs > 0:
+        executor = get_reusable_executor(max_workers=nr_procs,
+                                         initializer=Random.atfork)
+        results = executor.map(_generate_votes, args)
+    else:
+        results = map(_generate_votes, args)
+
+    votes = [None] * len(voter_urls)
+    plaintexts = [None] * len(voter_urls)
+    for chunk_indexes, chunk_votes in zip(indexes, results):
+        for i, (vote, encoded) in zip(chunk_indexes, chunk_votes):
+            votes[i] = vote
+            plaintexts[i] = encoded
+        sys.stderr.write("generated %d votes\n" % (len(chunk_indexes),))
+    return votes, plaintexts
+
+
+def main_load_test(voter_url_file, report_file, concurrency=10, nr_procs=2,
+                   plaintexts_file=None):
+    for filename in (report_file, plaintexts_file):
+        if filename and exists(filename):
+            m = "%s: file exists, will not overwrite" % (filename,)
+            raise ValueError(m)
+
+    with open(voter_url_file) as f:
+        voter_urls = f.read().splitlines()
+    if not voter_urls:
+        return
+
+    votes, plaintexts = generate_load_test_votes(voter_urls, nr_procs)
+    stats, cast, duration = asyncio.run(
+        run_load_test(voter_urls, votes, concurrency))
+    report = load_test_report(stats, cast, duration, concurrency)
+
+    with open(report_file, 'w') as f:
+        dump(report, f, indent=2, sort_keys=True)
+
+    if plaintexts_file:
+        with open(plaintexts_file, 'w') as f:
+            f.write(repr([encoded for encoded, ok in zip(plaintexts, cast)
+                          if ok]))
+
+    sys.stdout.write("%d/%d votes cast in %.1fs\n"
+                     % (report['cast'], report['voters'], duration))
+    for name in LOAD_TEST_REQUESTS:
+        r = report['requests'][name]
+        if not r['count']:
+            continue
+        sys.stdout.write("%-10s %6d requests %5.1f%% errors  "
+                         "p50 %.1fms p95 %.1fms p99 %.1fms\n"
+                         % (name, r['count'], 100 * r['error_rate'],
+                            r['p50_ms'], r['p95_ms'], r['p99_ms']))
+    return report
+
+
 def main_show(url):
     raise NotImplementedError()
     '''
@@ -381,7 +750,24 @@ def do_upload_factors(outfile, url):
         curr_file = outfile + ".%d" % poll_index
 
 
-def do_mix(mixfile, newfile, nr_rounds, nr_parallel, module):
+def get_pool(pool_file, mix):
+    return ReencryptionPool(pool_file, mix['modulus'], mix['generator'],
+                            mix['order'], mix['public'])
+
+
+def do_precompute(key, pool_file, count, nr_parallel):
+    if exists(key):
+        with open(key) as f:
+            mix = from_canonical(f)
+    else:
+        mix = {'modulus': p, 'generator': g, 'order': q, 'public': int(key)}
+
+    pool = get_pool(pool_file, mix)
+    available = pool.fill(count, nr_parallel=nr_parallel)
+    print("%d re-encryption factors in '%s'" % (available, pool_file))
+
+
+def do_mix(mixfile, newfile, nr_rounds, nr_parallel, module, pool_file=None):
     if exists(newfile):
         m = "file '%s' already exists, will not overwrite" % (newfile,)
         raise ValueError(m)
@@ -390,25 +776,28 @@ def do_mix(mixfile, newfile, nr_rounds, nr_parallel, module):
         i = 0
         while os.path.exists("{}.{}".format(mixfile, i)):
             do_mix("{}.{}".format(mixfile, i), "{}.{}".format(newfile, i),
-                   nr_rounds, nr_parallel, module)
+                   nr_rounds, nr_parallel, module, pool_file)
             i = i + 1
         return
 
     with open(mixfile) as f:
         mix = from_canonical(f)
 
+    kw = {}
+    if pool_file:
+        kw['pool'] = get_pool(pool_file, mix)
     new_mix = module.mix_ciphers(mix, nr_rounds=nr_rounds,
-                          nr_parallel=nr_parallel)
+                          nr_parallel=nr_parallel, **kw)
     with open(newfile, "w") as f:
         to_canonical(new_mix, out=f)
 
     return new_mix
 
 
-def do_automix(url, prefix, nr_rounds, nr_parallel, module):
+def do_automix(url, prefix, nr_rounds, nr_parallel, module, pool_file=None):
     do_download_mix(url, "{}-votes".format(prefix))
     do_mix("{}-votes".format(prefix), "{}-mix".format(prefix), nr_rounds,
-            nr_parallel, module)
+            nr_parallel, module, pool_file)
     do_upload_mix("{}-mix".format(prefix), url)
 
 
@@ -473,12 +862,14 @@ def do_decrypt(savefile, outfile, keyfile, nr_parallel):
 def main_help():
     usage = ("Usage: {0} generate <nr> <domain> <voters.csv>\n"
              "       {0} masscast <voter_url_file> <plaintexts_file> [nr_threads]\n"
+             "       {0} loadtest <voter_url_file> <report_file> [concurrency [nr_procs [plaintexts_file]]]\n"
              "       {0} show     <voter_url>\n"
              "       {0} castvote <voter_url> <1st>,<2nd>,... (e.g.)\n"
              "       {0} verify   <vote_signature_file> [randomness [plaintext]]\n"
              "\n"
              "       {0} download mix <url> <input.mix>\n"
-             "       {0} mix          [<url> <mix-name>|<input.mix> <output.mix>] <nr_rounds> <nr_parallel>\n"
+             "       {0} mix          [<url> <mix-name>|<input.mix> <output.mix>] <nr_rounds> <nr_parallel> [pool_file]\n"
+             "       {0} precompute   <public_key|input.mix> <pool_file> <count> <nr_parallel>\n"
              "       {0} upload mix   <output.mix> <url>\n"
              "\n"
              "       {0} download ciphers <url> <ballots_savefile>\n"
@@ -518,12 +909,17 @@ def main(argv=None):
         if argc < 6:
             main_help()
         from . import zeus_sk as shuffle_module
+        pool_file = argv[6] if argc > 6 else None
         if argv[2].startswith("http"):
             do_automix(argv[2], argv[3], int(argv[4]), int(argv[5]),
-                shuffle_module)
+                shuffle_module, pool_file)
         else:
             do_mix(argv[2], argv[3], int(argv[4]), int(argv[5]),
-                shuffle_module)
+                shuffle_module, pool_file)
+    elif cmd == 'precompute':
+        if argc < 6:
+            main_help()
+        do_precompute(argv[2], argv[3], int(argv[4]), int(argv[5]))
     elif cmd == 'decrypt':
         if argc < 6:
             main_help()
@@ -537,6 +933,14 @@ def main(argv=None):
             main_help()
         nr_threads=int(argv[4]) if argc > 4 else 2
         main_random_cast(argv[2], argv[3], nr_threads=nr_threads)
+    elif cmd == 'loadtest':
+        if argc < 4:
+            main_help()
+        concurrency = int(argv[4]) if argc > 4 else 10
+        nr_procs = int(argv[5]) if argc > 5 else 2
+        plaintexts_file = argv[6] if argc > 6 else None
+        main_load_test(argv[2], argv[3], concurrency=concurrency,
+                       nr_procs=nr_procs, plaintexts_file=plaintexts_file)
     elif cmd == 'show':
         if argc < 3:
             main_help()
@@ -2,21 +2,26 @@
 # -*- coding: utf-8 -*-
 
 
+import os
 import sys
+import threading
 from datetime import datetime
 from random import randint, choice as rand_choice
 from hashlib import sha256
-from itertools import zip_longest, cycle, chain, repeat
+from itertools import zip_longest, cycle, repeat
 from math import log
 from bisect import bisect_right
+from array import array
+from collections import Counter
+from collections.abc import Iterator
 import Crypto.Util.number as number
 from Crypto import Random
-from loky import get_reusable_executor
+from loky import get_reusable_executor, ProcessPoolExecutor
 import json
-from json import load as json_load
+import tempfile
 from time import time
 
-from gmpy2 import mpz
+from gmpy2 import mpz, jacobi
 _pow = pow
 inverse = number.inverse
 
@@ -30,6 +35,133 @@ bit_length = lambda num: num.bit_length()
 inverse = number.inverse
 
 
+FIXED_BASE_WINDOW = 6
+FIXED_BASE_CACHE_SIZE = 8
+
+
+class FixedBase(object):
+    """
+    Windowed precomputation table for exponentiations of a fixed base.
+
+    Row i of the table holds base^(d * 2^(i*window)) for every window
+    digit d, so that an exponentiation costs one modular multiplication
+    per non-zero digit of the exponent and no squarings.
+    """
+
+    def __init__(self, base, modulus, window=FIXED_BASE_WINDOW):
+        self.base = base
+        self.modulus = modulus
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.nr_bits = bit_length(modulus)
+        nr_rows = (self.nr_bits - 1) // window + 1
+
+        self.m = m = mpz(modulus)
+        b = mpz(base) % m
+        one = mpz(1)
+        table = []
+        append = table.append
+        for _ in range(nr_rows):
+            row = [one, b]
+            for _ in range(self.mask - 1):
+                row.append((row[-1] * b) % m)
+            append(row)
+            b = (row[-1] * b) % m
+        self.table = table
+
+    def pow(self, exponent):
+        if exponent < 0 or bit_length(exponent) > self.nr_bits:
+            return pow(self.base, exponent, self.modulus)
+
+        m = self.m
+        mask = self.mask
+        window = self.window
+        e = mpz(exponent)
+        r = mpz(1)
+        for row in self.table:
+            if not e:
+                break
+            digit = e & mask
+            if digit:
+                r = (r * row[digit]) % m
+            e >>= window
+        return int(r)
+
+
+_fixed_bases = {}
+
+
+def get_fixed_base(base, modulus):
+    key = (modulus, base)
+    fixed_base = _fixed_bases.pop(key, None)
+    if fixed_base is None:
+        fixed_base = FixedBase(base, modulus)
+        while len(_fixed_bases) >= FIXED_BASE_CACHE_SIZE:
+            del _fixed_bases[next(iter(_fixed_bases))]
+    # reinsert to keep the most recently used tables last
+    _fixed_bases[key] = fixed_base
+    return fixed_base
+
+
+def fixed_pow(base, exponent, modulus):
+    """
+    pow() for bases that are raised over and over again, such as the
+    group generator and election or trustee public keys.
+    """
+    return get_fixed_base(base, modulus).pow(exponent)
+
+
+MULTI_POW_MIN_BASES = 32
+BATCH_EXPONENT_CEIL = 2**128
+
+
+def multi_pow(bases, exponents, modulus):
+    """
+    Compute the product of base^exponent over all pairs, sharing the
+    squarings between all bases (bucket method, one exponent byte per
+    step). Pays off for many bases raised to short exponents, such as
+    the small random exponents of batch verification.
+    """
+    bases = list(bases)
+    exponents = list(exponents)
+    if len(bases) != len(exponents):
+        m = "bases and exponents differ in length"
+        raise ValueError(m)
+    if any(e < 0 for e in exponents):
+        m = "multi_pow exponents must be non-negative"
+        raise ValueError(m)
+
+    m = mpz(modulus)
+    bases = [mpz(b) for b in bases]
+    if len(bases) < MULTI_POW_MIN_BASES:
+        r = mpz(1)
+        for b, e in zip(bases, exponents):
+            r = (r * _pow(b, e, m)) % m
+        return int(r)
+
+    nr_bytes = (max(bit_length(e) for e in exponents) + 7) // 8
+    digits = [e.to_bytes(nr_bytes, 'little') for e in exponents]
+    r = mpz(1)
+    for i in range(nr_bytes - 1, -1, -1):
+        r = _pow(r, 256, m)
+        buckets = list([None]) * 256
+        for b, d in zip(bases, digits):
+            digit = d[i]
+            if digit:
+                bucket = buckets[digit]
+                buckets[digit] = b if bucket is None else (bucket * b) % m
+        acc = None
+        total = mpz(1)
+        for digit in range(255, 0, -1):
+            bucket = buckets[digit]
+            if bucket is not None:
+                acc = bucket if acc is None else (acc * bucket) % m
+            if acc is not None:
+                total = (total * acc) % m
+        r = (r * total) % m
+    return int(r)
+
+
 class ZeusError(Exception):
     pass
 
@@ -41,6 +173,13 @@ PROOF = 2
 VOTER_KEY_CEIL = 2**256
 VOTER_SLOT_CEIL = 2**48
 MIN_MIX_ROUNDS = 3
+# the keys of a mix its proof covers
+MIX_KEYS = ('challenge', 'cipher_collections', 'generator', 'mixed_ciphers',
+            'modulus', 'offset_collections', 'order', 'original_ciphers',
+            'public', 'random_collections')
+# verification ledger entries are honoured for this version only,
+# so bump it when what verifying a mix or factors checks changes
+VERIFIER_VERSION = 1
 
 V_CAST_VOTE = 'CAST VOTE'
 V_PUBLIC_AUDIT = 'PUBLIC AUDIT'
@@ -67,6 +206,58 @@ V_COMMENTS = 'COMMENTS: '
 
 _random_generator_file = Random.new()
 
+# random bytes are read from the generator in blocks of this size
+RANDOM_BLOCK_SIZE = 1 << 16
+# random integers are reduced from this many more bits than needed
+RANDOM_EXTRA_BITS = 64
+
+_random_lock = threading.Lock()
+_random_block = b''
+_random_offset = 0
+
+
+def _reset_random():
+    # a forked child must never hand out the bytes its parent buffered
+    global _random_generator_file, _random_lock, _random_block
+    global _random_offset
+    Random.atfork()
+    _random_generator_file = Random.new()
+    _random_lock = threading.Lock()
+    _random_block = b''
+    _random_offset = 0
+
+
+os.register_at_fork(after_in_child=_reset_random)
+
+# (nr_parallel, executor) verifying vote signatures in batches
+_signatures_pool = None
+
+
+def _reset_signatures_pool():
+    # the pool's processes belong to the parent
+    global _signatures_pool
+    _signatures_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_signatures_pool)
+
+
+def get_signatures_executor(nr_parallel):
+    """
+    Return the process pool verifying vote signatures, with nr_parallel
+    workers. It is kept apart from the reusable executor, which mixing
+    and decryption resize, restarting its workers, as they need.
+    """
+    global _signatures_pool
+    if _signatures_pool is not None:
+        size, executor = _signatures_pool
+        if size == nr_parallel:
+            return executor
+        executor.shutdown(wait=False)
+    executor = ProcessPoolExecutor(max_workers=nr_parallel)
+    _signatures_pool = (nr_parallel, executor)
+    return executor
+
 
 def c2048():
     p = 19936216778566278769000253703181821530777724513886984297472278095277636456087690955868900309738872419217596317525891498128424073395840060513894962337598264322558055230566786268714502738012916669517912719860309819086261817093999047426105645828097562635912023767088410684153615689914052935698627462693772783508681806906452733153116119222181911280990397752728529137894709311659730447623090500459340155653968608895572426146788021409657502780399150625362771073012861137005134355305397837208305921803153308069591184864176876279550962831273252563865904505239163777934648725590326075580394712644972925907314817076990800469107
@@ -169,6 +360,62 @@ def to_canonical(obj, out=None):
         return json.dumps(obj, sort_keys=True)
 
 
+CANONICAL_CHUNK = 1024
+COPY_CHUNK = 1 << 20
+
+
+def iter_canonical(obj, chunk_size=CANONICAL_CHUNK):
+    """
+    Iterate over the pieces of to_canonical(obj). Iterators in obj are
+    written out as lists, consuming one item at a time, and long lists
+    are written out in chunks, so that large objects need not be
+    serialized in one piece.
+    """
+    if isinstance(obj, dict) and all(isinstance(k, str) for k in obj):
+        sep = ''
+        yield '{'
+        for key in sorted(obj):
+            yield '%s%s: ' % (sep, json.dumps(key))
+            yield from iter_canonical(obj[key], chunk_size=chunk_size)
+            sep = ', '
+        yield '}'
+    elif isinstance(obj, Iterator):
+        sep = ''
+        yield '['
+        for item in obj:
+            yield sep
+            yield from iter_canonical(item, chunk_size=chunk_size)
+            sep = ', '
+        yield ']'
+    elif isinstance(obj, list) and len(obj) > chunk_size:
+        yield '['
+        for i in range(0, len(obj), chunk_size):
+            chunk = json.dumps(obj[i:i + chunk_size], sort_keys=True)
+            yield (', ' if i else '') + chunk[1:-1]
+        yield ']'
+    else:
+        yield json.dumps(obj, sort_keys=True)
+
+
+def write_canonical(obj, out):
+    """
+    Like to_canonical(obj, out=out), but written out piece by piece.
+    """
+    for data in iter_canonical(obj):
+        out.write(data)
+
+
+def canonical_digest(obj):
+    """
+    Return the SHA-256 hex digest of to_canonical(obj), hashed piece by
+    piece.
+    """
+    hasher = sha256()
+    for data in iter_canonical(obj):
+        hasher.update(data.encode())
+    return hasher.hexdigest()
+
+
 def from_canonical(inp):
     if isinstance(inp, (str, bytes)):
         return json.loads(inp)
@@ -936,6 +1183,50 @@ def gamma_decode(sumus, nr_candidates=None, max_choices=None):
     return choices
 
 
+def gamma_decode_counts(encoded_list, nr_candidates, max_choices=None,
+                        absolute=True):
+    """
+    Decode each distinct value in encoded_list once.
+    Return a list of (encoded, count, selection) in order of first
+    appearance, where selection is an array of candidate indices,
+    absolute unless absolute is false, or None if encoded is beyond
+    the encoding range.
+    """
+    nr_candidates, max_choices = \
+        get_choice_params(nr_candidates, nr_candidates, max_choices)
+    max_encoded = gamma_encoding_max(nr_candidates)
+
+    decoded = []
+    append = decoded.append
+    for encoded, count in Counter(encoded_list).items():
+        if encoded > max_encoded:
+            append((encoded, count, None))
+            continue
+        selection = gamma_decode(encoded, nr_candidates, max_choices)
+        if absolute:
+            selection = to_absolute_answers(selection, nr_candidates)
+        append((encoded, count, array('H', selection)))
+
+    return decoded
+
+
+def gamma_decode_list(encoded_list, nr_candidates, max_choices=None,
+                      absolute=True):
+    """
+    Decode encoded_list in order, each distinct value once.
+    Equal values share the same selection array.
+    """
+    selections = {}
+    for encoded, count, selection in gamma_decode_counts(
+            encoded_list, nr_candidates, max_choices, absolute=absolute):
+        if selection is None:
+            m = "Encoded value %d is out of range" % (encoded,)
+            raise ZeusError(m)
+        selections[encoded] = selection
+
+    return [selections[encoded] for encoded in encoded_list]
+
+
 def verify_gamma_encoding(n, completeness=1):
     choice_sets = {}
     encode_limit = get_offsets(n)[-1]
@@ -1100,23 +1391,16 @@ def gamma_decode_to_candidates(encoded, candidates):
 
 
 def gamma_count_candidates(encoded_list, candidates):
-    encoded_list = sorted(encoded_list)
-    iter_encoded_list = iter(encoded_list)
-    lastone = None
     counts = []
     append = counts.append
+    decoded = gamma_decode_counts(encoded_list, len(candidates))
+    decoded.sort(key=lambda d: d[0])
 
-    for lastone in iter_encoded_list:
-        count = 1
-        break
-
-    for encoded in chain(iter_encoded_list, [None]):
-        if encoded == lastone:
-            count += 1
-        else:
-            append([count] + gamma_decode_to_candidates(lastone, candidates))
-            count = 1
-            lastone = encoded
+    for encoded, count, selection in decoded:
+        if selection is None:
+            m = "Encoded value %d is out of range" % (encoded,)
+            raise ZeusError(m)
+        append([count] + [candidates[i] for i in selection])
 
     return counts
 
@@ -1198,6 +1482,10 @@ def gamma_decode_to_range_ballot(encoded, candidates_and_points):
     selection = gamma_decode(encoded, nr_candidates=nr_candidates,
                              max_choices=nr_candidates)
     permutation = to_absolute_answers(selection, nr_candidates)
+    return range_ballot(permutation, candidates_and_points)
+
+
+def range_ballot(permutation, candidates_and_points):
     ballot = {}
     counts = {}
     valid = False
@@ -1254,10 +1542,8 @@ def gamma_count_range(encoded_list, candidates_and_points, params):
     candidates, pointlist = range_split_candidates(candidates_and_points)
     detailed = {}
     totals = {}
-    ballots = []
 
     min_choices, max_choices = list(map(int, params.strip().split("-")))
-    max_encoded = gamma_encoding_max(len(candidates_and_points))
 
     for c in candidates:
         candidate_stats = {}
@@ -1266,13 +1552,15 @@ def gamma_count_range(encoded_list, candidates_and_points, params):
         detailed[c] = candidate_stats
         totals[c] = 0
 
-    for e in encoded_list:
+    decoded_ballots = {}
+    decoded = gamma_decode_counts(encoded_list, len(candidates_and_points))
+    for e, count, permutation in decoded:
         assert isinstance(e, int)
-        if e > max_encoded:
+        if permutation is None:
             ballot = {'valid': False}
         else:
-            ballot = gamma_decode_to_range_ballot(e, candidates_and_points)
-        ballots.append(ballot)
+            ballot = range_ballot(permutation, candidates_and_points)
+        decoded_ballots[e] = ballot
         if not ballot['valid']:
             continue
 
@@ -1287,8 +1575,10 @@ def gamma_count_range(encoded_list, candidates_and_points, params):
 
         for candidate, points in ballot_scores.items():
             assert candidate in candidates
-            totals[candidate] += points
-            detailed[candidate][points] += 1
+            totals[candidate] += points * count
+            detailed[candidate][points] += count
+
+    ballots = [decoded_ballots[e] for e in encoded_list]
 
     results = {}
     results['candidates'] = candidates
@@ -1389,6 +1679,12 @@ def gamma_decode_to_party_ballot(encoded, candidates, parties, nr_groups,
     nr_candidates = len(candidates)
     selection = gamma_decode(encoded, nr_candidates)
     choices = to_absolute_answers(selection, nr_candidates)
+    return party_ballot(choices, candidates, parties, nr_groups,
+                        separator=separator)
+
+
+def party_ballot(choices, candidates, parties, nr_groups,
+                 separator=PARTY_SEPARATOR):
     voted_candidates = []
     voted_parties = []
     voted_parties_counts = {}
@@ -1402,7 +1698,7 @@ def gamma_decode_to_party_ballot(encoded, candidates, parties, nr_groups,
         if i <= last_index or no_candidates_flag:
             valid = False
             invalid_reason = ("invalid index: %d <= %d -- choices: %s"
-                              % (i, last_index, choices))
+                              % (i, last_index, list(choices)))
             voted_candidates = None
             thegroup = None
             break
@@ -1502,21 +1798,27 @@ def gamma_count_parties(encoded_list, candidates, separator=PARTY_SEPARATOR):
                 continue
             candidate_counters[(party, candidate)] = 0
 
-    for encoded in encoded_list:
-        ballot = gamma_decode_to_party_ballot(encoded, candidates, parties,
-                                              nr_groups, separator=separator)
+    decoded_ballots = {}
+    for encoded, count, choices in gamma_decode_counts(encoded_list,
+                                                       len(candidates)):
+        if choices is None:
+            invalid_count += count
+            continue
+
+        ballot = party_ballot(choices, candidates, parties, nr_groups,
+                              separator=separator)
         if not ballot['valid']:
-            invalid_count += 1
+            invalid_count += count
             continue
 
-        append(ballot)
+        decoded_ballots[encoded] = ballot
 
         ballot_parties = ballot['parties']
         for party in ballot_parties:
             if party not in party_counters:
                 m = "Cannot find initialized counter at '%s'!" % (party)
                 raise AssertionError(m)
-            party_counters[party] += 1
+            party_counters[party] += count
 
         ballot_candidates = ballot['candidates']
         filtered_candidates = []
@@ -1531,12 +1833,16 @@ def gamma_count_parties(encoded_list, candidates, separator=PARTY_SEPARATOR):
                 continue
             else:
                 filtered_append((party, candidate))
-            candidate_counters[key] += 1
+            candidate_counters[key] += count
 
         ballot['candidates'] = filtered_candidates
 
         if not ballot_parties and not ballot_candidates:
-            blank_count += 1
+            blank_count += count
+
+    for encoded in encoded_list:
+        if encoded in decoded_ballots:
+            append(decoded_ballots[encoded])
 
     party_counts = [(-v, k) for k, v in party_counters.items()]
     party_counts.sort()
@@ -1604,23 +1910,56 @@ def bit_iterator(nr, infinite=True):
         yield 0
 
 
+def get_random_bytes(nr_bytes):
+    """
+    Return nr_bytes random bytes. Small reads are served from a block
+    read ahead from the generator, which is discarded in forked
+    children.
+    """
+    global _random_block, _random_offset
+    if nr_bytes >= RANDOM_BLOCK_SIZE:
+        return _random_generator_file.read(nr_bytes)
+
+    with _random_lock:
+        offset = _random_offset
+        end = offset + nr_bytes
+        if end > len(_random_block):
+            _random_block = _random_generator_file.read(RANDOM_BLOCK_SIZE)
+            offset = 0
+            end = nr_bytes
+        _random_offset = end
+        return _random_block[offset:end]
+
+
+def get_random_ints(count, minimum, ceiling):
+    """
+    Return count integers drawn uniformly from [minimum, ceiling).
+    Each is cut from one bulk read of random bytes with RANDOM_EXTRA_BITS
+    more bits than the range needs and reduced modulo the range, which
+    leaves a bias below 2**-RANDOM_EXTRA_BITS.
+    """
+    top = ceiling - minimum
+    if top <= 1:
+        return [minimum] * count
+
+    nr_bytes = (bit_length(top) + RANDOM_EXTRA_BITS - 1) // 8 + 1
+    strbin = get_random_bytes(count * nr_bytes)
+    from_bytes = int.from_bytes
+    return [from_bytes(strbin[i:i + nr_bytes], 'little') % top + minimum
+            for i in range(0, count * nr_bytes, nr_bytes)]
+
+
 def get_random_int(minimum, ceiling):
     top = ceiling - minimum
-    nr_bits = bit_length(top)
-    nr_bytes = (nr_bits - 1) // 8 + 1
-    strbin = _random_generator_file.read(nr_bytes)
-    num = strbin_to_int(strbin)
-    shift = bit_length(num) - nr_bits
-    if shift > 0:
-        num >>= shift
-    if num >= top:
-        num -= top
-    return num + minimum
+    if top <= 1:
+        return minimum
+    nr_bytes = (bit_length(top) + RANDOM_EXTRA_BITS - 1) // 8 + 1
+    return strbin_to_int(get_random_bytes(nr_bytes)) % top + minimum
 
 
 def get_random_element(modulus, generator, order):
     exponent = get_random_int(2, order)
-    element = pow(generator, exponent, modulus)
+    element = fixed_pow(generator, exponent, modulus)
     return element
 
 
@@ -1640,14 +1979,14 @@ def encrypt(message, modulus, generator, order, public, randomness=None):
     legendre = pow(message, order, modulus)
     if legendre != 1:
         message = -message % modulus
-    alpha = pow(generator, randomness, modulus)
-    beta = (message * pow(public, randomness, modulus)) % modulus
+    alpha = fixed_pow(generator, randomness, modulus)
+    beta = (message * fixed_pow(public, randomness, modulus)) % modulus
     return [alpha, beta, randomness]
 
 
 def decrypt_with_randomness(modulus, generator, order, public,
                             beta, secret):
-    encoded = pow(public, secret, modulus)
+    encoded = fixed_pow(public, secret, modulus)
     encoded = inverse(encoded, modulus)
     encoded = (encoded * beta) % modulus
     if encoded >= order:
@@ -1704,21 +2043,21 @@ def element_from_texts_hash(modulus, generator, order, *texts):
     num_hash = numbers_hash((modulus, generator, order))
     digest = texts_hash((num_hash,) + texts)
     number = strbin_to_int(digest) % order
-    element = pow(generator, number, modulus)
+    element = fixed_pow(generator, number, modulus)
     return element
 
 
 def element_from_elements_hash(modulus, generator, order, *elements):
     hexdigest = numbers_hash((modulus, generator, order) + elements)
     number = strbin_to_int(hexdigest.encode()) % order
-    element = pow(generator, number, modulus)
+    element = fixed_pow(generator, number, modulus)
     return element
 
 
 def prove_dlog_zeus(modulus, generator, order, power, dlog,
                     *extra_challenge_input):
     randomness = get_random_int(2, order)
-    commitment = pow(generator, randomness, modulus)
+    commitment = fixed_pow(generator, randomness, modulus)
     challenge = element_from_elements_hash(modulus, generator, order,
                                            power, commitment,
                                            *extra_challenge_input)
@@ -1734,7 +2073,7 @@ def verify_dlog_power_zeus(modulus, generator, order, power,
                                             *extra_challenge_input)
     if _challenge != challenge:
         return 0
-    return (pow(generator, response, modulus)
+    return (fixed_pow(generator, response, modulus)
             == ((commitment * pow(power, challenge, modulus)) % modulus))
 
 
@@ -1765,10 +2104,12 @@ def validate_public_key(modulus, generator, order, public_key,
 
 
 def prove_ddh_tuple_zeus(modulus, generator, order,
-                    message, base_power, message_power, exponent):
-    randomness = get_random_int(2, order)
+                    message, base_power, message_power, exponent,
+                    randomness=None):
+    if randomness is None:
+        randomness = get_random_int(2, order)
 
-    base_commitment = pow(generator, randomness, modulus)
+    base_commitment = fixed_pow(generator, randomness, modulus)
     message_commitment = pow(message, randomness, modulus)
 
     args = (modulus, generator, order, base_power, base_commitment,
@@ -1788,8 +2129,8 @@ def verify_ddh_tuple_zeus(modulus, generator, order,
     if _challenge != challenge:
         return 0
 
-    b = (base_commitment * pow(base_power, challenge, modulus)) % modulus
-    if b != pow(generator, response, modulus):
+    b = (base_commitment * fixed_pow(base_power, challenge, modulus)) % modulus
+    if b != fixed_pow(generator, response, modulus):
         return 0
 
     m = (message_commitment * pow(message_power, challenge, modulus)) % modulus
@@ -1822,7 +2163,7 @@ def sign_element(element, modulus, generator, order, key):
     """Compute ElGamal signature"""
     while 1:
         w = 2 * get_random_int(3, order) - 1
-        r = pow(generator, w, modulus)
+        r = fixed_pow(generator, w, modulus)
         modulus1 = modulus - 1
         w = inverse(w, modulus1)
         s = (w * ((element - (r*key) % modulus1))) % modulus1
@@ -1849,8 +2190,8 @@ def verify_element_signature(signature, modulus, generator, order, public):
     if r <= 0 or r >= modulus:
         return 0
 
-    x0 = (pow(public, r, modulus) * pow(r, s, modulus)) % modulus
-    x1 = pow(generator, e, modulus)
+    x0 = (fixed_pow(public, r, modulus) * pow(r, s, modulus)) % modulus
+    x1 = fixed_pow(generator, e, modulus)
     if x0 != x1:
         return 0
 
@@ -1873,6 +2214,27 @@ def verify_text_signature(signature, modulus, generator, order, public):
                                     modulus, generator, order, public)
 
 
+def verify_vote_encryption(encrypted_ballot):
+    """
+    Verify the encryption proof of a submitted encrypted ballot.
+    Return the vote fingerprint if the proof is valid, else None.
+    """
+    eb = encrypted_ballot
+    modulus = eb['modulus']
+    generator = eb['generator']
+    order = eb['order']
+    alpha = eb['alpha']
+    beta = eb['beta']
+    commitment = eb['commitment']
+    challenge = eb['challenge']
+    response = eb['response']
+    if not verify_encryption(modulus, generator, order, alpha, beta,
+                             commitment, challenge, response):
+        return None
+    return numbers_hash((modulus, generator, alpha, beta,
+                         commitment, challenge, response))
+
+
 def encode_selection(selection, nr_candidates=None):
     if nr_candidates is None:
         nr_candidates = len(selection)
@@ -1911,8 +2273,19 @@ def vote_from_encoded(modulus, generator, order, public,
     return vote
 
 
+def vote_signature_header(trustees, candidates,
+                          modulus, generator, order, public):
+    m05 = (V_ZEUS_PUBLIC + "%x") % public
+    m06 = (V_TRUSTEES + "%s") % (' '.join(("%x" % t) for t in trustees),)
+    m07 = (V_CANDIDATES + "%s") % (' % '.join(("%s" % c) for c in candidates),)
+    m08 = (V_MODULUS + "%x") % modulus
+    m09 = (V_GENERATOR + "%x") % generator
+    m10 = (V_ORDER + "%x") % order
+    return '\n'.join((m05, m06, m07, m08, m09, m10))
+
+
 def sign_vote(vote, trustees, candidates, comments,
-              modulus, generator, order, public, secret):
+              modulus, generator, order, public, secret, header=None):
     eb = vote['encrypted_ballot']
     election = eb['public']
     fingerprint = vote['fingerprint']
@@ -1920,25 +2293,23 @@ def sign_vote(vote, trustees, candidates, comments,
     index = vote['index']
     status = vote['status']
 
+    if header is None:
+        header = vote_signature_header(trustees, candidates,
+                                       modulus, generator, order, public)
+
     m00 = status
     m01 = (V_FINGERPRINT + "%s") % fingerprint
     m02 = (V_INDEX + "%s") % (("%d" % index) if index is not None else 'NONE')
     m03 = (V_PREVIOUS + "%s") % (previous_vote,)
     m04 = (V_ELECTION + "%x") % election
-    m05 = (V_ZEUS_PUBLIC + "%x") % public
-    m06 = (V_TRUSTEES + "%s") % (' '.join(("%x" % t) for t in trustees),)
-    m07 = (V_CANDIDATES + "%s") % (' % '.join(("%s" % c) for c in candidates),)
-    m08 = (V_MODULUS + "%x") % modulus
-    m09 = (V_GENERATOR + "%x") % generator
-    m10 = (V_ORDER + "%x") % order
     m11 = (V_ALPHA + "%x") % eb['alpha']
     m12 = (V_BETA + "%x") % eb['beta']
     m13 = (V_COMMITMENT + "%x") % eb['commitment']
     m14 = (V_CHALLENGE + "%x") % eb['challenge']
     m15 = (V_RESPONSE + "%x") % eb['response']
     m16 = (V_COMMENTS + "%s") % (comments,)
-    message = '\n'.join((m00, m01, m02, m03, m04, m05, m06, m07,
-                         m08, m09, m10, m11, m12, m13, m14, m15, m16))
+    message = '\n'.join((m00, m01, m02, m03, m04, header,
+                         m11, m12, m13, m14, m15, m16))
     signature = sign_text_message(message, modulus, generator, order, secret)
     text = signature['m']
     text += '\n-----------------\n'
@@ -1946,7 +2317,66 @@ def sign_vote(vote, trustees, candidates, comments,
     return text
 
 
-def verify_vote_signature(vote_signature):
+class VoteSigningContext(object):
+    """
+    Key material and pre-rendered signature message lines for signing
+    and checking the votes of one election. Treat it as read-only.
+    """
+
+    def __init__(self, modulus, generator, order, election_public,
+                 zeus_public, zeus_secret, trustees, candidates):
+        self.crypto = [modulus, generator, order]
+        self.election_public = election_public
+        self.zeus_public = zeus_public
+        self.zeus_secret = zeus_secret
+        self.trustees = tuple(sorted(trustees))
+        self.candidates = tuple(candidates)
+        self.header = None
+        if zeus_public is not None:
+            self.header = vote_signature_header(self.trustees,
+                                                self.candidates,
+                                                modulus, generator, order,
+                                                zeus_public)
+
+    def matches(self, election_public, candidates):
+        return (self.election_public == election_public and
+                self.candidates == tuple(candidates))
+
+    def without_secret(self):
+        """
+        Return a copy that can check but not sign votes.
+        """
+        modulus, generator, order = self.crypto
+        return VoteSigningContext(modulus, generator, order,
+                                  self.election_public, self.zeus_public,
+                                  None, self.trustees, self.candidates)
+
+    def sign_vote(self, vote, comments):
+        modulus, generator, order = self.crypto
+        return sign_vote(vote, self.trustees, self.candidates, comments,
+                         modulus, generator, order,
+                         self.zeus_public, self.zeus_secret,
+                         header=self.header)
+
+    def check_vote_info(self, vote_info):
+        vote, vote_crypto, vote_trustees, vote_candidates, comments = vote_info
+        eb = vote['encrypted_ballot']
+        if self.crypto != vote_crypto:
+            m = "Cannot verify vote signature: Cryptosystem mismatch!"
+            raise ZeusError(m)
+        if self.election_public != eb['public']:
+            m = "Cannot verify vote signature: Election public mismatch!"
+            raise ZeusError(m)
+        if set(self.trustees) != set(vote_trustees):
+            m = "Vote signature: trustees mismatch!"
+            raise AssertionError(m)
+        if self.candidates != tuple(vote_candidates):
+            m = "Vote signature: candidates mismatch!"
+            raise AssertionError(m)
+        return vote
+
+
+def verify_vote_signature(vote_signature, verify_proof=True):
     message, sep, e, r, s, null = vote_signature.rsplit('\n', 5)
     e = int(e, 16)
     r = int(r, 16)
@@ -2010,7 +2440,7 @@ def verify_vote_signature(vote_signature):
         m = "Invalid vote signature!"
         raise ZeusError(m)
 
-    if (index is not None and
+    if (verify_proof and index is not None and
         not verify_encryption(modulus, generator, order, alpha, beta,
                               commitment, challenge, response)):
         m = "Invalid vote encryption proof in valid signature!"
@@ -2034,6 +2464,26 @@ def verify_vote_signature(vote_signature):
     return vote, crypto, trustees, candidates, comments
 
 
+def verify_vote_signatures(context, signatures):
+    """
+    Verify vote signatures and check them against the signing context.
+    Return, in order, the signed vote of each valid signature and the
+    exception raised for each invalid one.
+    """
+    results = []
+    append = results.append
+    for signature in signatures:
+        try:
+            append(context.check_vote_info(verify_vote_signature(signature)))
+        except Exception as e:
+            append(e)
+    return results
+
+
+def _verify_vote_signatures(data):
+    return verify_vote_signatures(*data)
+
+
 def to_relative_answers(choices, nr_candidates):
     """
     Answer choices helper, convert absolute indexed answers to relative.
@@ -2084,22 +2534,25 @@ def compute_decryption_factors1(modulus, generator, order, secret, ciphers,
     public = pow(generator, secret, modulus)
     append = factors.append
     nr_ciphers = len(ciphers)
+    randoms = get_random_ints(nr_ciphers, 2, order)
     with teller.task("Computing decryption factors", total=nr_ciphers):
-        for alpha, beta in ciphers:
+        for (alpha, beta), randomness in zip(ciphers, randoms):
             factor = pow(alpha, secret, modulus)
             proof = prove_ddh_tuple(modulus, generator, order,
-                                    alpha, public, factor, secret)
+                                    alpha, public, factor, secret,
+                                    randomness=randomness)
             append([factor, proof])
             teller.advance()
     return factors
 
 
 def _compute_decryption_factor(data):
-    modulus, generator, order, secret, public, cipher = data
+    modulus, generator, order, secret, public, cipher, randomness = data
     alpha, beta = cipher
     factor = pow(alpha, secret, modulus)
     proof = prove_ddh_tuple(modulus, generator, order,
-                            alpha, public, factor, secret)
+                            alpha, public, factor, secret,
+                            randomness=randomness)
     return [factor, proof]
 
 
@@ -2118,9 +2571,11 @@ def compute_decryption_factors(modulus, generator, order, secret, ciphers,
     if not d:
         d = nr_ciphers
     factors = []
+    randoms = get_random_ints(nr_ciphers, 2, order)
     with teller.task("Computing decryption factors", total=nr_ciphers):
         args = [
-            (modulus, generator, order, secret, public, ciphers[i])
+            (modulus, generator, order, secret, public, ciphers[i],
+             randoms[i])
             for i in range(nr_ciphers)
         ]
         for r in executor.map(_compute_decryption_factor, args, chunksize=d):
@@ -2156,9 +2611,139 @@ def _verify_decryption_factor(data):
                             factor, *proof)
 
 
+def _batch_check_decryption_factors(modulus, generator, order, public,
+                                    ciphers, factors):
+    # Every factor proof asserts two equalities,
+    #   base_commitment * public^challenge == generator^response
+    #   message_commitment * factor^challenge == alpha^response
+    # Raise both sides of each to a small random exponent and compare the
+    # products instead. The Jacobi symbol checks confine all elements to
+    # the prime order subgroup, where a single wrong proof survives with
+    # probability 1/BATCH_EXPONENT_CEIL.
+    p = modulus
+    if jacobi(generator, p) != 1 or jacobi(public, p) != 1:
+        return False
+
+    randoms = []
+    base_commitments = []
+    message_commitments = []
+    factor_powers = []
+    factor_exponents = []
+    alphas = []
+    alpha_exponents = []
+    public_exponent = 0
+    generator_exponent = 0
+    batch_exponents = iter(get_random_ints(len(factors), 1,
+                                           BATCH_EXPONENT_CEIL))
+
+    for cipher, factor in zip(ciphers, factors):
+        alpha, beta = cipher
+        factor, proof = factor
+        base_commitment, message_commitment, challenge, response = proof
+        for element in (alpha, factor, base_commitment, message_commitment):
+            if not 0 < element < p or jacobi(element, p) != 1:
+                return False
+
+        _challenge = element_from_elements_hash(p, generator, order,
+                                                public, base_commitment,
+                                                alpha, factor,
+                                                message_commitment)
+        if _challenge != challenge:
+            return False
+
+        r = next(batch_exponents)
+        randoms.append(r)
+        base_commitments.append(base_commitment)
+        message_commitments.append(message_commitment)
+        factor_powers.append(factor)
+        factor_exponents.append((r * challenge) % (p - 1))
+        alphas.append(alpha)
+        alpha_exponents.append((r * response) % (p - 1))
+        public_exponent += r * challenge
+        generator_exponent += r * response
+
+    left = multi_pow(base_commitments, randoms, p)
+    left = (left * fixed_pow(public, public_exponent % (p - 1), p)) % p
+    right = fixed_pow(generator, generator_exponent % (p - 1), p)
+    if left != right:
+        return False
+
+    left = multi_pow(message_commitments, randoms, p)
+    left = (left * multi_pow(factor_powers, factor_exponents, p)) % p
+    right = multi_pow(alphas, alpha_exponents, p)
+    return left == right
+
+
+def batch_verify_decryption_factors1(modulus, generator, order, public,
+                                     ciphers, factors):
+    try:
+        verified = _batch_check_decryption_factors(modulus, generator, order,
+                                                   public, ciphers, factors)
+    except (TypeError, ValueError):
+        verified = False
+
+    if verified:
+        return 1
+
+    # Fall back to checking each proof on its own, so that the outcome is
+    # exactly that of verify_decryption_factors1.
+    for cipher, factor in zip(ciphers, factors):
+        alpha, beta = cipher
+        factor, proof = factor
+        if not verify_ddh_tuple(modulus, generator, order, alpha, public,
+                                factor, *proof):
+            return 0
+    return 1
+
+
+def _batch_verify_decryption_factors(data):
+    return batch_verify_decryption_factors1(*data)
+
+
+def batch_verify_decryption_factors(modulus, generator, order, public,
+                                    ciphers, factors, teller=_teller,
+                                    nr_parallel=1):
+    nr_ciphers = len(ciphers)
+    if nr_ciphers != len(factors):
+        return 0
+
+    with teller.task("Verifying decryption factors", total=nr_ciphers):
+        if nr_parallel <= 0:
+            if not batch_verify_decryption_factors1(modulus, generator,
+                                                    order, public,
+                                                    ciphers, factors):
+                teller.fail()
+                return 0
+            teller.advance(nr_ciphers)
+            return 1
+
+        executor = get_reusable_executor(max_workers=nr_parallel,
+                                         initializer=Random.atfork)
+        d = -(-nr_ciphers // nr_parallel) or 1
+        args = [
+            (modulus, generator, order, public,
+             ciphers[i:i + d], factors[i:i + d])
+            for i in range(0, nr_ciphers, d)
+        ]
+        results = executor.map(_batch_verify_decryption_factors, args)
+        for chunk, r in zip(args, results):
+            if not r:
+                teller.fail()
+                return 0
+            teller.advance(len(chunk[4]))
+
+    return 1
+
+
 def verify_decryption_factors(modulus, generator, order, public,
                               ciphers, factors, teller=_teller,
-                              nr_parallel=1):
+                              nr_parallel=1, batch=False):
+    if batch:
+        return batch_verify_decryption_factors(modulus, generator, order,
+                                               public, ciphers, factors,
+                                               teller=teller,
+                                               nr_parallel=nr_parallel)
+
     if nr_parallel <= 0:
         return verify_decryption_factors1(modulus, generator, order, public,
                                           ciphers, factors, teller=teller)
@@ -2198,6 +2783,25 @@ def combine_decryption_factors(modulus, factor_collection):
     return master_factors
 
 
+def mix_payload(mix):
+    """
+    Return what verifying the proof of mix checks, for the verification
+    ledger.
+    """
+    return {key: mix[key] for key in MIX_KEYS if key in mix}
+
+
+def factors_payload(cryptosystem, public, ciphers, factors):
+    """
+    Return what verifying decryption factors checks, for the
+    verification ledger.
+    """
+    modulus, generator, order = cryptosystem
+    return {'modulus': modulus, 'generator': generator, 'order': order,
+            'public': public, 'ciphers': ciphers,
+            'decryption_factors': factors}
+
+
 class ZeusCoreElection(object):
     stage = 'UNINITIALIZED'
 
@@ -2242,6 +2846,7 @@ class ZeusCoreElection(object):
         self.zeus_key_proof = None
         self.trustees = {}
         self.election_public = None
+        self.verified = set()
 
     def do_store_cryptosystem(self, modulus, generator, order):
         self.cryptosys = [modulus, generator, order]
@@ -2342,6 +2947,13 @@ class ZeusCoreElection(object):
         self.audit_requests = {}
         self.audit_publications = []
         self.excluded_voters = {}
+        self.signing_context = None
+
+    def do_store_signing_context(self, context):
+        self.signing_context = context
+
+    def do_get_signing_context(self):
+        return self.signing_context
 
     def do_store_audit_publication(self, fingerprint):
         self.audit_publications.append(fingerprint)
@@ -2370,6 +2982,13 @@ class ZeusCoreElection(object):
     def do_get_vote(self, fingerprint):
         return self.votes.get(fingerprint, None)
 
+    def do_has_vote(self, fingerprint):
+        return fingerprint in self.votes
+
+    def do_get_votes_by_fingerprint(self, fingerprints):
+        votes = self.votes
+        return dict((f, votes[f]) for f in fingerprints if f in votes)
+
     def do_get_votes(self):
         return dict(self.votes)
 
@@ -2403,6 +3022,19 @@ class ZeusCoreElection(object):
     def do_get_all_cast_votes(self):
         return dict(self.cast_votes)
 
+    def do_get_cast_context(self, voter_key, fingerprint):
+        """
+        Return what casting a vote needs to know about its voter and
+        fingerprint: the voter, their audit codes and cast votes, the
+        voter of an audit request for the fingerprint and whether a vote
+        with the fingerprint is already stored.
+        """
+        return {'voter': self.do_get_voter(voter_key),
+                'audit_codes': self.do_get_voter_audit_codes(voter_key),
+                'cast_votes': self.do_get_cast_votes(voter_key),
+                'audit_request': self.do_get_audit_request(fingerprint),
+                'vote_stored': self.do_has_vote(fingerprint)}
+
     def do_store_excluded_voter(self, voter_key, reason):
         self.excluded_voters[voter_key] = reason
 
@@ -2422,10 +3054,18 @@ class ZeusCoreElection(object):
 
     def do_init_mixing(self):
         self.mixes = []
+        self.mix_digests = {}
 
     def do_store_mix(self, mix):
         self.mixes.append(mix)
 
+    def do_store_mix_digest(self, digest):
+        # the ledger digest of the mix stored last
+        self.mix_digests[len(self.mixes) - 1] = digest
+
+    def do_get_mix_digests(self):
+        return [self.mix_digests.get(i) for i in range(len(self.mixes))]
+
     def do_get_last_mix(self):
         mixes = self.mixes
         if not mixes:
@@ -2435,6 +3075,10 @@ class ZeusCoreElection(object):
     def do_get_all_mixes(self):
         return list(self.mixes)
 
+    def do_iter_mixes(self):
+        # the mixes after the votes for mixing, as exported
+        return iter(self.mixes[1:])
+
     ### DECRYPTING BACKEND API ###
 
     def do_init_decrypting(self):
@@ -2466,6 +3110,14 @@ class ZeusCoreElection(object):
     def do_get_results(self):
         return self.results
 
+    ### VERIFICATION LEDGER BACKEND API ###
+
+    def do_get_verified(self, kind, digest, version):
+        return (kind, digest, version) in self.verified
+
+    def do_store_verified(self, kind, digest, version):
+        self.verified.add((kind, digest, version))
+
     ### GENERIC IMPLEMENTATION ###
 
     def set_option(self, **kw):
@@ -2475,6 +3127,26 @@ class ZeusCoreElection(object):
     def get_option(self, name):
         return self.do_get_option(name)
 
+    def get_verification(self, kind, payload):
+        """
+        Look payload up in the verification ledger, if the ledger is
+        enabled by the verification_ledger option. Return its digest,
+        None without a ledger, and whether it has already been verified.
+        """
+        if not self.get_option('verification_ledger'):
+            return None, False
+        digest = canonical_digest(payload)
+        return digest, self.is_verified(kind, digest)
+
+    def is_verified(self, kind, digest):
+        if digest is None or not self.get_option('verification_ledger'):
+            return False
+        return self.do_get_verified(kind, digest, VERIFIER_VERSION)
+
+    def set_verified(self, kind, digest):
+        if digest is not None and self.get_option('verification_ledger'):
+            self.do_store_verified(kind, digest, VERIFIER_VERSION)
+
     def init_creating(self, cryptosystem):
         modulus, generator, order = cryptosystem
         self.do_store_cryptosystem(modulus, generator, order)
@@ -2709,7 +3381,16 @@ class ZeusCoreElection(object):
         self.do_set_stage('VOTING')
         return self
 
-    def validate_submitted_vote(self, vote):
+    def verify_vote_proof(self, vote):
+        """
+        Verify the encryption proof of a submitted vote ahead of casting.
+        Return the fingerprint of a valid vote, else None.
+        Casting the vote with that fingerprint skips the proof check.
+        """
+        return verify_vote_encryption(vote['encrypted_ballot'])
+
+    def validate_submitted_vote(self, vote, vote_stored=None,
+                                verified_fingerprint=None):
         keys = set(('voter', 'encrypted_ballot', 'fingerprint',
                     'audit_code', 'voter_secret'))
         nr_keys = len(keys)
@@ -2760,58 +3441,59 @@ class ZeusCoreElection(object):
         response = eb['response']
 
         modulus, generator, order = crypto
-        if not verify_encryption(modulus, generator, order, alpha, beta,
-                                 commitment, challenge, response):
+        fingerprint = numbers_hash((modulus, generator, alpha, beta,
+                                    commitment, challenge, response))
+        if (fingerprint != verified_fingerprint and
+                not verify_encryption(modulus, generator, order, alpha, beta,
+                                      commitment, challenge, response)):
             m = "Invalid vote encryption proof!"
             raise ZeusError(m)
 
-        fingerprint = numbers_hash((modulus, generator, alpha, beta,
-                                    commitment, challenge, response))
         if fingerprint != vote['fingerprint']:
             m = "Invalid vote fingerprint!"
             raise ZeusError(m)
 
-        stored = self.do_get_vote(fingerprint)
-        if stored is not None:
+        if vote_stored is None:
+            vote_stored = self.do_has_vote(fingerprint)
+        if vote_stored:
             m = "Vote has already been cast!"
             raise ZeusError(m)
 
         return vote
 
-    def sign_vote(self, vote, comments):
-        modulus, generator, order = self.do_get_cryptosystem()
+    def get_signing_context(self):
+        election_public = self.do_get_election_public()
         candidates = self.do_get_candidates()
-        public = self.do_get_zeus_public()
-        secret = self.do_get_zeus_secret()
-        trustees = list(self.do_get_trustees())
-        trustees.sort()
-        signature = sign_vote(vote, trustees, candidates, comments,
-                              modulus, generator, order, public, secret)
-        self.verify_vote_signature(signature)
+        context = self.do_get_signing_context()
+        if context is not None and context.matches(election_public,
+                                                   candidates):
+            return context
+
+        modulus, generator, order = self.do_get_cryptosystem()
+        context = VoteSigningContext(modulus, generator, order,
+                                     election_public,
+                                     self.do_get_zeus_public(),
+                                     self.do_get_zeus_secret(),
+                                     self.do_get_trustees(),
+                                     candidates)
+        self.do_store_signing_context(context)
+        return context
+
+    def sign_vote(self, vote, comments):
+        context = self.get_signing_context()
+        signature = context.sign_vote(vote, comments)
+        # the vote proof has been verified before signing
+        self.verify_vote_signature(signature, context=context,
+                                   verify_proof=False)
         return signature
 
-    def verify_vote_signature(self, vote_signature):
-        vote_info = verify_vote_signature(vote_signature)
-        vote, vote_crypto, vote_trustees, vote_candidates, comments = vote_info
-        trustees = list(self.do_get_trustees())
-        trustees.sort()
-        crypto = self.do_get_cryptosystem()
-        public = self.do_get_election_public()
-        eb = vote['encrypted_ballot']
-        if crypto != vote_crypto:
-            m = "Cannot verify vote signature: Cryptosystem mismatch!"
-            raise ZeusError(m)
-        if public != eb['public']:
-            m = "Cannot verify vote signature: Election public mismatch!"
-            raise ZeusError(m)
-        if set(trustees) != set(vote_trustees):
-            m = "Vote signature: trustees mismatch!"
-            raise AssertionError(m)
-        candidates = self.do_get_candidates()
-        if candidates != vote_candidates:
-            m = "Vote signature: candidates mismatch!"
-            raise AssertionError(m)
-        return vote
+    def verify_vote_signature(self, vote_signature, context=None,
+                              verify_proof=True):
+        vote_info = verify_vote_signature(vote_signature,
+                                          verify_proof=verify_proof)
+        if context is None:
+            context = self.get_signing_context()
+        return context.check_vote_info(vote_info)
 
     def validate_vote(self, signed_vote):
         election = signed_vote['encrypted_ballot']['public']
@@ -2823,8 +3505,7 @@ class ZeusCoreElection(object):
             m = "Election mismatch in vote!"
             raise ZeusError(m)
 
-        stored = self.do_get_vote(fingerprint)
-        if not stored:
+        if not self.do_has_vote(fingerprint):
             m = "Cannot find verified vote [%s] in store!" % (fingerprint,)
             raise AssertionError(m)
 
@@ -2837,24 +3518,62 @@ class ZeusCoreElection(object):
                      % (fingerprint, index, index, indexed_fingerprint))
                 raise AssertionError(m)
 
-        if previous and self.do_get_vote(previous) is None:
+        if previous and not self.do_has_vote(previous):
             m = "Cannot find valid previous vote [%s] in store!" % (previous,)
             raise AssertionError(m)
 
-    def verify_vote(self, vote):
+    def verify_vote(self, vote, signed_votes=None):
         if 'signature' not in vote:
             m = "No signature found in vote!"
             raise ZeusError(m)
-        signature = vote['signature']
-        signed_vote = self.verify_vote_signature(signature)
+        signed_vote = None
+        if signed_votes is not None:
+            signed_vote = signed_votes.get(vote['fingerprint'])
+        if signed_vote is None:
+            signature = vote['signature']
+            signed_vote = self.verify_vote_signature(signature)
+        elif isinstance(signed_vote, Exception):
+            raise signed_vote
         return self.validate_vote(signed_vote)
 
-    def cast_vote(self, vote):
+    def verify_vote_signatures(self, votes):
+        """
+        Verify the signatures of votes in a pool of nr_parallel processes.
+        Return a dict from vote fingerprint to its signed vote, or to the
+        exception verifying its signature raised, for verify_vote.
+        Without nr_parallel, return an empty dict and leave verification
+        to verify_vote.
+        """
+        nr_parallel = self.get_option('nr_parallel') or 0
+        votes = [vote for vote in votes if 'signature' in vote]
+        nr_votes = len(votes)
+        if nr_parallel <= 0 or not nr_votes:
+            return {}
+
+        context = self.get_signing_context().without_secret()
+        executor = get_signatures_executor(nr_parallel)
+        d = -(-nr_votes // nr_parallel) or 1
+        chunks = [votes[i:i + d] for i in range(0, nr_votes, d)]
+        args = [(context, [vote['signature'] for vote in chunk])
+                for chunk in chunks]
+
+        signed_votes = {}
+        teller = self.teller
+        with teller.task("Verifying vote signatures", total=nr_votes):
+            results = executor.map(_verify_vote_signatures, args)
+            for chunk, signed in zip(chunks, results):
+                for vote, signed_vote in zip(chunk, signed):
+                    signed_votes[vote['fingerprint']] = signed_vote
+                teller.advance(len(chunk))
+        return signed_votes
+
+    def cast_vote(self, vote, verified_fingerprint=None):
         self.do_assert_stage('VOTING')
         fingerprint = vote['fingerprint']
         voter_key = vote['voter']
-        voter = self.do_get_voter(voter_key)
-        audit_codes = self.do_get_voter_audit_codes(voter_key)
+        cast_context = self.do_get_cast_context(voter_key, fingerprint)
+        voter = cast_context['voter']
+        audit_codes = cast_context['audit_codes']
         if not voter and not audit_codes:
             m = "Invalid voter key!"
             raise ZeusError(m)
@@ -2863,7 +3582,7 @@ class ZeusCoreElection(object):
             m = "Voter audit_code inconsistency! Invalid Election."
             raise AssertionError(m)
 
-        audit_request = self.do_get_audit_request(fingerprint)
+        audit_request = cast_context['audit_request']
         voter_secret = vote['voter_secret'] if 'voter_secret' in vote else None
         voter_audit_code = vote['audit_code'] if 'audit_code' in vote else None
 
@@ -2922,11 +3641,12 @@ class ZeusCoreElection(object):
             return signature
 
         # This is a genuine vote submission
-        if self.do_get_vote(fingerprint):
+        vote_stored = cast_context['vote_stored']
+        if vote_stored:
             m = "Vote [%s] already cast!" % (fingerprint,)
             raise ZeusError(m)
 
-        cast_votes = self.do_get_cast_votes(voter_key)
+        cast_votes = cast_context['cast_votes']
         vote_limit = self.get_option('vote_limit')
         if vote_limit and len(cast_votes) >= vote_limit:
             m = "Maximum allowed number of votes reached: %d" % vote_limit
@@ -2937,7 +3657,9 @@ class ZeusCoreElection(object):
         else:
             previous_fingerprint = cast_votes[-1]
 
-        vote = self.validate_submitted_vote(vote)
+        vote = self.validate_submitted_vote(
+            vote, vote_stored=vote_stored,
+            verified_fingerprint=verified_fingerprint)
 
         vote['previous'] = previous_fingerprint
         vote['status'] = V_CAST_VOTE
@@ -2955,8 +3677,8 @@ class ZeusCoreElection(object):
         teller = self.teller
         if not votes:
             audit_reqs = self.do_get_audit_requests()
-            get_vote = self.do_get_vote
-            votes = [dict(get_vote(f)) for f in audit_reqs]
+            stored = self.do_get_votes_by_fingerprint(audit_reqs)
+            votes = [dict(stored[f]) for f in audit_reqs]
             add_plaintext = 0
         else:
             add_plaintext = 1
@@ -2990,7 +3712,7 @@ class ZeusCoreElection(object):
                     teller.advance()
                     continue
 
-                alpha = pow(generator, voter_secret, modulus)
+                alpha = fixed_pow(generator, voter_secret, modulus)
                 if alpha != eb['alpha']:
                     failed.append(vote)
                     m = "[%s] ciphertext mismatch: wrong key"
@@ -3025,6 +3747,7 @@ class ZeusCoreElection(object):
         all_cast_votes = self.do_get_all_cast_votes()
         all_votes = self.do_get_votes()
         nr_votes = len(all_votes)
+        signed_votes = self.verify_vote_signatures(all_votes.values())
         with teller.task("Validating cast votes", total=nr_votes):
             for voter_key, cast_votes in all_cast_votes.items():
                 previous = ''
@@ -3039,7 +3762,7 @@ class ZeusCoreElection(object):
                         m = ("Vote %s/[%s] previous '%s' != '%s'"
                             % (voter_key, cast_vote, vote_previous, previous))
                         raise AssertionError(m)
-                    self.verify_vote(vote)
+                    self.verify_vote(vote, signed_votes)
                     del all_votes[cast_vote]
                     teller.advance()
                     previous = cast_vote
@@ -3053,7 +3776,7 @@ class ZeusCoreElection(object):
                     m = "Audit vote [%s] not found in vote archive!" % (audit_vote,)
                     raise AssertionError(m)
                 vote = all_votes[audit_vote]
-                self.verify_vote(vote)
+                self.verify_vote(vote, signed_votes)
                 msg = vote['signature']
                 if msg.startswith(V_PUBLIC_AUDIT):
                     if vote['fingerprint'] not in all_audit_requests:
@@ -3074,7 +3797,7 @@ class ZeusCoreElection(object):
                         % (voter_key, audit_request))
                     raise AssertionError(m)
                 vote = all_votes[audit_request]
-                self.verify_vote(vote)
+                self.verify_vote(vote, signed_votes)
                 del all_votes[audit_request]
                 teller.advance()
 
@@ -3115,7 +3838,8 @@ class ZeusCoreElection(object):
         nr_votes = len(vote_index)
         scratch = list([None]) * nr_votes
         counted = list([None]) * nr_votes
-        do_get_vote = self.do_get_vote
+        votes = self.do_get_votes_by_fingerprint(vote_index)
+        voters = self.do_get_voters()
         vote_count = 0
         excluded_voters = self.do_get_excluded_voters()
         excluded_votes = set()
@@ -3124,7 +3848,7 @@ class ZeusCoreElection(object):
             update(self.do_get_cast_votes(voter_key))
 
         for i, fingerprint in enumerate(vote_index):
-            vote = dict(do_get_vote(fingerprint))
+            vote = votes[fingerprint]
             index = vote['index']
             if i != index:
                 m = "Index mismatch %d != %d. Corrupt index!" % (i, index)
@@ -3134,7 +3858,7 @@ class ZeusCoreElection(object):
                 continue
 
             voter_key = vote['voter']
-            voter_name, voter_weight = self.do_get_voter(voter_key)
+            voter_name, voter_weight = voters[voter_key]
             eb = vote['encrypted_ballot']
             _vote = [eb['alpha'], eb['beta'], voter_weight]
             scratch[i] = _vote
@@ -3144,7 +3868,10 @@ class ZeusCoreElection(object):
                 vote_count += 1
                 continue
 
-            previous_vote = dict(do_get_vote(previous))
+            if previous not in votes:
+                m = "Inconsistent index!"
+                raise AssertionError(m)
+            previous_vote = votes[previous]
             previous_index = previous_vote['index']
             if previous_index >= index or scratch[previous_index] is None:
                 m = "Inconsistent index!"
@@ -3230,7 +3957,6 @@ class ZeusCoreElection(object):
         return last_mix
 
     def validate_mix(self, mix):
-        teller = self.teller
         nr_parallel = self.get_option('nr_parallel')
         if nr_parallel is None:
             nr_parallel = 2
@@ -3260,15 +3986,37 @@ class ZeusCoreElection(object):
             m = "Invalid mix: not a mix of latest ciphers!"
             raise ZeusError(m)
 
-        if not self.shuffle_module.verify_cipher_mix(
-                mix, teller=teller, nr_parallel=nr_parallel):
+        # hashed once here, backends store the digest with the mix
+        digest, verified = self.get_verification('mix', mix_payload(mix))
+        if verified:
+            return digest
+
+        if not self.verify_cipher_mix(mix, nr_parallel):
             m = "Invalid mix: proof verification failed!"
             raise ZeusError(m)
+        self.set_verified('mix', digest)
+        return digest
+
+    def verify_cipher_mix(self, mix, nr_parallel):
+        kw = {}
+        if self.get_option('batch_verify'):
+            # only passed when enabled, custom shuffle modules may not
+            # support batch verification
+            kw['batch'] = True
+        return self.shuffle_module.verify_cipher_mix(
+            mix, teller=self.teller, nr_parallel=nr_parallel, **kw)
 
     def add_mix(self, mix):
+        """
+        Validate and store mix. Return its verification ledger digest,
+        None without a ledger.
+        """
         self.do_assert_stage('MIXING')
-        self.validate_mix(mix)
+        digest = self.validate_mix(mix)
         self.do_store_mix(mix)
+        if digest is not None:
+            self.do_store_mix_digest(digest)
+        return digest
 
     def validate_mixing(self):
         teller = self.teller
@@ -3280,6 +4028,7 @@ class ZeusCoreElection(object):
         crypto = self.do_get_cryptosystem()
         previous = None
         mixes = self.do_get_all_mixes()
+        digests = self.do_get_mix_digests()
         min_mixes = self.get_option('min_mixes') or 1
         nr_mixes = len(mixes) - 1
         if nr_mixes < min_mixes:
@@ -3300,50 +4049,55 @@ class ZeusCoreElection(object):
                             % (i+1, nr_mixes))
                         raise AssertionError(m)
 
-                    if not self.shuffle_module.verify_cipher_mix(
-                            mix, teller=teller, nr_parallel=nr_parallel):
-                        m = "Invalid mix proof"
-                        raise AssertionError(m)
+                    # only mixes validated when added have a digest
+                    digest = digests[i]
+                    if not self.is_verified('mix', digest):
+                        if not self.verify_cipher_mix(mix, nr_parallel):
+                            m = "Invalid mix proof"
+                            raise AssertionError(m)
+                        self.set_verified('mix', digest)
 
                     teller.advance()
                 else:
-                    t = self.extract_votes_for_mixing()
-                    votes_for_mixing, counted_list = t
-                    original_ciphers = mix['original_ciphers']
-                    if len(original_ciphers) != len(counted_list):
-                        m = "Invalid extraction for mixing!"
-                        raise AssertionError(m)
-                    if original_ciphers != votes_for_mixing['original_ciphers']:
-                        m = "Invalid first mix: Does not mix votes in archive!"
-                        raise AssertionError(m)
-
-                    counted_set = set(counted_list)
-                    del counted_list
-
-                    excluded = self.do_get_excluded_voters()
-                    for voter_key, reason in excluded.items():
-                        cast_votes = self.do_get_cast_votes(voter_key)
-                        for fingerprint in cast_votes:
-                            if fingerprint in counted_set:
-                                m = ("Invalid extraction for mixing: "
-                                     "vote [%s] from voter '%s' not excluded!"
-                                     % (fingerprint, voter_key))
-                                raise AssertionError(m)
-                    del votes_for_mixing
-                    del excluded
+                    self.validate_votes_for_mixing(mix['original_ciphers'])
 
                 previous = mix
 
         teller.finish('Validating state')
 
-    def export_mixing(self):
+    def validate_votes_for_mixing(self, original_ciphers):
+        votes_for_mixing, counted_list = self.extract_votes_for_mixing()
+        if len(original_ciphers) != len(counted_list):
+            m = "Invalid extraction for mixing!"
+            raise AssertionError(m)
+        if original_ciphers != votes_for_mixing['original_ciphers']:
+            m = "Invalid first mix: Does not mix votes in archive!"
+            raise AssertionError(m)
+
+        counted_set = set(counted_list)
+        del counted_list
+
+        excluded = self.do_get_excluded_voters()
+        for voter_key, reason in excluded.items():
+            cast_votes = self.do_get_cast_votes(voter_key)
+            for fingerprint in cast_votes:
+                if fingerprint in counted_set:
+                    m = ("Invalid extraction for mixing: "
+                         "vote [%s] from voter '%s' not excluded!"
+                         % (fingerprint, voter_key))
+                    raise AssertionError(m)
+
+    def export_mixing(self, lazy=False):
         stage = self.do_get_stage()
         if stage in ('UNINITIALIZED', 'CREATING', 'VOTING', 'MIXING'):
             m = "Stage 'MIXING' must have passed before it can be exported"
             raise ZeusError(m)
 
         mixing = self.export_voting()
-        mixes = self.do_get_all_mixes()[1:]
+        if lazy:
+            mixes = self.do_iter_mixes()
+        else:
+            mixes = self.do_get_all_mixes()[1:]
         mixing['mixes'] = mixes
         return mixing
 
@@ -3362,13 +4116,13 @@ class ZeusCoreElection(object):
         self.compute_zeus_factors()
         self.do_set_stage('DECRYPTING')
 
-    def export_decrypting(self):
+    def export_decrypting(self, lazy=False):
         stage = self.do_get_stage()
         if stage not in ('FINISHED'):
             m = "Stage 'DECRYPTING' must have passed before it can be exported"
             raise ZeusError(m)
 
-        decrypting = self.export_mixing()
+        decrypting = self.export_mixing(lazy=lazy)
         all_factors = self.do_get_all_trustee_factors()
         trustee_factors = [{'trustee_public': k, 'decryption_factors': v}
                            for k, v in all_factors.items()]
@@ -3421,12 +4175,19 @@ class ZeusCoreElection(object):
 
         factors = trustee_factors['decryption_factors']
         ciphers = self.get_mixed_ballots()
+        payload = factors_payload(crypto, trustee_public, ciphers, factors)
+        digest, verified = self.get_verification('factors', payload)
+        if verified:
+            return 1
+
         nr_parallel = self.get_option('nr_parallel')
+        batch = bool(self.get_option('batch_verify_factors'))
         if not verify_decryption_factors(modulus, generator, order,
                                          trustee_public,
                                          ciphers, factors,
                                          teller=teller,
-                                         nr_parallel=nr_parallel):
+                                         nr_parallel=nr_parallel,
+                                         batch=batch):
             print("MODULUS", modulus)
             print("GENERATOR", generator)
             print("ORDER", order)
@@ -3436,6 +4197,7 @@ class ZeusCoreElection(object):
             m = "Invalid trustee factor proof!"
             raise ZeusError(m)
 
+        self.set_verified('factors', digest)
         return 1
 
     def add_trustee_factors(self, trustee_factors):
@@ -3462,6 +4224,7 @@ class ZeusCoreElection(object):
             raise ZeusError(m)
 
         mixed_ballots = self.get_mixed_ballots()
+        batch = bool(self.get_option('batch_verify_factors'))
 
         for trustee in trustees:
             if trustee not in all_factors:
@@ -3470,20 +4233,32 @@ class ZeusCoreElection(object):
 
             nr_parallel = self.get_option('nr_parallel')
             factors = all_factors[trustee]
+            payload = factors_payload(crypto, trustee, mixed_ballots, factors)
+            digest, verified = self.get_verification('factors', payload)
+            if verified:
+                continue
             if not verify_decryption_factors(modulus, generator, order,
                                              trustee, mixed_ballots, factors,
                                              teller=teller,
-                                             nr_parallel=nr_parallel):
+                                             nr_parallel=nr_parallel,
+                                             batch=batch):
                 m = "Invalid trustee factors proof!"
                 raise ZeusError(m)
+            self.set_verified('factors', digest)
 
         zeus_factors = self.do_get_zeus_factors()
         zeus_public = self.do_get_zeus_public()
-        if not verify_decryption_factors(modulus, generator, order,
-                                         zeus_public, mixed_ballots,
-                                         zeus_factors, teller=teller):
-            m = "Invalid zeus factors proof!"
-            raise ZeusError(m)
+        payload = factors_payload(crypto, zeus_public, mixed_ballots,
+                                  zeus_factors)
+        digest, verified = self.get_verification('factors', payload)
+        if not verified:
+            if not verify_decryption_factors(modulus, generator, order,
+                                             zeus_public, mixed_ballots,
+                                             zeus_factors, teller=teller,
+                                             batch=batch):
+                m = "Invalid zeus factors proof!"
+                raise ZeusError(m)
+            self.set_verified('factors', digest)
 
         teller.finish()
 
@@ -3558,7 +4333,10 @@ class ZeusCoreElection(object):
         finished['results'] = self.do_get_results()
         fingerprint = sha256(to_canonical(finished).encode()).hexdigest()
         finished['election_fingerprint'] = fingerprint
+        finished['election_report'] = self.get_election_report(fingerprint)
+        return finished
 
+    def get_election_report(self, fingerprint):
         report = ''
 
         trustees = list(self.do_get_trustees())
@@ -3579,9 +4357,7 @@ class ZeusCoreElection(object):
             report += '\n'
 
         report += 'ZEUS ELECTION FINGERPRINT: %s\n' % (fingerprint,)
-
-        finished['election_report'] = report
-        return finished
+        return report
 
     @classmethod
     def new_at_finished(cls, finished, teller=_teller, **kw):
@@ -3589,6 +4365,9 @@ class ZeusCoreElection(object):
         self.do_store_results(finished['results'])
         finished.pop('election_report', None)
         fingerprint = finished.pop('election_fingerprint', None)
+        # trustees are keyed by int, which sort differently than strings
+        finished['trustees'] = dict((int(k), v) for k, v in
+                                    finished['trustees'].items())
         _fingerprint = sha256(to_canonical(finished).encode()).hexdigest()
         if fingerprint is not None:
             if fingerprint != _fingerprint:
@@ -3621,6 +4400,72 @@ class ZeusCoreElection(object):
             raise ValueError(m)
         return getattr(self, method_name)(), stage
 
+    def export_to_file(self, out, tmpdir=None):
+        """
+        Write to_canonical() of the export to the binary file out, byte
+        for byte, without building it in memory: mixes are written out
+        one proof round at a time. Return the stage and the election
+        fingerprint, which is None before stage 'FINISHED'.
+        """
+        stage = self.do_get_stage()
+        if stage == 'DECRYPTING':
+            exported = self.export_mixing(lazy=True)
+        elif stage == 'FINISHED':
+            exported = self.export_decrypting(lazy=True)
+            exported['results'] = self.do_get_results()
+        else:
+            exported, stage = self.export()
+
+        if stage != 'FINISHED':
+            for data in iter_canonical(exported):
+                out.write(data.encode())
+            return stage, None
+
+        # The fingerprint is the hash of the export without itself and
+        # the report, but it sorts before the mixes. Write the rest to a
+        # temporary file while hashing it, then copy it over key by key.
+        hasher = sha256()
+        parts = {}
+        with tempfile.TemporaryFile(prefix='zeus-export-', dir=tmpdir) as f:
+            def write(data):
+                data = data.encode()
+                hasher.update(data)
+                f.write(data)
+
+            sep = '{'
+            for key in sorted(exported):
+                write('%s%s: ' % (sep, json.dumps(key)))
+                start = f.tell()
+                for data in iter_canonical(exported[key]):
+                    write(data)
+                parts[key] = (start, f.tell())
+                sep = ', '
+            write('}')
+            del exported
+
+            fingerprint = hasher.hexdigest()
+            report = self.get_election_report(fingerprint)
+            parts['election_fingerprint'] = json.dumps(fingerprint)
+            parts['election_report'] = json.dumps(report)
+
+            sep = '{'
+            for key in sorted(parts):
+                out.write(('%s%s: ' % (sep, json.dumps(key))).encode())
+                sep = ', '
+                part = parts[key]
+                if isinstance(part, str):
+                    out.write(part.encode())
+                    continue
+                start, end = part
+                f.seek(start)
+                while start < end:
+                    data = f.read(min(COPY_CHUNK, end - start))
+                    out.write(data)
+                    start += len(data)
+            out.write(b'}')
+
+        return stage, fingerprint
+
     def validate(self):
         self.validate_creating()
         self.validate_voting()
@@ -3925,9 +4770,16 @@ def main(cmd=None):
         help="Read a FINISHED election from a proofs file and verify it")
 
     parser.add_argument('--verify-signatures', nargs='*',
-        metavar=('election_file', 'signature_file'),
-        help="Read an election and a signature from a JSON file "
-             "and verify the signature")
+        metavar='signature_file',
+        help="Verify vote signatures in files, or in directories of "
+             "files, against the --election")
+
+    parser.add_argument('--state-file', metavar='path',
+        help="Verify signatures: record progress in this file and "
+             "resume from it")
+
+    parser.add_argument('--summary', metavar='path',
+        help="Verify signatures: write a JSON summary to this file")
 
     parser.add_argument('--parallel', dest='nr_procs', type=int, default=2,
         help="Use multiple processes for parallel mixing")
@@ -3935,6 +4787,11 @@ def main(cmd=None):
     parser.add_argument('--no-verify', action='store_true', default=False,
                         help="Do not verify elections")
 
+    parser.add_argument('--batch-verify', action='store_true', default=False,
+                        help=("Verify mix and decryption factor proofs "
+                              "with randomized batch checks instead of "
+                              "one by one"))
+
     parser.add_argument('--report', action='store_true', default=False,
                         help="Display election report")
 
@@ -4049,10 +4906,9 @@ def main(cmd=None):
         return vfm, counted_list
 
     def do_report(election):
-        exported, stage = election.export()
-        if 'election_report' in exported:
-            print(exported['election_report'])
-        return exported, stage
+        report = election.get_election_report(election.election_fingerprint)
+        print(report)
+        return report
 
     def do_results(election):
         results = election.do_get_results()
@@ -4107,19 +4963,19 @@ def main(cmd=None):
             print(report)
 
     def main_verify_election(args, teller=_teller, nr_parallel=0):
-        no_verify = args.no_verify
+        from .verifier import ElectionVerifier
+
         filename = args.election
         sys.stderr.write("loading election from '%s'\n" % (filename,))
+        verifier = ElectionVerifier(teller=teller, nr_parallel=nr_parallel,
+                                    no_verify=args.no_verify,
+                                    batch_verify=args.batch_verify,
+                                    batch_verify_factors=args.batch_verify)
         with open(filename, "r") as f:
-            try:
-                finished = from_canonical(f)
-            except ValueError:
-                finished = json_load(f)
+            election = verifier.load(f)
 
-        election = ZeusCoreElection.new_at_finished(finished, teller=teller,
-                                                    nr_parallel=nr_parallel)
-        if not no_verify:
-            election.validate()
+        for name, seconds in verifier.timings.items():
+            sys.stderr.write("%s: %.3fs\n" % (name, seconds))
 
         if args.extract_signatures:
             do_extract_signatures(election, args.extract_signatures,
@@ -4144,9 +5000,9 @@ def main(cmd=None):
         return election
 
     def main_verify_signature(args, teller=_teller, nr_parallel=0):
-        no_verify = args.no_verify
-        report = args.report
-        sigfiles = args.verify_signatures
+        from .verifier import SignatureBatch, expand_paths
+
+        sigfiles = expand_paths(args.verify_signatures)
         if len(sigfiles) < 1:
             m = "No signature files given!"
             raise ValueError(m)
@@ -4155,27 +5011,25 @@ def main(cmd=None):
                  "and at least one signature file")
             raise ValueError(m)
 
-        election_file = args.election
-        sys.stderr.write("loading election from '%s'\n" % (election_file,))
-        with open(election_file, "r") as f:
-            try:
-                finished = from_canonical(f)
-            except ValueError:
-                finished = json_load(f)
-
-        election = ZeusCoreElection.new_at_finished(finished, teller=teller,
-                                                    nr_parallel=nr_parallel,
-                                                    no_verify=no_verify)
-        if report:
-            do_report()
-
-        with teller.task("Verifying signatures", total=len(sigfiles)):
-            for sigfile in sigfiles:
-                with open(sigfile, "r") as f:
-                    signature = f.read()
-                signed_vote = election.verify_vote_signature(signature)
-                election.validate_vote(signed_vote)
-                teller.advance()
+        election = main_verify_election(args, teller=teller,
+                                        nr_parallel=nr_parallel)
+        batch = SignatureBatch(election, state_path=args.state_file,
+                               teller=teller, nr_parallel=nr_parallel)
+        summary = batch.run(sigfiles)
+        if args.summary:
+            with open(args.summary, "w") as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+
+        for record in summary['failed']:
+            print("INVALID SIGNATURE: %s: %s"
+                  % (record['file'], record['error']))
+        print("SIGNATURES: %d valid, %d invalid, %d counted"
+              % (summary['valid'], summary['invalid'], summary['counted']))
+        if summary['invalid']:
+            m = ("%d of %d signatures are invalid"
+                 % (summary['invalid'], summary['total']))
+            raise ZeusError(m)
+        return summary
 
     class Nullstream(object):
         def write(*args):
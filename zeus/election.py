@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import os
 import uuid
 import json
 import copy
 import re
+import tempfile
 
 from collections import OrderedDict
+from fractions import Fraction
 
 from zeus.core import ZeusCoreElection, Teller, sk_from_args, \
     gamma_count_parties, gamma_count_range
 from zeus.core import V_CAST_VOTE, V_PUBLIC_AUDIT, V_AUDIT_REQUEST, \
-    ZeusError
+    ZeusError, to_canonical
+from zeus.mixpool import ReencryptionPool
+from zeus.mixfile import dump_mix
 
 from django.conf import settings
+from django.db.models import Exists, Max, Subquery
 
 from helios.crypto import electionalgs, elgamal
 from helios.crypto import utils
@@ -33,9 +39,66 @@ ELGAMAL_PARAMS.p = DEFAULT_CRYPTOSYSTEM_PARAMS['p']
 ELGAMAL_PARAMS.q = DEFAULT_CRYPTOSYSTEM_PARAMS['q']
 ELGAMAL_PARAMS.g = DEFAULT_CRYPTOSYSTEM_PARAMS['g']
 
-MIXNET_NR_PARALLEL = getattr(settings, 'ZEUS_MIXNET_NR_PARALLEL', 2)
+# verifying mixes and factors, also in the web processes
+MIXNET_NR_PARALLEL = getattr(settings, 'ZEUS_MIXNET_NR_PARALLEL', 0)
+# mixing and filling re-encryption pools, which run in their own tasks
+MIXING_NR_PARALLEL = getattr(settings, 'ZEUS_MIXING_NR_PARALLEL',
+                             getattr(settings, 'ZEUS_MIXNET_NR_PARALLEL',
+                                     os.cpu_count() or 2))
 MIXNET_NR_ROUNDS = getattr(settings, 'ZEUS_MIXNET_NR_ROUNDS', 128)
+MIXNET_BATCH_VERIFY = getattr(settings, 'ZEUS_MIXNET_BATCH_VERIFY', False)
+MIXNET_POOL_PATH = getattr(settings, 'ZEUS_MIXNET_POOL_PATH', None)
+DECRYPTION_BATCH_VERIFY = getattr(settings, 'ZEUS_DECRYPTION_BATCH_VERIFY',
+                                  True)
 SHUFFLE_MODULE = getattr(settings, 'SHUFFLE_MODULE', 'zeus.zeus_sk')
+RESULTS_CACHE_PATH = getattr(settings, 'ZEUS_RESULTS_CACHE_PATH',
+                             os.path.join(helios_models.RESULTS_PATH, 'cache'))
+VERIFICATION_LEDGER = getattr(settings, 'ZEUS_VERIFICATION_LEDGER', True)
+SIGNING_CONTEXT_CACHE_SIZE = getattr(settings,
+                                     'ZEUS_SIGNING_CONTEXT_CACHE_SIZE', 64)
+BULK_LOAD_CHUNK_SIZE = getattr(settings, 'ZEUS_BULK_LOAD_CHUNK_SIZE', 2000)
+
+
+def results_to_json(obj):
+    """
+    Convert counted results to plain JSON data that results_from_json
+    turns back into equal results. The tuples, Fractions and non-string
+    dict keys of the results are tagged, dicts keep their order.
+    """
+    if isinstance(obj, list):
+        return [results_to_json(item) for item in obj]
+    if isinstance(obj, tuple):
+        return {'tuple': [results_to_json(item) for item in obj]}
+    if isinstance(obj, dict):
+        return {'dict': [[results_to_json(key), results_to_json(value)]
+                         for key, value in obj.items()]}
+    if isinstance(obj, Fraction):
+        return {'fraction': [obj.numerator, obj.denominator]}
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    m = "Cannot store results of type %s" % (type(obj).__name__,)
+    raise TypeError(m)
+
+
+def results_from_json(obj):
+    if isinstance(obj, list):
+        return [results_from_json(item) for item in obj]
+    if isinstance(obj, dict):
+        (tag, value), = obj.items()
+        if tag == 'tuple':
+            return tuple(results_from_json(item) for item in value)
+        if tag == 'dict':
+            return dict((results_from_json(key), results_from_json(item))
+                        for key, item in value)
+        if tag == 'fraction':
+            return Fraction(*value)
+        m = "Unknown results tag %s" % (tag,)
+        raise ValueError(m)
+    return obj
+
+
+# poll pk -> vote signing context, least recently used first
+_signing_contexts = {}
 
 shuffle_module = importlib.import_module(SHUFFLE_MODULE)
 
@@ -51,6 +114,27 @@ class NullStream(object):
         return
 
 
+def iter_keyset(queryset, chunk_size=BULK_LOAD_CHUNK_SIZE):
+    """
+    Yield all objects of queryset in primary key order, one page of
+    chunk_size objects per query, each streamed through a server side
+    cursor.
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        count = 0
+        for obj in page[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last = obj.pk
+            yield obj
+        if count < chunk_size:
+            return
+
+
 def get_datatype(datatype, obj=None, **kwargs):
     if len(datatype.split("/")) == 1:
         datatype = 'legacy/%s' % datatype
@@ -79,137 +163,231 @@ class ZeusDjangoElection(ZeusCoreElection):
 
         self.election = election
         self.poll = poll
+        # voters loaded while casting, by uuid
+        self._voters = {}
+        # voters and votes of the poll, see _load_voters and _load_votes
+        self._loaded_voters = None
+        self._loaded_votes = None
 
         kwargs['cryptosystem'] = (ELGAMAL_PARAMS.p, ELGAMAL_PARAMS.g,
                                   ELGAMAL_PARAMS.q)
         kwargs['teller'] = Teller(outstream=NullStream())
         super(ZeusDjangoElection, self).__init__(*args, **kwargs)
-        self.set_option(parallel=MIXNET_NR_PARALLEL)
+        self.set_option(parallel=MIXING_NR_PARALLEL)
         self.set_option(nr_parallel=MIXNET_NR_PARALLEL)
         self.set_option(min_mix_rounds=MIXNET_NR_ROUNDS)
+        self.set_option(batch_verify=MIXNET_BATCH_VERIFY)
+        self.set_option(batch_verify_factors=DECRYPTION_BATCH_VERIFY)
+        self.set_option(verification_ledger=VERIFICATION_LEDGER)
 
     def _get_zeus_vote(self, enc_vote, voter=None, audit_password=None):
         return self.poll._get_zeus_vote(enc_vote, voter=voter,
                                                   audit_password=audit_password)
 
+    def _zeus_cast_vote(self, vote):
+        zeus_vote = self._get_zeus_vote(vote.vote)
+        zeus_vote['fingerprint'] = vote.fingerprint
+        zeus_vote['signature'] = vote.signature['signature']
+        zeus_vote['previous'] = vote.previous
+        zeus_vote['voter'] = vote.voter.uuid
+        zeus_vote['index'] = vote.index
+        zeus_vote['weight'] = vote.voter.voter_weight
+        return zeus_vote
+
+    def _zeus_audited_vote(self, audited):
+        helios_vote = electionalgs.EncryptedVote.fromJSONDict(
+            utils.from_json(audited.raw_vote))
+        zeus_vote = self._get_zeus_vote(
+            helios_vote,
+            audit_password=audited.audit_code)
+        zeus_vote['fingerprint'] = audited.fingerprint
+        zeus_vote['signature'] = audited.signature['signature']
+        return zeus_vote
+
+    def _load_voters(self):
+        """
+        Load the voters of the poll, their audit codes and the excluded
+        ones, unless already loaded.
+        """
+        if self._loaded_voters is not None:
+            return self._loaded_voters
+
+        voters = {}
+        audit_codes = {}
+        excluded = {}
+        fields = ('poll', 'uuid', 'voter_name', 'voter_surname',
+                  'voter_fathername', 'voter_mobile', 'voter_login_id',
+                  'voter_weight', 'audit_passwords', 'excluded_at',
+                  'exclude_reason')
+        for voter in iter_keyset(self.poll.voters.only(*fields)):
+            voters[voter.uuid] = voter.zeus_string, voter.voter_weight
+            audit_codes[voter.uuid] = voter.get_audit_passwords()
+            if voter.excluded_at is not None:
+                excluded[voter.uuid] = voter.exclude_reason
+
+        self._loaded_voters = {
+            'voters': voters,
+            'audit_codes': audit_codes,
+            'excluded': excluded,
+        }
+        return self._loaded_voters
+
+    def _load_votes(self):
+        """
+        Load the cast votes and audited ballots of the poll, unless
+        already loaded. Storing votes through this election discards
+        them.
+        """
+        if self._loaded_votes is not None:
+            return self._loaded_votes
+
+        votes = {}
+        unverified = set()
+        cast_votes = {}
+        vote_index = []
+        fields = ('poll', 'fingerprint', 'previous', 'index', 'vote',
+                  'signature', 'verified_at', 'voter__uuid',
+                  'voter__voter_weight')
+        cast = self.poll.cast_votes.select_related('voter').only(*fields)
+        for vote in iter_keyset(cast):
+            fingerprint = vote.fingerprint
+            votes[fingerprint] = self._zeus_cast_vote(vote)
+            if vote.verified_at is None:
+                unverified.add(fingerprint)
+            else:
+                cast_votes.setdefault(vote.voter.uuid, []).append(fingerprint)
+            if vote.index is not None:
+                vote_index.append((vote.index, fingerprint))
+
+        audited = {}
+        audit_requests = {}
+        audit_publications = []
+        fields = ('poll', 'fingerprint', 'is_request', 'raw_vote',
+                  'audit_code', 'signature', 'voter__uuid')
+        ballots = self.poll.audited_ballots.select_related('voter').only(
+            *fields)
+        for ballot in iter_keyset(ballots):
+            fingerprint = ballot.fingerprint
+            if ballot.is_request:
+                audit_requests[fingerprint] = ballot.voter.uuid
+                # publications override requests
+                if fingerprint in audited:
+                    continue
+            else:
+                audit_publications.append(fingerprint)
+            audited[fingerprint] = self._zeus_audited_vote(ballot)
+
+        vote_index.sort()
+        self._loaded_votes = {
+            'votes': votes,
+            'unverified': unverified,
+            'cast_votes': cast_votes,
+            'vote_index': [fingerprint for _, fingerprint in vote_index],
+            'indexed': dict(vote_index),
+            'audited': audited,
+            'audit_requests': audit_requests,
+            'audit_publications': audit_publications,
+        }
+        return self._loaded_votes
+
+    def do_has_vote(self, fingerprint):
+        if self._loaded_votes is not None:
+            return (fingerprint in self._loaded_votes['votes'] or
+                    fingerprint in self._loaded_votes['audited'])
+        cast = self.poll.cast_votes.filter(
+            fingerprint=fingerprint).values('fingerprint')
+        audited = self.poll.audited_ballots.filter(
+            fingerprint=fingerprint,
+            is_request__in=[True, False]).values('fingerprint')
+        return cast.union(audited).exists()
+
+    def do_get_votes_by_fingerprint(self, fingerprints):
+        fingerprints = list(fingerprints)
+        if (self._loaded_votes is not None or
+                len(fingerprints) > BULK_LOAD_CHUNK_SIZE):
+            loaded = self._load_votes()
+            votes = {}
+            for fingerprint in fingerprints:
+                vote = loaded['votes'].get(fingerprint)
+                if vote is None:
+                    vote = loaded['audited'].get(fingerprint)
+                if vote is not None:
+                    votes[fingerprint] = vote
+            return votes
+
+        votes = {}
+        # publications override requests, cast votes override both
+        audited = self.poll.audited_ballots.filter(
+            fingerprint__in=fingerprints).order_by('-is_request')
+        for audited_vote in audited:
+            votes[audited_vote.fingerprint] = \
+                self._zeus_audited_vote(audited_vote)
+        cast = self.poll.cast_votes.filter(
+            fingerprint__in=fingerprints).select_related('voter')
+        for vote in cast:
+            votes[vote.fingerprint] = self._zeus_cast_vote(vote)
+        return votes
+
     def do_get_vote(self, fingerprint):
-        # try CastVote
-        try:
-            vote = self.poll.cast_votes.get(fingerprint=fingerprint)
-            zeus_vote = self._get_zeus_vote(vote.vote)
-            zeus_vote['fingerprint'] = vote.fingerprint
-            zeus_vote['signature'] = vote.signature['signature']
-            zeus_vote['previous'] = vote.previous
-            zeus_vote['voter'] = vote.voter.uuid
-            zeus_vote['index'] = vote.index
-            zeus_vote['weight'] = vote.voter.voter_weight
-            return zeus_vote
-        except helios_models.CastVote.DoesNotExist:
-            pass
-        # then AuditedBallot
-        try:
-            audited = self.poll.audited_ballots.get(
-                fingerprint=fingerprint, is_request=False)
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            return zeus_vote
-        except helios_models.AuditedBallot.DoesNotExist:
-            pass
-        # then AuditedBallot requests
-        try:
-            audited = self.poll.audited_ballots.get(
-                fingerprint=fingerprint, is_request=True)
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            return zeus_vote
-        except helios_models.AuditedBallot.DoesNotExist:
-            return None
-        return None
+        return self.do_get_votes_by_fingerprint([fingerprint]).get(fingerprint)
 
     def do_get_cast_votes(self, voter):
+        if self._loaded_votes is not None:
+            return list(self._loaded_votes['cast_votes'].get(voter, []))
         votes = []
         for vote in self.poll.cast_votes.filter(verified_at__isnull=False,
                                                            voter__uuid=voter).order_by('pk'):
             votes.append(vote.fingerprint)
         return votes
 
+    def do_get_cast_context(self, voter_key, fingerprint):
+        audited = self.poll.audited_ballots.filter(fingerprint=fingerprint)
+        audit_request = audited.filter(is_request=True).values('voter__uuid')
+        voter = self.poll.voters.annotate(
+            audit_request=Subquery(audit_request[:1]),
+            cast_stored=Exists(
+                self.poll.cast_votes.filter(fingerprint=fingerprint)),
+            audit_stored=Exists(audited),
+        ).get(uuid=voter_key)
+        self._voters[voter.uuid] = voter
+
+        cast_votes = self.poll.cast_votes.filter(
+            voter=voter, verified_at__isnull=False).order_by('pk')
+        return {
+            'voter': (voter.zeus_string, voter.voter_weight),
+            'audit_codes': voter.get_audit_passwords(),
+            'cast_votes': list(cast_votes.values_list('fingerprint',
+                                                      flat=True)),
+            'audit_request': voter.audit_request,
+            'vote_stored': voter.cast_stored or voter.audit_stored,
+        }
+
     def do_get_all_cast_votes(self):
-        votes = {}
-        for voter in self.do_get_voters():
-            voter_votes = [vote for vote in self.do_get_cast_votes(voter)]
-            if voter_votes:
-                votes[voter] = voter_votes
-        return votes
+        cast_votes = self._load_votes()['cast_votes']
+        return dict((voter, list(votes))
+                    for voter, votes in cast_votes.items())
 
     def do_index_vote(self, fingerprint):
-        # TODO: READ FOR UPDATE
-        index = self.poll.cast_votes.filter(verified_at__isnull=False).count()
-        return index
+        # casting holds the poll's cast lock, see Poll.lock_for_casting
+        last = self.poll.cast_votes.filter(
+            index__isnull=False).aggregate(last=Max('index'))['last']
+        return 0 if last is None else last + 1
 
     def do_get_index_vote(self, index):
+        if self._loaded_votes is not None:
+            return self._loaded_votes['indexed'].get(index)
         return self.poll.cast_votes.get(index=index).fingerprint
 
     def do_get_vote_index(self):
-        votes = []
-        for vote in self.poll.cast_votes.filter(index__isnull=False).order_by('index'):
-            votes.append(vote.fingerprint)
-        return votes
+        return list(self._load_votes()['vote_index'])
 
     def do_get_votes(self):
-        votes = {}
-        casted = self._casted_votes()
-        audited = self._audit_votes()
-        votes.update(casted)
-        votes.update(audited)
-        return votes
-
-    def _audit_votes(self):
-        votes = {}
-        for audited in self.poll.audited_ballots.filter(is_request=False):
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            votes[audited.fingerprint] = zeus_vote
-        for audited in self.poll.audited_ballots.filter(is_request=True):
-            try:
-                self.poll.audited_ballots.get(fingerprint=audited.fingerprint,
-                                                        is_request=False)
-            except helios_models.AuditedBallot.DoesNotExist:
-                helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                    utils.from_json(audited.raw_vote))
-                zeus_vote = self._get_zeus_vote(
-                    helios_vote,
-                    audit_password=audited.audit_code)
-                zeus_vote['fingerprint'] = audited.fingerprint
-                zeus_vote['signature'] = audited.signature['signature']
-                votes[audited.fingerprint] = zeus_vote
-
-        return votes
-
-    def _casted_votes(self):
-        votes = {}
-        for vote in self.poll.cast_votes.filter(verified_at__isnull=False):
-            zeus_vote = self._get_zeus_vote(vote.vote, voter=vote.voter)
-            zeus_vote['fingerprint'] = vote.fingerprint
-            zeus_vote['signature'] = vote.signature['signature']
-            zeus_vote['previous'] = vote.previous
-            zeus_vote['voter'] = vote.voter.uuid
-            zeus_vote['index'] = vote.index
-            votes[vote.fingerprint] = zeus_vote
+        loaded = self._load_votes()
+        unverified = loaded['unverified']
+        votes = dict((fingerprint, vote)
+                     for fingerprint, vote in loaded['votes'].items()
+                     if fingerprint not in unverified)
+        votes.update(loaded['audited'])
         return votes
 
     def do_store_audit_publication(self, fingerprint):
@@ -219,10 +397,7 @@ class ZeusDjangoElection(ZeusCoreElection):
         pass
 
     def do_get_audit_requests(self):
-        reqs = {}
-        for req in self.poll.audited_ballots.filter(is_request=True):
-            reqs[req.fingerprint] = req.voter.uuid
-        return reqs
+        return dict(self._load_votes()['audit_requests'])
 
     def do_get_audit_request(self, fingerprint):
         try:
@@ -234,11 +409,7 @@ class ZeusDjangoElection(ZeusCoreElection):
         return obj.voter.uuid
 
     def do_get_audit_publications(self):
-        pubs = []
-        for pub in self.poll.audited_ballots.filter(is_request=False):
-            pubs.append(pub.fingerprint)
-
-        return pubs
+        return list(self._load_votes()['audit_publications'])
 
     def _get_helios_vote_dict(self, vote):
         enc_ballot = vote['encrypted_ballot']
@@ -313,6 +484,7 @@ class ZeusDjangoElection(ZeusCoreElection):
         vobj.save()
 
     def do_store_votes(self, votes):
+        self._loaded_votes = None
         for vote in votes:
             if vote['status'] == V_CAST_VOTE:
                 self._do_store_cast_vote(vote)
@@ -321,6 +493,19 @@ class ZeusDjangoElection(ZeusCoreElection):
             if vote['status'] == V_PUBLIC_AUDIT:
                 self._do_store_public_audit(vote)
 
+    def do_store_signing_context(self, context):
+        _signing_contexts.pop(self.poll.pk, None)
+        if SIGNING_CONTEXT_CACHE_SIZE > 0:
+            while len(_signing_contexts) >= SIGNING_CONTEXT_CACHE_SIZE:
+                del _signing_contexts[next(iter(_signing_contexts))]
+            _signing_contexts[self.poll.pk] = context
+
+    def do_get_signing_context(self):
+        context = _signing_contexts.pop(self.poll.pk, None)
+        if context is not None:
+            _signing_contexts[self.poll.pk] = context
+        return context
+
     def do_get_candidates(self):
         try:
             candidates = self.poll.questions[0]['answers']
@@ -329,18 +514,18 @@ class ZeusDjangoElection(ZeusCoreElection):
         return candidates
 
     def _get_voter_object(self, voter_uuid):
+        if voter_uuid in self._voters:
+            return self._voters[voter_uuid]
         return self.poll.voters.get(uuid=voter_uuid)
 
     def do_get_voter(self, voter_uuid):
+        if self._loaded_voters is not None:
+            return self._loaded_voters['voters'].get(voter_uuid)
         v = self._get_voter_object(voter_uuid)
         return v.zeus_string, v.voter_weight
 
     def do_get_voters(self):
-        voters = {}
-        for v in self.poll.voters.all():
-            voters[v.uuid] = v.zeus_string, v.voter_weight
-
-        return voters
+        return dict(self._load_voters()['voters'])
 
     def do_store_election_public(self, public):
         p, g, q = self.do_get_cryptosystem()
@@ -359,11 +544,9 @@ class ZeusDjangoElection(ZeusCoreElection):
             uuid=voter).get_audit_passwords()
 
     def do_get_all_voter_audit_codes(self):
-        voter_slots = {}
-        for v in self.poll.voters.all():
-            voter_slots[v.uuid] = v.get_audit_passwords()
-
-        return voter_slots
+        audit_codes = self._load_voters()['audit_codes']
+        return dict((voter, list(codes))
+                    for voter, codes in audit_codes.items())
 
     def do_get_cryptosystem(self):
         return [ELGAMAL_PARAMS.p, ELGAMAL_PARAMS.g,
@@ -476,22 +659,97 @@ class ZeusDjangoElection(ZeusCoreElection):
             status='finished').order_by('-mix_order')
         if mixes.count() == 0:
             return self.extract_votes_for_mixing()[0]
-        return mixes[0].zeus_mix()
+        # the proof of the last mix is never used
+        return mixes[0].zeus_mix(proof=False)
 
     def do_store_mix(self, mix):
         pass
 
+    def do_store_mix_digest(self, digest):
+        # stored with the remote mix by Poll.add_remote_mix
+        pass
+
+    def do_get_mix_digests(self):
+        mixes = self.poll.mixes.filter(status='finished').order_by('mix_order')
+        return [None] + list(mixes.values_list('digest', flat=True))
+
     def do_get_all_mixes(self):
         mixes = [self.extract_votes_for_mixing()[0]]
         for mixnet in self.poll.mixes.filter(status='finished').order_by('mix_order'):
             mixes.append(mixnet.zeus_mix())
         return mixes
 
+    def do_iter_mixes(self):
+        for mixnet in self.poll.mixes.filter(status='finished').order_by('mix_order'):
+            yield from mixnet.iter_zeus_mix()
+
+    def do_get_verified(self, kind, digest, version):
+        return self.poll.verifications.filter(
+            kind=kind, digest=digest, verifier_version=version).exists()
+
+    def do_store_verified(self, kind, digest, version):
+        self.poll.verifications.get_or_create(
+            kind=kind, digest=digest, verifier_version=version)
+
+    def get_reencryption_pool(self):
+        public = self.do_get_election_public()
+        if not MIXNET_POOL_PATH or not public:
+            return None
+        modulus, generator, order = self.do_get_cryptosystem()
+        path = os.path.join(MIXNET_POOL_PATH,
+                            '%s.pool' % (self.election.uuid,))
+        return ReencryptionPool(path, modulus, generator, order, public)
+
+    def _mix_kwargs(self):
+        kw = {}
+        pool = self.get_reencryption_pool()
+        if pool is not None:
+            # only passed when enabled, custom shuffle modules may not
+            # support re-encryption pools
+            kw['pool'] = pool
+        return kw
+
     def mix(self, ciphers):
         return shuffle_module.mix_ciphers(
             ciphers, teller=self.teller,
             nr_rounds=MIXNET_NR_ROUNDS,
-            nr_parallel=self.get_option('parallel'))
+            nr_parallel=self.get_option('parallel'),
+            **self._mix_kwargs())
+
+    def mix_to_file(self, ciphers, out, spill_dir=None, binary=False):
+        if not hasattr(shuffle_module, 'mix_ciphers_to_file'):
+            if binary:
+                dump_mix(self.mix(ciphers), out)
+            else:
+                to_canonical(self.mix(ciphers), out=out)
+            return
+        kw = self._mix_kwargs()
+        if binary:
+            # only passed when enabled, custom shuffle modules may not
+            # support writing mix files
+            kw['binary'] = True
+        shuffle_module.mix_ciphers_to_file(
+            ciphers, out, teller=self.teller,
+            nr_rounds=MIXNET_NR_ROUNDS,
+            nr_parallel=self.get_option('parallel'),
+            spill_dir=spill_dir, **kw)
+
+    def fill_reencryption_pool(self, count=None):
+        """
+        Precompute re-encryption factors for the mixes of all polls, by
+        default enough for every voter and mix round.
+        """
+        pool = self.get_reencryption_pool()
+        if pool is None:
+            return 0
+        if count is None:
+            nr_voters = helios_models.Voter.objects.filter(
+                poll__election=self.election).count()
+            count = nr_voters * (MIXNET_NR_ROUNDS + 1) - pool.available()
+        if count <= 0:
+            return pool.available()
+        return pool.fill(count, teller=self.teller,
+                         nr_parallel=self.get_option('parallel'))
 
     def _get_zeus_factors(self, trustee):
         trustee_factors = []
@@ -537,6 +795,7 @@ class ZeusDjangoElection(ZeusCoreElection):
         e = self.poll
         e.result = [results]
         e.save()
+        self.forget_cached_results()
 
     def do_get_results(self):
         return self.poll.result[0]
@@ -547,23 +806,100 @@ class ZeusDjangoElection(ZeusCoreElection):
         super(cls, ZeusDjangoElection).mk_random(*args, **kwargs)
 
     def do_store_excluded_voter(self, voter_key, reason):
+        self._loaded_voters = None
         voter = self.poll.voters.get(uuid=voter_key)
         voter.excluded_at = datetime.datetime.now()
         voter.exclude_reason = reason
         voter.save()
 
     def do_get_excluded_voters(self):
-        excluded_voters = {}
-        for voter in self.poll.voters.filter(
-                excluded_at__isnull=False):
-            excluded_voters[voter.uuid] = voter.exclude_reason
-        return excluded_voters
+        return dict(self._load_voters()['excluded'])
+
+    def get_results_key(self):
+        """
+        Identify the plaintexts the results are counted from by the
+        mixes and partial decryptions behind them and the decryption
+        that stored them, without reading the plaintexts.
+        """
+        poll = self.poll
+        mixes = poll.mixes.filter(status='finished').order_by('mix_order')
+        decryptions = poll.partial_decryptions.order_by('pk')
+        decrypted_at = poll.decrypt_started_at
+        return {
+            'module': poll.get_module().module_id,
+            'mixes': list(mixes.values_list('pk', flat=True)),
+            'decryptions': list(decryptions.values_list('pk', flat=True)),
+            'decrypted_at': decrypted_at and decrypted_at.isoformat(),
+        }
+
+    def _results_cache_file(self):
+        fname = "%s.results.json" % (self.poll.uuid,)
+        return os.path.join(RESULTS_CACHE_PATH, fname)
+
+    def cache_results(self):
+        """
+        Count the results and store them for get_results,
+        replacing any previously stored copy.
+        """
+        if self.poll.get_module().module_id == 'stv':
+            # stv results are stored in the poll itself
+            return self.poll.stv_results
+
+        results_key = self.get_results_key()
+        results = self.count_results()
+        data = {'key': results_key, 'results': results_to_json(results)}
+        os.makedirs(RESULTS_CACHE_PATH, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=RESULTS_CACHE_PATH)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self._results_cache_file())
+        except Exception:
+            os.unlink(tmp_file)
+            raise
+        return results
+
+    def forget_cached_results(self):
+        try:
+            os.unlink(self._results_cache_file())
+        except FileNotFoundError:
+            pass
+
+    def _load_cached_results(self):
+        try:
+            with open(self._results_cache_file(), "r") as f:
+                data = json.load(f)
+            results_key = data['key']
+            results = data['results']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            self.forget_cached_results()
+            return None
+
+        if results_key != self.get_results_key():
+            return None
+        try:
+            return results_from_json(results)
+        except (ValueError, KeyError, TypeError):
+            self.forget_cached_results()
+            return None
 
     def get_results(self):
+        if self.poll.get_module().module_id == 'stv':
+            # we expect cached stv results
+            return self.poll.stv_results
+
+        results = self._load_cached_results()
+        if results is None:
+            results = self.count_results()
+        return results
+
+    def count_results(self):
         if self.poll.get_module().module_id == 'score':
             # last entry should be question min/max params
             # catch untagged entries for backwards compatibility
-            candidates = self.do_get_candidates()
+            candidates = list(self.do_get_candidates())
             params = candidates[-1]
             if not re.match(r"\d{1,}-\d{1,}", params):
                 params = "%d-%d" % (0, len(candidates))
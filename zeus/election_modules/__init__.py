@@ -226,7 +226,7 @@ class ElectionModuleBase(ElectionHooks):
         if self.module_id != "sav":
             results_json = self.poll.zeus.get_results()
         else:
-            results = count_sav_results_for_poll(self.poll)
+            results = self.poll.zeus.get_results()
             results_json = {
                 candidate: {
                     "float_votes": float(votes),
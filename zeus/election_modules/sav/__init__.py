@@ -1,10 +1,11 @@
 from django.utils.translation import gettext_lazy as _
 from django.forms.formsets import formset_factory
 from fractions import Fraction
+from collections import Counter
 
 from zeus.election_modules import ElectionModuleBase, election_module
 from django.conf import settings
-from zeus.core import gamma_decode, to_absolute_answers
+from zeus.core import gamma_decode_list
 
 
 @election_module
@@ -87,7 +88,7 @@ class SavElection(ElectionModuleBase):
 
     def generate_result_docs(self, lang):
         poll_data = [
-            (self.poll.name, count_sav_results_for_poll(self.poll), self.poll.questions,
+            (self.poll.name, self.poll.zeus.get_results(), self.poll.questions,
              self.poll.voters.all())
             ]
         from zeus.results_report import build_sav_doc
@@ -106,7 +107,7 @@ class SavElection(ElectionModuleBase):
 
         for poll in self.election.polls.filter():
             polls_data.append((poll.name,
-                               count_sav_results_for_poll(poll),
+                               poll.zeus.get_results(),
                                poll.questions,
                                poll.voters.all()))
 
@@ -121,8 +122,8 @@ class SavElection(ElectionModuleBase):
 def count_sav_results(ballots, cands_data, minimal=1):
     candidates_dict = {candidate: 0 for candidate in cands_data}
 
-    for ballot in ballots:
-        weight = Fraction(1, max(len(ballot), minimal))
+    for ballot, count in Counter(tuple(ballot) for ballot in ballots).items():
+        weight = Fraction(count, max(len(ballot), minimal))
         for i in ballot:
             candidates_dict[cands_data[i]] += weight
     candidate_data = [(candidate, votes) for candidate, votes in candidates_dict.items()]
@@ -144,11 +145,9 @@ def get_sav_ballots(poll):
     ballots_data = poll.result[0]
     ballots = []
 
-    for ballot in ballots_data:
+    for ballot in gamma_decode_list(ballots_data, cands_count, cands_count):
         if not ballot:
             continue
-        ballot = to_absolute_answers(gamma_decode(ballot, cands_count, cands_count),
-                                     cands_count)
         ballots.append(ballot)
 
     return cands_data, ballots
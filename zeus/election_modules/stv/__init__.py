@@ -10,7 +10,7 @@ from django.conf import settings
 from zeus.election_modules import ElectionModuleBase, election_module
 
 from stv.stv import count_stv, Ballot
-from zeus.core import gamma_decode, to_absolute_answers
+from zeus.core import gamma_decode_list
 
 
 @election_module
@@ -198,10 +198,8 @@ def get_csv_ballots(poll):
 
     ballots_data = poll.result[0]
     ballots = []
-    for ballot in ballots_data:
+    for ballot in gamma_decode_list(ballots_data, cands_count, cands_count):
         if not ballot:
             continue
-        ballot = to_absolute_answers(gamma_decode(ballot, cands_count, cands_count),
-                                     cands_count)
         ballots.append(ballot)
     return ballots
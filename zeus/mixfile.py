@@ -0,0 +1,342 @@
+"""
+Compact binary container for cipher mixes.
+
+All numbers are big-endian. A mix file starts with a fixed header
+
+    magic           8 bytes, MIX_MAGIC
+    version         uint32
+    element size    uint32, bytes per group element (w)
+    nr_ciphers      uint64 (N)
+    nr_rounds       uint32 (R)
+    challenge       32 bytes, the sha256 mix challenge
+
+followed by modulus, generator, order and public (w bytes each), a
+table of R uint64 file offsets, one per proof round, the original and
+the mixed ciphers (N * 2w bytes each), the R proof rounds and finally
+a trailer. A round holds its ciphers (N * 2w bytes), offsets (N uint32)
+and randoms (N * w bytes). The trailer holds the canonical JSON of any
+other keys of the mix followed by its length as a uint64, so that a
+mix file loads back to the very mix it was written from. Version 1
+files have no trailer.
+
+Files are memory mapped on load, so that single rounds or just the
+mixed ciphers can be read without touching the rest of the file.
+"""
+
+import mmap
+import struct
+import sys
+from argparse import ArgumentParser
+
+from zeus.core import ZeusError, from_canonical, to_canonical
+
+MIX_MAGIC = b'ZEUSMIX\0'
+MIX_VERSION = 2
+# the keys of a mix stored in the binary layout, others go to the trailer
+MIX_FILE_KEYS = ('challenge', 'cipher_collections', 'generator',
+                 'mixed_ciphers', 'modulus', 'offset_collections', 'order',
+                 'original_ciphers', 'public', 'random_collections')
+
+_header = struct.Struct('>8sIIQI32s')
+_round_offset = struct.Struct('>Q')
+_trailer_length = struct.Struct('>Q')
+OFFSET_SIZE = 4
+OFFSET_CEIL = 2 ** (8 * OFFSET_SIZE)
+
+
+def pack_elements(elements, size):
+    return b''.join(e.to_bytes(size, 'big') for e in elements)
+
+
+def pack_ciphers(ciphers, size):
+    return b''.join(alpha.to_bytes(size, 'big') + beta.to_bytes(size, 'big')
+                    for alpha, beta in ciphers)
+
+
+def unpack_elements(data, size):
+    from_bytes = int.from_bytes
+    return [from_bytes(data[i:i + size], 'big')
+            for i in range(0, len(data), size)]
+
+
+def dump_mix(mix, out):
+    """
+    Write the cipher mix dict to the binary file out.
+    Raise ZeusError if it does not fit the container.
+    """
+    try:
+        cipher_collections = mix['cipher_collections']
+        offset_collections = mix['offset_collections']
+        random_collections = mix['random_collections']
+        nr_rounds = len(cipher_collections)
+        if (len(offset_collections) != nr_rounds or
+                len(random_collections) != nr_rounds):
+            m = "Invalid mix: cannot store in a mix file"
+            raise ZeusError(m)
+    except (KeyError, TypeError) as e:
+        m = "Invalid mix: cannot store in a mix file"
+        raise ZeusError(m, e)
+
+    rounds = zip(cipher_collections, offset_collections, random_collections)
+    dump_mix_rounds(mix, nr_rounds, rounds, out)
+
+
+def dump_mix_rounds(mix, nr_rounds, rounds, out):
+    """
+    Like dump_mix(), but take the nr_rounds proof rounds of the mix from
+    the iterable rounds, as (ciphers, offsets, randoms), one at a time.
+    """
+    try:
+        modulus = mix['modulus']
+        size = (modulus.bit_length() + 7) // 8
+        original_ciphers = mix['original_ciphers']
+        mixed_ciphers = mix['mixed_ciphers']
+        challenge = bytes.fromhex(mix['challenge'])
+        nr_ciphers = len(original_ciphers)
+
+        if (challenge.hex() != mix['challenge'] or len(challenge) != 32 or
+                len(mixed_ciphers) != nr_ciphers or
+                nr_ciphers >= OFFSET_CEIL):
+            m = "Invalid mix: cannot store in a mix file"
+            raise ZeusError(m)
+
+        params = pack_elements([modulus, mix['generator'],
+                                 mix['order'], mix['public']], size)
+        ciphers_size = nr_ciphers * 2 * size
+        round_size = ciphers_size + nr_ciphers * (OFFSET_SIZE + size)
+        offset = (_header.size + len(params) +
+                  nr_rounds * _round_offset.size + 2 * ciphers_size)
+
+        out.write(_header.pack(MIX_MAGIC, MIX_VERSION, size,
+                               nr_ciphers, nr_rounds, challenge))
+        out.write(params)
+        for i in range(nr_rounds):
+            out.write(_round_offset.pack(offset + i * round_size))
+        out.write(pack_ciphers(original_ciphers, size))
+        out.write(pack_ciphers(mixed_ciphers, size))
+
+        offsets_format = '>%dI' % nr_ciphers
+        count = 0
+        for i, (ciphers, offsets, randoms) in enumerate(rounds):
+            if (len(ciphers) != nr_ciphers or len(offsets) != nr_ciphers or
+                    len(randoms) != nr_ciphers):
+                m = "Invalid mix: round %d has wrong length" % (i,)
+                raise ZeusError(m)
+            out.write(pack_ciphers(ciphers, size))
+            out.write(struct.pack(offsets_format, *offsets))
+            out.write(pack_elements(randoms, size))
+            count += 1
+        if count != nr_rounds:
+            m = "Invalid mix: cannot store in a mix file"
+            raise ZeusError(m)
+
+        extra = dict((key, value) for key, value in mix.items()
+                     if key not in MIX_FILE_KEYS)
+        trailer = to_canonical(extra).encode()
+        out.write(trailer)
+        out.write(_trailer_length.pack(len(trailer)))
+    except (KeyError, TypeError, ValueError, AttributeError,
+            OverflowError, struct.error) as e:
+        m = "Invalid mix: cannot store in a mix file"
+        raise ZeusError(m, e)
+
+
+class MixFile(object):
+    """
+    Read access to a binary mix file, opened by path.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() < _header.size:
+                m = "Invalid mix file: truncated header"
+                raise ZeusError(m)
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._read_header()
+        except ZeusError:
+            self.data.close()
+            raise
+
+    def _read_header(self):
+        data = self.data
+        magic, version, size, nr_ciphers, nr_rounds, challenge = \
+            _header.unpack_from(data, 0)
+        if magic != MIX_MAGIC:
+            m = "Invalid mix file: bad magic"
+            raise ZeusError(m)
+        if version not in (1, MIX_VERSION):
+            m = "Unsupported mix file version %d" % (version,)
+            raise ZeusError(m)
+
+        self.size = size
+        self.nr_ciphers = nr_ciphers
+        self.nr_rounds = nr_rounds
+        self.challenge = challenge.hex()
+
+        offset = _header.size
+        self.modulus, self.generator, self.order, self.public = \
+            unpack_elements(data[offset:offset + 4 * size], size)
+        offset += 4 * size
+
+        self.round_positions = [
+            _round_offset.unpack_from(data, offset + i * _round_offset.size)[0]
+            for i in range(nr_rounds)
+        ]
+        offset += nr_rounds * _round_offset.size
+        self.original_offset = offset
+        self.mixed_offset = offset + nr_ciphers * 2 * size
+
+        end = self.mixed_offset + nr_ciphers * 2 * size
+        round_size = nr_ciphers * (3 * size + OFFSET_SIZE)
+        if nr_rounds:
+            end = self.round_positions[-1] + round_size
+
+        self.extra = {}
+        if version > 1:
+            trailer_end = len(data) - _trailer_length.size
+            if trailer_end < end:
+                m = "Invalid mix file: size mismatch"
+                raise ZeusError(m)
+            trailer_size, = _trailer_length.unpack_from(data, trailer_end)
+            if end + trailer_size != trailer_end:
+                m = "Invalid mix file: size mismatch"
+                raise ZeusError(m)
+            try:
+                self.extra = from_canonical(data[end:trailer_end])
+            except ValueError as e:
+                m = "Invalid mix file: bad trailer"
+                raise ZeusError(m, e)
+            if not isinstance(self.extra, dict):
+                m = "Invalid mix file: bad trailer"
+                raise ZeusError(m)
+            end = len(data)
+
+        if len(data) != end:
+            m = "Invalid mix file: size mismatch"
+            raise ZeusError(m)
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _ciphers(self, offset):
+        size = self.size
+        end = offset + self.nr_ciphers * 2 * size
+        elements = unpack_elements(self.data[offset:end], size)
+        return [list(c) for c in zip(elements[0::2], elements[1::2])]
+
+    def original_ciphers(self):
+        return self._ciphers(self.original_offset)
+
+    def mixed_ciphers(self):
+        return self._ciphers(self.mixed_offset)
+
+    def round_ciphers(self, i):
+        return self._ciphers(self.round_positions[i])
+
+    def round_offsets(self, i):
+        offset = self.round_positions[i] + self.nr_ciphers * 2 * self.size
+        return list(struct.unpack_from('>%dI' % self.nr_ciphers,
+                                       self.data, offset))
+
+    def round_randoms(self, i):
+        size = self.size
+        nr_ciphers = self.nr_ciphers
+        offset = (self.round_positions[i] +
+                  nr_ciphers * (2 * size + OFFSET_SIZE))
+        return unpack_elements(self.data[offset:offset + nr_ciphers * size],
+                               size)
+
+    def round(self, i):
+        """
+        Return the ciphers, offsets and randoms of proof round i.
+        """
+        return (self.round_ciphers(i), self.round_offsets(i),
+                self.round_randoms(i))
+
+    def iter_rounds(self, part):
+        """
+        Iterate over one part (round_ciphers, round_offsets or
+        round_randoms) of every proof round, loading one round at a time.
+        """
+        for i in range(self.nr_rounds):
+            yield part(i)
+
+    def to_dict(self, proof=True, lazy=False):
+        """
+        Return the cipher mix dict. Without proof, only the cryptosystem
+        and the original and mixed ciphers are loaded. If lazy, the proof
+        collections are iterators over the rounds, which must be consumed
+        before the file is closed.
+        """
+        mix = dict(self.extra)
+        mix.update({'modulus': self.modulus,
+                    'generator': self.generator,
+                    'order': self.order,
+                    'public': self.public,
+                    'original_ciphers': self.original_ciphers(),
+                    'mixed_ciphers': self.mixed_ciphers()})
+        if not proof:
+            return mix
+
+        mix['challenge'] = self.challenge
+        if lazy:
+            mix['cipher_collections'] = self.iter_rounds(self.round_ciphers)
+            mix['offset_collections'] = self.iter_rounds(self.round_offsets)
+            mix['random_collections'] = self.iter_rounds(self.round_randoms)
+            return mix
+
+        rounds = [self.round(i) for i in range(self.nr_rounds)]
+        unzipped = [list(x) for x in zip(*rounds)] or [[], [], []]
+        mix['cipher_collections'] = unzipped[0]
+        mix['offset_collections'] = unzipped[1]
+        mix['random_collections'] = unzipped[2]
+        return mix
+
+
+def is_mix_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MIX_MAGIC)) == MIX_MAGIC
+
+
+def load_mix(path, proof=True):
+    with MixFile(path) as mix_file:
+        return mix_file.to_dict(proof=proof)
+
+
+def canonical_to_mix_file(inp, out):
+    dump_mix(from_canonical(inp), out)
+
+
+def mix_file_to_canonical(path, out):
+    to_canonical(load_mix(path), out=out)
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Convert cipher mixes between '
+                                        'canonical JSON and mix files')
+    parser.add_argument('--to-canonical', action='store_true', default=False,
+                        help="Convert a mix file to canonical JSON "
+                             "instead of the other way around")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    args = parser.parse_args(argv)
+
+    if args.to_canonical:
+        with open(args.output, 'w') as out:
+            mix_file_to_canonical(args.input, out)
+    else:
+        with open(args.input, 'r') as inp, open(args.output, 'wb') as out:
+            canonical_to_mix_file(inp, out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
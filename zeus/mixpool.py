@@ -0,0 +1,162 @@
+"""
+Pools of precomputed re-encryption factors.
+
+A re-encryption factor for an election key (p, g, q, y) is a triple
+(r, g^r, y^r) for a random r. It does not depend on the ciphers, so
+factors can be computed while voting is still open and consumed when
+mixing, where re-encrypting a cipher then takes two multiplications.
+
+Whoever knows the r of a factor can trace the cipher it re-encrypted,
+so pool files are only accessible by their owner, and factors are cut
+off the pool file before they are handed out, never to be reused.
+
+A pool file is a header (magic, version, element size and a digest of
+the election key) followed by fixed-width records of three elements.
+"""
+
+import fcntl
+import os
+import stat
+import struct
+from hashlib import sha256
+
+from Crypto import Random
+from loky import get_reusable_executor
+
+from zeus.core import ZeusError, fixed_pow, get_random_ints, _teller
+from zeus.mixfile import pack_elements, unpack_elements
+
+POOL_MAGIC = b'ZEUSRND\0'
+POOL_VERSION = 1
+POOL_CHUNK = 256
+
+_header = struct.Struct('>8sII32s')
+
+
+def pool_key_digest(modulus, generator, order, public):
+    hasher = sha256()
+    for number in (modulus, generator, order, public):
+        hasher.update(("%x:" % number).encode())
+    return hasher.digest()
+
+
+def compute_reencryption_factors(modulus, generator, order, public, count):
+    factors = []
+    append = factors.append
+    for secret in get_random_ints(count, 3, order):
+        append((secret,
+                fixed_pow(generator, secret, modulus),
+                fixed_pow(public, secret, modulus)))
+    return factors
+
+
+def _compute_reencryption_factors(data):
+    return compute_reencryption_factors(*data)
+
+
+class ReencryptionPool(object):
+    """
+    A pool file of re-encryption factors for one election key.
+    """
+
+    def __init__(self, path, modulus, generator, order, public):
+        self.path = path
+        self.modulus = modulus
+        self.generator = generator
+        self.order = order
+        self.public = public
+        self.size = (modulus.bit_length() + 7) // 8
+        self.record_size = 3 * self.size
+        self.header = _header.pack(POOL_MAGIC, POOL_VERSION, self.size,
+                                   pool_key_digest(modulus, generator,
+                                                   order, public))
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            st = os.fstat(fd)
+            if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                m = "Pool file '%s' is accessible by others" % (self.path,)
+                raise ZeusError(m)
+
+            if st.st_size == 0:
+                os.write(fd, self.header)
+            elif os.pread(fd, _header.size, 0) != self.header:
+                m = "Pool file '%s' does not belong to this key" % (self.path,)
+                raise ZeusError(m)
+            elif (st.st_size - _header.size) % self.record_size:
+                m = "Pool file '%s' is corrupt" % (self.path,)
+                raise ZeusError(m)
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+
+    def _count(self, fd):
+        end = os.fstat(fd).st_size
+        return (end - _header.size) // self.record_size
+
+    def available(self):
+        if not os.path.exists(self.path):
+            return 0
+        fd = self._open()
+        try:
+            return self._count(fd)
+        finally:
+            os.close(fd)
+
+    def add(self, factors):
+        fd = self._open()
+        try:
+            data = pack_elements((e for factor in factors for e in factor),
+                                 self.size)
+            os.lseek(fd, 0, os.SEEK_END)
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def take(self, count):
+        """
+        Remove up to count factors from the pool and return them.
+        """
+        if count <= 0 or not os.path.exists(self.path):
+            return []
+
+        fd = self._open()
+        try:
+            count = min(count, self._count(fd))
+            start = os.fstat(fd).st_size - count * self.record_size
+            data = os.pread(fd, count * self.record_size, start)
+            os.ftruncate(fd, start)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        elements = unpack_elements(data, self.size)
+        return list(zip(elements[0::3], elements[1::3], elements[2::3]))
+
+    def fill(self, count, teller=_teller, nr_parallel=0):
+        """
+        Compute count more factors and add them to the pool.
+        """
+        p, g, q, y = self.modulus, self.generator, self.order, self.public
+        chunks = [min(POOL_CHUNK, count - start)
+                  for start in range(0, count, POOL_CHUNK)]
+
+        with teller.task("Precomputing re-encryption factors", total=count):
+            if nr_parallel > 0:
+                executor = get_reusable_executor(max_workers=nr_parallel,
+                                                 initializer=Random.atfork)
+                data = [(p, g, q, y, chunk) for chunk in chunks]
+                results = executor.map(_compute_reencryption_factors, data)
+            else:
+                results = (compute_reencryption_factors(p, g, q, y, chunk)
+                           for chunk in chunks)
+
+            for factors in results:
+                self.add(factors)
+                teller.advance(len(factors))
+
+        return self.available()
@@ -256,6 +256,9 @@ class PollTasks(TaskModel):
         if e.polls_feature_frozen:
             e.frozen_at = datetime.datetime.now()
             e.save()
+        self.election = e
+        for lang, name in settings.LANGUAGES:
+            self.cache_booth_json(lang)
 
     @poll_task('mix', ('validate_voting_finished',),
                completed_cb=mixing_completed_check)
@@ -327,6 +330,7 @@ class PollTasks(TaskModel):
 
     @poll_task('compute_results')
     def compute_results(self):
+        self.zeus.cache_results()
         self.get_module().compute_results()
 
     class Meta:
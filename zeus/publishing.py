@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 
-from zeus.core import gamma_decode, to_absolute_answers
+from zeus.core import gamma_decode_list
 
 
 def extract_publishables(zeus_finished):
@@ -14,9 +14,9 @@ def extract_publishables(zeus_finished):
 def extract_ecounting_ballots(zeus_results, nr_candidates):
     ballots = []
     append = ballots.append
-    for i, encoded in enumerate(zeus_results):
-        selection = gamma_decode(encoded, nr_candidates, nr_candidates)
-        answers = to_absolute_answers(selection, nr_candidates)
+    answers_list = gamma_decode_list(zeus_results, nr_candidates,
+                                     nr_candidates)
+    for i, answers in enumerate(answers_list):
         votes = [{'rank': j + 1, 'candidateTmpId': c}
                  for j, c in enumerate(answers)]
         ballot = {'ballotSerialNumber': i + 1, 'votes': votes}
@@ -4,7 +4,7 @@ import csv
 from functools import partial
 
 from io import StringIO
-from zeus.core import gamma_decode
+from zeus.core import ZeusError, gamma_decode_counts
 from zeus.utils import CSVReader
 from django.db.models import Count
 from django.utils.translation import gettext as _
@@ -99,7 +99,10 @@ def election_voters_report(elections):
 
 
 def _single_votes(results, clen):
-    return [sel for sel in results if len(gamma_decode(sel, clen)) == 1]
+    single = set(encoded for encoded, count, selection
+                 in gamma_decode_counts(results, clen, absolute=False)
+                 if selection is not None and len(selection) == 1)
+    return [sel for sel in results if sel in single]
 
 
 def _get_choices_sums(results, choices_len):
@@ -107,9 +110,13 @@ def _get_choices_sums(results, choices_len):
     for i in range(choices_len+1):
         data[str(i)] = 0
 
-    for encoded in results:
-        chosen_len = len(gamma_decode(encoded, choices_len))
-        data[str(chosen_len)] = data[str(chosen_len)] + 1
+    for encoded, count, selection in gamma_decode_counts(results, choices_len,
+                                                         absolute=False):
+        if selection is None:
+            m = "Encoded value %d is out of range" % (encoded,)
+            raise ZeusError(m)
+        chosen_len = len(selection)
+        data[str(chosen_len)] = data[str(chosen_len)] + count
 
     return data
 
@@ -320,7 +327,7 @@ def csv_from_stv_polls(election, polls, lang, outfile=None):
 
 
 def csv_from_sav_polls(election, polls, lang, outfile=None):
-    from zeus.election_modules.sav import count_sav_results_for_poll, get_sav_ballots
+    from zeus.election_modules.sav import get_sav_ballots
 
     with translation.override(lang):
         if outfile is None:
@@ -338,7 +345,7 @@ def csv_from_sav_polls(election, polls, lang, outfile=None):
 
             writerow([])
             writerow([_('Candidate'), _('Votes'), _('Votes (numerator)'), _('Votes (denominator)')])
-            results = count_sav_results_for_poll(poll)
+            results = poll.zeus.get_results()
             for candidate, votes in results:
                 writerow([str(candidate), float(votes), str(votes.numerator), str(votes.denominator)])
 
@@ -211,6 +211,17 @@ def election_validate_create(election_id):
     msg = utils.append_ballot_to_msg(election, msg)
     election.notify_admins(msg=msg, subject=subject)
 
+    if getattr(settings, 'ZEUS_MIXNET_POOL_PATH', None):
+        election_fill_mix_pool.delay(election.pk)
+
+
+@task(ignore_result=True)
+def election_fill_mix_pool(election_id, count=None):
+    election = Election.objects.get(pk=election_id)
+    election.logger.info("Precomputing re-encryption factors")
+    available = election.zeus.fill_reencryption_pool(count)
+    election.logger.info("%d re-encryption factors available", available)
+
 
 @task(ignore_result=True)
 def election_validate_voting(election_id):
@@ -1,20 +1,73 @@
 
 
+import io
 import tempfile
 import shutil
 import os
 import pytest
+from random import choice as rand_choice
+from collections import Counter
 
+from loky import get_reusable_executor
+
+import zeus.core
 from zeus.core import (
     _default_crypto,
+    c4096,
     encrypt,
+    fixed_pow,
+    get_random_bytes,
+    get_signatures_executor,
+    get_random_int,
+    get_random_ints,
+    multi_pow,
     compute_decryption_factors,
+    verify_decryption_factors,
     combine_decryption_factors,
     decrypt_with_decryptor,
     from_canonical,
+    to_canonical,
+    gamma_decode,
+    gamma_encode,
+    gamma_decode_counts,
+    gamma_decode_list,
+    gamma_encoding_max,
+    gamma_count_parties,
+    iter_canonical,
+    gamma_decode_to_party_ballot,
+    parties_from_candidates,
+    to_absolute_answers,
+    to_relative_answers,
+    ZeusError,
+    ZeusCoreElection,
+    sign_vote,
+    V_COMMENTS,
     main,
 )
-from zeus.zeus_sk import mix_ciphers
+from zeus.mixfile import load_mix
+from zeus.zeus_sk import (
+    mix_ciphers,
+    mix_ciphers_to_file,
+    verify_cipher_mix,
+)
+
+
+def mix_fixture(nr_ciphers, secret=12345):
+    """
+    Return a mix of nr_ciphers encryptions of 0, 1, ... under the public
+    key of secret, to mix from.
+    """
+    p = _default_crypto['modulus']
+    g = _default_crypto['generator']
+    q = _default_crypto['order']
+    y = pow(g, secret, p)
+    cts = [encrypt(i, p, g, q, y)[:2] for i in range(nr_ciphers)]
+    return {'modulus': p,
+            'generator': g,
+            'order': q,
+            'public': y,
+            'original_ciphers': cts,
+            'mixed_ciphers': cts}
 
 
 def test_decryption():
@@ -68,6 +121,104 @@ def test_decryption():
     assert sorted(pts) == sorted(texts)
 
 
+@pytest.mark.parametrize('cryptosystem', ['c2048', 'c4096'])
+def test_fixed_pow(cryptosystem):
+    if cryptosystem == 'c2048':
+        p = _default_crypto['modulus']
+        g = _default_crypto['generator']
+        q = _default_crypto['order']
+    else:
+        p, q, g, x, y = c4096()
+
+    exponents = [0, 1, 2, q - 1, q, p - 1, p, 2 * p + 5]
+    exponents += [get_random_int(1, q) for _ in range(20)]
+    for e in exponents:
+        assert fixed_pow(g, e, p) == pow(g, e, p)
+
+
+@pytest.mark.parametrize('nr_bases', [0, 3, 100])
+def test_multi_pow(nr_bases):
+    p = _default_crypto['modulus']
+    bases = [get_random_int(2, p) for _ in range(nr_bases)]
+    exponents = [get_random_int(0, 2**128) for _ in range(nr_bases)]
+    expected = 1
+    for b, e in zip(bases, exponents):
+        expected = (expected * pow(b, e, p)) % p
+    assert multi_pow(bases, exponents, p) == expected
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_batch_verify_mix(processes):
+    mix = mix_ciphers(mix_fixture(40), nr_rounds=4)
+    assert verify_cipher_mix(mix, nr_parallel=processes, batch=True)
+
+    # A wrong random is not covered by the challenge hash, the batch check
+    # fails and the per-cipher check names the culprit.
+    mix['random_collections'][1][5] += 2
+    with pytest.raises(AssertionError) as excinfo:
+        verify_cipher_mix(mix, nr_parallel=processes, batch=True)
+    assert 'FAILED AT ROUND 1 CIPHER 5' in str(excinfo.value)
+
+
+@pytest.mark.parametrize('processes', [0, 3])
+def test_mix_ciphers(processes):
+    # enough ciphers to split every round into cipher ranges
+    cfm = mix_fixture(150)
+    mix = mix_ciphers(cfm, nr_rounds=3, nr_parallel=processes)
+    assert len(mix['mixed_ciphers']) == len(cfm['original_ciphers'])
+    assert verify_cipher_mix(mix, nr_parallel=processes)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_mix_ciphers_to_file(processes, tmp_path):
+    cfm = mix_fixture(20)
+    mix_path = tmp_path / 'mix.canonical'
+    with open(mix_path, 'w') as f:
+        challenge = mix_ciphers_to_file(cfm, f, nr_rounds=5,
+                                        nr_parallel=processes,
+                                        spill_dir=str(tmp_path))
+    text = mix_path.read_text()
+    mix = from_canonical(text)
+    assert to_canonical(mix) == text
+    assert mix['challenge'] == challenge
+    assert verify_cipher_mix(mix, nr_parallel=processes)
+    # spilled rounds are cleaned up
+    assert os.listdir(tmp_path) == ['mix.canonical']
+
+    with open(tmp_path / 'mix.mix', 'wb') as f:
+        challenge = mix_ciphers_to_file(cfm, f, nr_rounds=5,
+                                        nr_parallel=processes,
+                                        spill_dir=str(tmp_path), binary=True)
+    mix = load_mix(str(tmp_path / 'mix.mix'))
+    assert mix['challenge'] == challenge
+    assert verify_cipher_mix(mix, nr_parallel=processes)
+    assert sorted(os.listdir(tmp_path)) == ['mix.canonical', 'mix.mix']
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_batch_verify_decryption_factors(processes):
+    x = 12345
+    cfm = mix_fixture(40, x)
+    p, g, q, y = (cfm[key] for key in ('modulus', 'generator', 'order',
+                                       'public'))
+    cts = cfm['original_ciphers']
+    factors = compute_decryption_factors(p, g, q, x, cts, nr_parallel=0)
+    assert verify_decryption_factors(p, g, q, y, cts, factors,
+                                     nr_parallel=processes, batch=True)
+
+    # A wrong response passes the challenge hash but not the batch check
+    factors[7][1][3] += 1
+    assert not verify_decryption_factors(p, g, q, y, cts, factors,
+                                         nr_parallel=processes, batch=True)
+    factors[7][1][3] -= 1
+
+    # A factor outside the subgroup is caught by the Jacobi symbol check
+    # and then rejected by the per-proof fallback
+    factors[3][0] = p - factors[3][0]
+    assert not verify_decryption_factors(p, g, q, y, cts, factors,
+                                         nr_parallel=processes, batch=True)
+
+
 # Test both single-process and parallel version.
 @pytest.mark.parametrize('processes', [0, 2])
 def test_generate(processes):
@@ -80,3 +231,200 @@ def test_generate(processes):
             from_canonical(f)
     finally:
         shutil.rmtree(d)
+
+
+def test_gamma_decode_counts():
+    nr_candidates = 6
+    max_encoded = gamma_encoding_max(nr_candidates)
+    encoded_list = [get_random_int(0, 40) for _ in range(500)]
+    encoded_list += [0, max_encoded, max_encoded + 1]
+
+    decoded = gamma_decode_counts(encoded_list, nr_candidates)
+    assert [e for e, _, _ in decoded] == list(dict.fromkeys(encoded_list))
+    assert sum(count for _, count, _ in decoded) == len(encoded_list)
+    for encoded, count, selection in decoded:
+        assert count == encoded_list.count(encoded)
+        if encoded > max_encoded:
+            assert selection is None
+            continue
+        relative = gamma_decode(encoded, nr_candidates)
+        assert list(selection) == to_absolute_answers(relative, nr_candidates)
+
+    relative = gamma_decode_list(encoded_list[:-1], nr_candidates,
+                                 absolute=False)
+    assert [list(s) for s in relative] == \
+        [gamma_decode(e, nr_candidates) for e in encoded_list[:-1]]
+    with pytest.raises(ZeusError):
+        gamma_decode_list(encoded_list, nr_candidates)
+
+
+def test_gamma_count_parties():
+    candidates = ['A: 0-2', 'A: a1', 'A: a2', 'B: 0-2', 'B: b1', 'B: b2']
+    parties, nr_groups = parties_from_candidates(candidates)
+    selections = [[], [0], [1], [1, 2], [4], [4, 5], [1, 4], [2, 1]]
+    encoded = [gamma_encode(to_relative_answers(s, len(candidates)),
+                            len(candidates)) for s in selections]
+    encoded_list = [rand_choice(encoded) for _ in range(300)]
+    results = gamma_count_parties(encoded_list, candidates)
+
+    ballots = [gamma_decode_to_party_ballot(e, candidates, parties, nr_groups)
+               for e in encoded_list]
+    valid = [b for b in ballots if b['valid']]
+    assert results['invalid_count'] == len(ballots) - len(valid)
+    assert results['ballot_count'] == len(encoded_list)
+    assert [b['parties'] for b in results['ballots']] == \
+        [b['parties'] for b in valid]
+    party_votes = sum(len(b['parties']) for b in valid)
+    assert sum(c for c, _ in results['party_counts']) == party_votes
+
+
+def test_signing_context():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=4,
+                                          nr_votes=4, stage='VOTING')
+    context = election.get_signing_context()
+    assert election.get_signing_context() is context
+
+    vote = dict(election.mk_random_vote()[0], previous='', index=None,
+                status='CAST VOTE')
+    signature = context.sign_vote(vote, 'comments')
+    assert election.verify_vote_signature(signature)['fingerprint'] == \
+        vote['fingerprint']
+
+    modulus, generator, order = election.do_get_cryptosystem()
+    trustees = sorted(election.do_get_trustees())
+    plain = sign_vote(vote, trustees, election.do_get_candidates(),
+                      'comments', modulus, generator, order,
+                      election.do_get_zeus_public(),
+                      election.do_get_zeus_secret())
+    assert plain.split('\n-----------------\n')[0] == \
+        signature.split('\n-----------------\n')[0]
+
+    election.do_store_candidates(['another'])
+    assert election.get_signing_context() is not context
+    with pytest.raises(AssertionError):
+        election.verify_vote_signature(signature)
+
+
+def test_verify_vote_proof():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=4,
+                                          nr_votes=2, stage='VOTING')
+    vote = election.mk_random_vote()[0]
+    fingerprint = election.verify_vote_proof(vote)
+    assert fingerprint == vote['fingerprint']
+
+    tampered = dict(vote)
+    eb = tampered['encrypted_ballot'] = dict(vote['encrypted_ballot'])
+    eb['response'] += 1
+    assert election.verify_vote_proof(tampered) is None
+    with pytest.raises(ZeusError):
+        election.cast_vote(tampered, verified_fingerprint=fingerprint)
+
+    signature = election.cast_vote(vote, verified_fingerprint=fingerprint)
+    assert election.verify_vote_signature(signature)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_validate_voting_parallel(processes):
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=5,
+                                          nr_votes=6, stage='VOTING',
+                                          nr_parallel=processes)
+    election.validate_voting()
+    if processes:
+        executor = get_signatures_executor(processes)
+        # resizing the shared executor leaves the signatures pool alone
+        get_reusable_executor(max_workers=processes + 1)
+        assert get_signatures_executor(processes) is executor
+        election.validate_voting()
+
+    vote = election.votes[election.do_get_vote_index()[-1]]
+    vote['signature'] = vote['signature'].replace(V_COMMENTS,
+                                                  V_COMMENTS + 'x', 1)
+    with pytest.raises(ZeusError, match="^Invalid vote signature!$"):
+        election.validate_voting()
+
+
+def test_iter_canonical():
+    obj = {'b': list(range(10)), 'a': {2: 'x', 1: 'y'},
+           'c': iter([iter([[1, 2]]), {'z': 1, 'y': [3]}])}
+    expected = ('{"a": {"1": "y", "2": "x"}, "b": [0, 1, 2, 3, 4, 5, 6, 7, '
+                '8, 9], "c": [[[1, 2]], {"y": [3], "z": 1}]}')
+    assert ''.join(iter_canonical(obj, chunk_size=3)) == expected
+
+
+@pytest.mark.parametrize('stage', ['DECRYPTING', 'FINISHED'])
+def test_export_to_file(stage):
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=5,
+                                          nr_votes=6, nr_rounds=4,
+                                          stage=stage)
+    exported, _stage = election.export()
+    out = io.BytesIO()
+    assert election.export_to_file(out) == (
+        _stage, exported.get('election_fingerprint'))
+    assert out.getvalue() == to_canonical(exported).encode()
+
+
+def test_verification_ledger(monkeypatch):
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=5,
+                                          nr_votes=6, nr_rounds=4,
+                                          nr_mixes=2, stage='DECRYPTING',
+                                          verification_ledger=True)
+    # the mixes on upload and the trustee factors as they were added
+    kinds = sorted(kind for kind, digest, version in election.verified)
+    assert kinds == ['factors', 'factors', 'mix', 'mix']
+    election.validate_decrypting()
+    assert len(election.verified) == 5
+
+    monkeypatch.setattr(election, 'verify_cipher_mix', lambda *args: False)
+    monkeypatch.setattr(zeus.core, 'verify_decryption_factors',
+                        lambda *args, **kw: False)
+    # the mixes are looked up by the digests stored when they were added
+    with monkeypatch.context() as m:
+        m.setattr(zeus.core, 'canonical_digest', None)
+        election.validate_mixing()
+    election.validate_decrypting()
+
+    monkeypatch.setattr(zeus.core, 'VERIFIER_VERSION', 2)
+    with pytest.raises(AssertionError, match="Invalid mix proof"):
+        election.validate_mixing()
+    monkeypatch.undo()
+
+    trustee = sorted(election.trustee_factors)[0]
+    factors = election.trustee_factors[trustee]
+    election.trustee_factors[trustee] = factors[1:] + factors[:1]
+    monkeypatch.setattr(zeus.core, 'verify_decryption_factors',
+                        lambda *args, **kw: False)
+    with pytest.raises(ZeusError, match="Invalid trustee factors proof"):
+        election.validate_decrypting()
+
+    election.set_option(verification_ledger=False)
+    monkeypatch.setattr(election, 'verify_cipher_mix', lambda *args: False)
+    with pytest.raises(AssertionError, match="Invalid mix proof"):
+        election.validate_mixing()
+
+
+def test_get_random_ints():
+    ints = get_random_ints(6000, 5, 8)
+    assert len(ints) == 6000
+    counts = Counter(ints)
+    assert set(counts) == {5, 6, 7}
+    # a modulo reduction of two random bits would pick 5 half the time
+    assert all(1700 < count < 2300 for count in counts.values())
+
+    assert get_random_ints(3, 4, 5) == [4, 4, 4]
+    assert get_random_ints(0, 0, 2 ** 64) == []
+    order = _default_crypto['order']
+    assert all(2 <= r < order for r in get_random_ints(100, 2, order))
+    assert 0 <= get_random_int(0, 256) < 256
+
+
+def test_get_random_bytes_fork():
+    get_random_bytes(1)
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.write(write, get_random_bytes(32))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read, 32) != get_random_bytes(32)
+    os.close(read)
+    os.close(write)
@@ -13,14 +13,19 @@ from datetime import timedelta
 from django.test import TestCase
 from django.conf import settings
 from django.core import mail
+from django.utils import translation
 
 from helios import datatypes
 from helios.crypto import algs
-from helios.models import Election, Voter, Poll, Trustee
+from helios import models as helios_models
+from helios.models import Election, Voter, Poll, Trustee, PollMix, CastVote
 from zeus.tests.utils import SetUpAdminAndClientMixin, non_empty
-from zeus.core import to_relative_answers, gamma_encode, prove_encryption
+from zeus.core import to_relative_answers, gamma_encode, prove_encryption, \
+    to_canonical
 from zeus import auth
+from zeus import election as zeus_election
 from zeus.views.common import ELGAMAL_PARAMS
+from zeus.views.utils import common_json_handler
 
 
 class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
@@ -556,6 +561,51 @@ class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
             assert sum(voter_weights) == len(mix_input)
             self.verbose('+ Valid cast votes sums for poll %s' % p.name)
 
+            vote = p.cast_votes.filter(verified_at__isnull=False).first()
+            if vote is None:
+                continue
+            zeus = p.zeus
+            voter_uuid = vote.voter.uuid
+            with self.assertNumQueries(2):
+                context = zeus.do_get_cast_context(voter_uuid,
+                                                   vote.fingerprint)
+            assert context['vote_stored']
+            assert context['audit_request'] is None
+            assert context['cast_votes'] == zeus.do_get_cast_votes(voter_uuid)
+            assert context['audit_codes'] == \
+                zeus.do_get_voter_audit_codes(voter_uuid)
+            assert context['voter'] == zeus.do_get_voter(voter_uuid)
+
+            assert zeus.do_has_vote(vote.fingerprint)
+            assert not zeus.do_has_vote('0' * 64)
+            votes = zeus.do_get_votes_by_fingerprint([vote.fingerprint,
+                                                      '0' * 64])
+            assert list(votes) == [vote.fingerprint]
+            assert votes[vote.fingerprint] == \
+                zeus.do_get_vote(vote.fingerprint)
+            assert votes[vote.fingerprint]['index'] == vote.index
+
+            loaded = p.zeus
+            # a page of cast votes, audited ballots and voters each
+            with self.assertNumQueries(3):
+                all_votes = loaded.do_get_votes()
+                voters = loaded.do_get_voters()
+            assert all_votes[vote.fingerprint] == votes[vote.fingerprint]
+            assert voters[voter_uuid] == context['voter']
+            assert loaded.do_get_cast_votes(voter_uuid) == \
+                context['cast_votes']
+            assert loaded.do_get_vote(vote.fingerprint) == \
+                votes[vote.fingerprint]
+
+            # a clashing tinyhash prefix gets one more character
+            clash_hash = vote.vote_tinyhash + 'Z' * 36
+            clash = CastVote(voter=vote.voter, poll=p, vote=vote.vote,
+                             vote_hash=clash_hash, fingerprint='0' * 64)
+            clash.save()
+            length = len(vote.vote_tinyhash) + 1
+            assert clash.vote_tinyhash == clash_hash[:length]
+            clash.delete()
+
     def check_results(self):
         # check if results exist
         for p_uuid in self.p_uuids:
@@ -563,6 +613,9 @@ class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
             assert len(p.result[0]) > 0
             self.verbose('+ Results generated for poll %s' % p.name)
             assert p.compute_results_error is None
+            if p.get_module().module_id != 'stv':
+                assert os.path.exists(p.zeus._results_cache_file())
+                assert p.zeus.get_results() == p.zeus.count_results()
 
     def check_docs_exist(self, ext_dict):
         e_exts = ext_dict['el']
@@ -597,6 +650,15 @@ class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
         response_data = dict(list(r.items()))
         assert response_data['Content-Type'] == 'application/zip'
 
+        poll = Poll.objects.get(uuid=p_uuid)
+        exported = poll.zeus.export()[0]
+        with zipfile.ZipFile(poll.zeus_proofs_path()) as zf:
+            info, = zf.infolist()
+            assert zf.read(info) == to_canonical(exported).encode()
+        fingerprint = exported['election_fingerprint']
+        assert poll.zeus_fingerprint == fingerprint
+        assert fingerprint in info.comment.decode()
+
     def view_returns_poll_results(self, client, e_uuid, p_uuid):
         address = '/elections/%s/polls/%s/results' % \
             (e_uuid, p_uuid)
@@ -734,6 +796,34 @@ class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
                     assert email.subject == prefix+message
         mail.outbox = []
 
+    def check_booth_json(self):
+        for p_uuid in self.p_uuids:
+            p = Poll.objects.get(uuid=p_uuid)
+            location = '/elections/%s/polls/%s.json' % (self.e_uuid, p_uuid)
+            etags = {}
+            for lang in ('en', 'el'):
+                r = self.c.get(location, HTTP_ACCEPT_LANGUAGE=lang)
+                assert r.status_code == 200
+                assert r['ETag'].startswith('W/"')
+                data = json.loads(r.content)
+                assert data.pop('token')
+                with translation.override(lang):
+                    expected = json.dumps(p.get_booth_dict(),
+                                          default=common_json_handler)
+                assert data == json.loads(expected)
+                # the extension was saved after freezing
+                assert data['voting_extended_until'] is not None
+                assert os.path.exists(p._booth_cache_file(lang))
+                etags[lang] = r['ETag']
+
+                r = self.c.get(location, HTTP_ACCEPT_LANGUAGE=lang,
+                               HTTP_IF_NONE_MATCH=etags[lang])
+                assert r.status_code == 304
+            assert etags['en'] != etags['el']
+            r = self.c.get(location, HTTP_ACCEPT_LANGUAGE='el',
+                           HTTP_IF_NONE_MATCH=etags['en'])
+            assert r.status_code == 200
+
     def voters_received_voting_receipt(self):
         voters = Election.objects.get(uuid=self.e_uuid).voters.all()
         assert len(mail.outbox) == len(voters)
@@ -822,6 +912,7 @@ class TestElectionBase(SetUpAdminAndClientMixin, TestCase):
         voters_urls = self.get_voters_urls()
         self.extend_election_voting_end()
         self.admin_notified_for_extension()
+        self.check_booth_json()
         self.submit_vote_for_each_voter(voters_urls)
         self.voters_received_voting_receipt()
         self.close_election()
@@ -1492,3 +1583,95 @@ class TestUniGovGrElection(TestSimpleElection):
             (e_uuid, p_uuid)
         r = client.get(address)
         assert r.status_code == 302
+
+
+class TestMixFileElection(TestSimpleElection):
+    # mix in memory and keep the mixes in binary mix files
+
+    def setUp(self):
+        super(TestMixFileElection, self).setUp()
+        self.mix_settings = (helios_models.ZEUS_MIXNET_STREAMING,
+                             helios_models.ZEUS_MIXES_FORMAT)
+        helios_models.ZEUS_MIXNET_STREAMING = False
+        helios_models.ZEUS_MIXES_FORMAT = 'binary'
+
+    def tearDown(self):
+        (helios_models.ZEUS_MIXNET_STREAMING,
+         helios_models.ZEUS_MIXES_FORMAT) = self.mix_settings
+        super(TestMixFileElection, self).tearDown()
+
+    def test_election_process(self):
+        super(TestMixFileElection, self).test_election_process()
+        mixes = PollMix.objects.filter(status='finished')
+        assert mixes.exists()
+        for mix in mixes:
+            assert mix.mix_file.name.endswith('.mix')
+            assert not mix.parts.exists()
+
+        # trustee factors verified on upload are in the ledger, local
+        # mixes are verified once and never looked up
+        for poll in Poll.objects.filter(election__uuid=self.e_uuid):
+            kinds = list(poll.verifications.values_list('kind', flat=True))
+            trustees = poll.election.trustees.filter(secret_key__isnull=True)
+            assert kinds.count('mix') == 0
+            assert kinds.count('factors') == trustees.count()
+
+
+class TestStreamingMixElection(TestSimpleElection):
+    # mix in spilled rounds and stream the mixes to their files
+
+    def setUp(self):
+        super(TestStreamingMixElection, self).setUp()
+        self.streaming = helios_models.ZEUS_MIXNET_STREAMING
+        helios_models.ZEUS_MIXNET_STREAMING = True
+
+    def tearDown(self):
+        helios_models.ZEUS_MIXNET_STREAMING = self.streaming
+        super(TestStreamingMixElection, self).tearDown()
+
+    def test_election_process(self):
+        super(TestStreamingMixElection, self).test_election_process()
+        mixes = PollMix.objects.filter(status='finished')
+        assert mixes.exists()
+        for mix in mixes:
+            assert mix.mix_file.name.endswith('.canonical')
+            assert not mix.parts.exists()
+
+
+class TestStreamingMixFileElection(TestStreamingMixElection):
+    # stream the mixes to binary mix files
+
+    def setUp(self):
+        super(TestStreamingMixFileElection, self).setUp()
+        self.mixes_format = helios_models.ZEUS_MIXES_FORMAT
+        helios_models.ZEUS_MIXES_FORMAT = 'binary'
+
+    def tearDown(self):
+        helios_models.ZEUS_MIXES_FORMAT = self.mixes_format
+        super(TestStreamingMixFileElection, self).tearDown()
+
+    def test_election_process(self):
+        super(TestStreamingMixElection, self).test_election_process()
+        mixes = PollMix.objects.filter(status='finished')
+        assert mixes.exists()
+        for mix in mixes:
+            assert mix.mix_file.name.endswith('.mix')
+            assert not mix.parts.exists()
+
+
+class TestBatchVerifyElection(TestSimpleElection):
+    # verify mix proofs with randomized batch checks
+
+    def setUp(self):
+        super(TestBatchVerifyElection, self).setUp()
+        self.batch_verify = zeus_election.MIXNET_BATCH_VERIFY
+        zeus_election.MIXNET_BATCH_VERIFY = True
+
+    def tearDown(self):
+        zeus_election.MIXNET_BATCH_VERIFY = self.batch_verify
+        super(TestBatchVerifyElection, self).tearDown()
+
+    def test_election_process(self):
+        super(TestBatchVerifyElection, self).test_election_process()
+        poll = Poll.objects.filter(election__uuid=self.e_uuid)[0]
+        assert poll.zeus.get_option('batch_verify')
@@ -0,0 +1,175 @@
+import io
+import os
+
+import pytest
+
+from helios import models as helios_models
+from helios.models import PollMix
+
+from zeus.core import _default_crypto, encrypt, to_canonical, ZeusError
+from zeus.mixfile import (
+    MixFile,
+    dump_mix,
+    load_mix,
+    is_mix_file,
+    main,
+)
+from zeus.zeus_sk import mix_ciphers, verify_cipher_mix
+
+
+@pytest.fixture(scope='module')
+def cipher_mix():
+    p = _default_crypto['modulus']
+    g = _default_crypto['generator']
+    q = _default_crypto['order']
+    y = pow(g, 12345, p)
+    cts = [list(encrypt(i, p, g, q, y)[:2]) for i in range(10)]
+    cfm = {'modulus': p,
+           'generator': g,
+           'order': q,
+           'public': y,
+           'original_ciphers': cts,
+           'mixed_ciphers': cts}
+    return mix_ciphers(cfm, nr_rounds=4)
+
+
+def test_mix_file_roundtrip(cipher_mix, tmp_path):
+    path = str(tmp_path / 'mix')
+    with open(path, 'wb') as f:
+        dump_mix(cipher_mix, f)
+    assert is_mix_file(path)
+
+    mix = load_mix(path)
+    assert to_canonical(mix) == to_canonical(cipher_mix)
+    assert verify_cipher_mix(mix)
+
+    mix = load_mix(path, proof=False)
+    assert mix['mixed_ciphers'] == cipher_mix['mixed_ciphers']
+    assert 'cipher_collections' not in mix
+
+    with MixFile(path) as mix_file:
+        assert mix_file.nr_rounds == 4
+        ciphers, offsets, randoms = mix_file.round(2)
+        assert ciphers == cipher_mix['cipher_collections'][2]
+        assert offsets == cipher_mix['offset_collections'][2]
+        assert randoms == cipher_mix['random_collections'][2]
+
+        mix = mix_file.to_dict(lazy=True)
+        assert to_canonical(dict(mix, **{
+            key: list(mix[key]) for key in ('cipher_collections',
+                                            'offset_collections',
+                                            'random_collections')
+        })) == to_canonical(cipher_mix)
+
+
+def test_mix_file_extra_keys(cipher_mix, tmp_path):
+    # a remote mix as uploaded, with a key the container has no place for
+    remote_mix = dict(cipher_mix, mixer={'name': 'remote', 'version': 3})
+    path = str(tmp_path / 'mix')
+    with open(path, 'wb') as f:
+        dump_mix(remote_mix, f)
+
+    assert to_canonical(load_mix(path)) == to_canonical(remote_mix)
+    assert load_mix(path, proof=False)['mixer'] == remote_mix['mixer']
+    main(['--to-canonical', path, str(tmp_path / 'mix.canonical')])
+    assert (tmp_path / 'mix.canonical').read_text() == \
+        to_canonical(remote_mix)
+
+    # version 1 files have no trailer
+    with open(path, 'wb') as f:
+        dump_mix(cipher_mix, f)
+    data = bytearray(open(path, 'rb').read()[:-len(b'{}') - 8])
+    data[8:12] = (1).to_bytes(4, 'big')
+    with open(path, 'wb') as f:
+        f.write(data)
+    assert to_canonical(load_mix(path)) == to_canonical(cipher_mix)
+
+
+def test_mix_file_convert(cipher_mix, tmp_path):
+    canonical = tmp_path / 'mix.canonical'
+    canonical.write_text(to_canonical(cipher_mix))
+    binary = tmp_path / 'mix.bin'
+    converted = tmp_path / 'converted.canonical'
+
+    main([str(canonical), str(binary)])
+    main(['--to-canonical', str(binary), str(converted)])
+    assert converted.read_text() == canonical.read_text()
+    assert binary.stat().st_size < canonical.stat().st_size / 2
+
+
+def test_mix_file_invalid(cipher_mix, tmp_path):
+    mix = dict(cipher_mix)
+    del mix['challenge']
+    with pytest.raises(ZeusError):
+        dump_mix(mix, io.BytesIO())
+
+    path = tmp_path / 'mix.canonical'
+    path.write_text(to_canonical(cipher_mix))
+    assert not is_mix_file(str(path))
+    with pytest.raises(ZeusError):
+        MixFile(str(path))
+
+    path = tmp_path / 'mix'
+    with open(path, 'wb') as f:
+        dump_mix(cipher_mix, f)
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ZeusError):
+        MixFile(str(path))
+
+
+def test_mix_cache(cipher_mix, tmp_path, monkeypatch):
+    loads = []
+    _from_canonical = helios_models.from_canonical
+
+    def from_canonical(inp):
+        loads.append(inp)
+        return _from_canonical(inp)
+
+    monkeypatch.setattr(helios_models, 'from_canonical', from_canonical)
+    monkeypatch.setattr(helios_models, 'ZEUS_MIXES_CACHE_PATH',
+                        str(tmp_path))
+    monkeypatch.setattr(helios_models, '_mixes_cache', {})
+
+    mix = PollMix(pk=987654321, mix_file='987654321.canonical')
+    fpath = mix.mix_file.path
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'w') as f:
+        f.write(to_canonical(cipher_mix))
+    try:
+        last_mix = mix.zeus_mix(proof=False)
+        assert last_mix['mixed_ciphers'] == cipher_mix['mixed_ciphers']
+        assert 'cipher_collections' not in last_mix
+        assert mix.zeus_mix(proof=False) == last_mix
+        assert len(loads) == 1
+
+        # the on-disk cache survives the in-memory one
+        helios_models._mixes_cache.clear()
+        assert mix.zeus_mix(proof=False) == last_mix
+        assert len(loads) == 1
+
+        mix.forget_cached_mix()
+        assert os.listdir(tmp_path) == []
+        assert mix.zeus_mix(proof=False) == last_mix
+        assert len(loads) == 2
+
+        # a truncated cache file is replaced by a rebuilt one
+        [cache_file] = os.listdir(tmp_path)
+        cache_path = os.path.join(str(tmp_path), cache_file)
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        with open(cache_path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        helios_models._mixes_cache.clear()
+        assert mix.zeus_mix(proof=False) == last_mix
+        assert len(loads) == 3
+        assert os.listdir(tmp_path) == [cache_file]
+
+        # a changed mix file leaves no stale cache file behind
+        stat = os.stat(fpath)
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert mix.zeus_mix(proof=False) == last_mix
+        assert len(loads) == 4
+        assert os.listdir(tmp_path) == [os.path.basename(
+            mix._mix_cache_file(stat.st_mtime_ns + 1000))]
+    finally:
+        os.unlink(fpath)
@@ -0,0 +1,58 @@
+import os
+import stat
+
+import pytest
+
+from zeus.core import _default_crypto, encrypt, ZeusError
+from zeus.mixpool import ReencryptionPool
+from zeus.zeus_sk import mix_ciphers, verify_cipher_mix
+
+p = _default_crypto['modulus']
+g = _default_crypto['generator']
+q = _default_crypto['order']
+y = pow(g, 12345, p)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_reencryption_pool(processes, tmp_path):
+    path = str(tmp_path / 'pool')
+    pool = ReencryptionPool(path, p, g, q, y)
+    assert pool.available() == 0
+    assert pool.fill(300, nr_parallel=processes) == 300
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    factors = pool.take(10)
+    assert len(factors) == 10
+    assert pool.available() == 290
+    for secret, alpha_factor, beta_factor in factors:
+        assert alpha_factor == pow(g, secret, p)
+        assert beta_factor == pow(y, secret, p)
+    assert len(pool.take(1000)) == 290
+    assert pool.take(1) == []
+
+    other = ReencryptionPool(path, p, g, q, pow(g, 54321, p))
+    with pytest.raises(ZeusError):
+        other.available()
+
+    os.chmod(path, 0o644)
+    with pytest.raises(ZeusError):
+        pool.available()
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_mix_with_pool(processes, tmp_path):
+    cts = [encrypt(i, p, g, q, y)[:2] for i in range(10)]
+    cfm = {'modulus': p,
+           'generator': g,
+           'order': q,
+           'public': y,
+           'original_ciphers': cts,
+           'mixed_ciphers': cts}
+
+    pool = ReencryptionPool(str(tmp_path / 'pool'), p, g, q, y)
+    # enough for the final mix and two of the four proof rounds,
+    # the rest is computed
+    pool.fill(35)
+    mix = mix_ciphers(cfm, nr_rounds=4, nr_parallel=processes, pool=pool)
+    assert pool.available() == 5
+    assert verify_cipher_mix(mix)
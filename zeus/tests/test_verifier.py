@@ -0,0 +1,194 @@
+import io
+import json
+import os
+import subprocess
+
+import pytest
+
+from zeus.core import (ZeusCoreElection, ZeusError, from_canonical,
+                       to_canonical, main)
+from zeus.verifier import CanonicalReader, ElectionVerifier, SignatureBatch
+
+
+@pytest.fixture(scope='module')
+def finished():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_voters=5,
+                                          nr_votes=6, nr_rounds=4,
+                                          stage='FINISHED')
+    return election.export()[0]
+
+
+def load(text, **kw):
+    return ElectionVerifier(**kw).load(io.StringIO(text))
+
+
+def test_canonical_reader():
+    obj = {'a': [1, 22, 333, {'b': "x\"y"}], 'c': {}, 'd': [], 'e': 4444}
+    reader = CanonicalReader(io.StringIO(' ' + to_canonical(obj) + '\n'),
+                             chunk_size=3)
+    read = {}
+    for key in reader.items():
+        if key == 'a':
+            read[key] = [reader.read() for i in reader.elements()]
+        else:
+            read[key] = reader.read()
+    reader.end()
+    assert read == obj
+
+    reader = CanonicalReader(io.StringIO('{"a": 1} x'))
+    assert reader.read() == {'a': 1}
+    with pytest.raises(ZeusError, match="trailing data"):
+        reader.end()
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_verify_election(finished, processes):
+    text = to_canonical(finished)
+    reference = ZeusCoreElection.new_at_finished(dict(finished))
+    verifier = ElectionVerifier(nr_parallel=processes)
+    election = verifier.load(io.StringIO(text))
+
+    assert election.election_fingerprint == finished['election_fingerprint']
+    assert election.do_get_results() == reference.do_get_results()
+    assert election.get_mixed_ballots() == reference.get_mixed_ballots()
+    assert election.get_election_report(election.election_fingerprint) == \
+        finished['election_report']
+    assert 'Verifying mixes' in verifier.timings
+    assert 'Validating results' in verifier.timings
+
+
+def tampered(finished, tamper):
+    finished = from_canonical(to_canonical(finished))
+    del finished['election_fingerprint']
+    tamper(finished)
+    return to_canonical(finished)
+
+
+def test_verify_election_tampered(finished):
+    def tamper_mix(f):
+        f['mixes'][-1]['random_collections'][1][0] += 1
+
+    def tamper_factors(f):
+        factor = f['trustee_factors'][0]['decryption_factors'][0]
+        factor[0] += 1
+
+    def tamper_results(f):
+        f['results'][0] += 1
+
+    with pytest.raises(AssertionError, match="MIXING VERIFICATION FAILED"):
+        load(tampered(finished, tamper_mix))
+    with pytest.raises(ZeusError, match="Invalid trustee factors proof"):
+        load(tampered(finished, tamper_factors))
+    with pytest.raises(AssertionError, match="Old results did not match"):
+        load(tampered(finished, tamper_results))
+
+    text = to_canonical(dict(finished, results=[0]))
+    with pytest.raises(AssertionError, match="fingerprint mismatch"):
+        load(text, no_verify=True)
+    with pytest.raises(ZeusError, match="Invalid proofs file"):
+        load(to_canonical(finished)[:-100])
+    with pytest.raises(ZeusError, match="'votes' is missing"):
+        load(tampered(finished, lambda f: f.pop('votes')))
+
+
+def test_verify_election_main(finished, tmp_path, capsys):
+    path = str(tmp_path / 'election.zeus')
+    with open(path, 'w') as f:
+        to_canonical(finished, out=f)
+    election = main(['--election', path, '--results', '--report',
+                     '--quiet'])
+    out = capsys.readouterr().out
+    assert finished['election_fingerprint'] in out
+    assert 'RESULTS: %s' % (' '.join(map(str, finished['results'])),) in out
+    assert election.do_get_results() == finished['results']
+
+
+def test_verify_signatures_main(finished, tmp_path, capsys):
+    path = str(tmp_path / 'election.zeus')
+    with open(path, 'w') as f:
+        to_canonical(finished, out=f)
+    sigdir = tmp_path / 'signatures'
+    sigdir.mkdir()
+    votes = [vote for vote in finished['votes'] if 'signature' in vote]
+    for i, vote in enumerate(votes):
+        (sigdir / ('%03d' % i)).write_text(vote['signature'])
+    tampered = votes[0]['signature'].replace('INDEX: ', 'INDEX: 9')
+    (sigdir / 'tampered').write_text(tampered)
+    reference = ZeusCoreElection.new_at_finished(dict(finished))
+    counted = reference.extract_votes_for_mixing()[1]
+
+    state = str(tmp_path / 'state')
+    summary = str(tmp_path / 'summary.json')
+    args = ['--election', path, '--no-verify', '--quiet', '--parallel', '2',
+            '--verify-signatures', str(sigdir),
+            '--state-file', state, '--summary', summary]
+    with pytest.raises(ZeusError, match="1 of %d signatures are invalid"
+                       % (len(votes) + 1,)):
+        main(args)
+    with open(summary) as f:
+        result = json.load(f)
+    assert result['election_fingerprint'] == finished['election_fingerprint']
+    assert result['total'] == len(votes) + 1
+    assert result['valid'] == len(votes)
+    assert result['counted'] == len(counted)
+    assert [r['file'] for r in result['failed']] == [str(sigdir / 'tampered')]
+    assert 'INVALID SIGNATURE: %s' % (sigdir / 'tampered',) in \
+        capsys.readouterr().out
+
+    # interrupted while writing the third record
+    with open(state) as f:
+        lines = f.readlines()
+    assert len(lines) == len(votes) + 2
+    with open(state, 'w') as f:
+        f.writelines(lines[:3])
+        f.write(lines[3][:10])
+    with open(path) as f:
+        election = ElectionVerifier(no_verify=True).load(f)
+    records, f = SignatureBatch(election, state_path=state).load_state()
+    f.close()
+    assert list(records) == [str(sigdir / '000'), str(sigdir / '001')]
+
+    with pytest.raises(ZeusError, match="signatures are invalid"):
+        main(args)
+    with open(summary) as f:
+        assert json.load(f)['signatures'] == result['signatures']
+    with open(state) as f:
+        assert f.readlines() == lines
+
+    with open(state, 'w') as f:
+        f.write(json.dumps({'election_fingerprint': 'other'}) + '\n')
+    with pytest.raises(ZeusError, match="does not belong"):
+        main(args)
+
+
+def test_check_signatures_script(finished, tmp_path):
+    path = str(tmp_path / 'election.zeus')
+    with open(path, 'w') as f:
+        to_canonical(finished, out=f)
+    reference = ZeusCoreElection.new_at_finished(dict(finished))
+    sigdir = tmp_path / 'receipts'
+    sigdir.mkdir()
+    for fingerprint in reference.extract_votes_for_mixing()[1]:
+        signature = reference.do_get_vote(fingerprint)['signature']
+        (sigdir / fingerprint).write_text(signature)
+    script = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          'zeus-check-signatures')
+
+    def check():
+        return subprocess.run(['bash', script, '-k', '-p', '2', path,
+                               str(sigdir)], cwd=str(tmp_path),
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+
+    process = check()
+    assert process.returncode == 0, process.stdout.decode()
+    with open(str(tmp_path / 'voter-signatures-summary.json')) as f:
+        assert json.load(f)['invalid'] == 0
+
+    os.unlink(str(tmp_path / 'voter-signatures-state'))
+    receipt = sorted(sigdir.iterdir())[0]
+    receipt.write_text(receipt.read_text().replace('INDEX: ', 'INDEX: 9'))
+    process = check()
+    assert process.returncode != 0
+    assert b'verification FAILED' in process.stdout
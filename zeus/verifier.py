@@ -0,0 +1,648 @@
+"""
+Streaming verification of election proofs files.
+
+A proofs file is the canonical export of a finished election and most
+of it is mixes, 128 proof rounds each. ElectionVerifier reads the file
+incrementally instead of loading it whole: every mix is verified as it
+is read, spooled one proof round at a time to a binary mix file in a
+temporary directory, and every set of trustee factors is verified and
+folded into the combined decryption factors. Only what later checks
+need is kept, i.e. the votes, the first ciphers mixed and the last
+mixed ciphers.
+
+The election fingerprint is computed while reading, over the canonical
+form of what was read, so keys must come in canonical order.
+
+SignatureBatch verifies voter signature files against a loaded
+election, checkpointing to a state file so that long runs can resume.
+"""
+
+import json
+import marshal
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha256
+from tempfile import TemporaryDirectory
+from time import time
+
+from loky import get_reusable_executor
+
+from zeus.core import (ZeusCoreElection, ZeusError, BETA, MIX_KEYS, _teller,
+                       combine_decryption_factors, decrypt_with_decryptor,
+                       iter_canonical, verify_decryption_factors,
+                       verify_vote_signatures)
+from zeus.mixfile import dump_mix_rounds
+from zeus.zeus_sk import verify_mix_file
+
+READ_CHUNK = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+MIX_COLLECTIONS = ('cipher_collections', 'offset_collections',
+                   'random_collections')
+FINISHED_KEYS = ('audit_publications', 'audit_requests', 'candidates',
+                 'cast_vote_index', 'cast_votes', 'cryptosystem',
+                 'election_public', 'excluded_voters', 'mixes', 'results',
+                 'trustee_factors', 'trustees', 'voter_audit_codes',
+                 'voters', 'votes', 'zeus_decryption_factors',
+                 'zeus_key_proof', 'zeus_public')
+UNHASHED_KEYS = ('election_fingerprint', 'election_report')
+SIGNATURE_CHUNK = 64
+
+
+class CanonicalReader(object):
+    """
+    Incremental reader of a JSON text file. Values are either read
+    whole with read(), or entered with items() and elements() and read
+    piece by piece.
+    """
+
+    def __init__(self, f, chunk_size=READ_CHUNK):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def error(self, reason):
+        m = ("Invalid proofs file at offset %d: %s"
+             % (self.offset + self.pos, reason))
+        return ZeusError(m)
+
+    def _fill(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            buf = self.buf
+            pos = self.pos
+            end = len(buf)
+            while pos < end and buf[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < end:
+                return buf[pos]
+            if not self._fill(self.chunk_size):
+                return None
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self.error("expected '%s'" % (char,))
+        self.pos += 1
+
+    def read(self):
+        """
+        Read the next value whole.
+        """
+        if self._peek() is None:
+            raise self.error("unexpected end of file")
+
+        # Read more until the value is complete. Read sizes double, so
+        # that large values are not parsed over and over again.
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError as e:
+                if self.eof:
+                    raise self.error(e)
+            else:
+                # a number may go on past the end of the buffer
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            self._fill(size)
+            size = max(size, len(self.buf))
+
+    def items(self):
+        """
+        Iterate over the keys of the object that comes next. The value
+        of each key must be read before moving on to the next one.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read()
+            if not isinstance(key, str):
+                raise self.error("expected a key")
+            self._expect(':')
+            yield key
+            char = self._peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise self.error("expected ',' or '}'")
+
+    def elements(self):
+        """
+        Iterate over the indexes of the array that comes next. Each
+        element must be read before moving on to the next one.
+        """
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self._peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise self.error("expected ',' or ']'")
+
+    def end(self):
+        if self._peek() is not None:
+            raise self.error("trailing data")
+
+
+def _spill_path(directory, key, i):
+    return os.path.join(directory, '%s-%d' % (key, i))
+
+
+def _spill(path, obj):
+    with open(path, "wb") as f:
+        marshal.dump(obj, f)
+
+
+def _unspill(path):
+    with open(path, "rb") as f:
+        obj = marshal.load(f)
+    os.unlink(path)
+    return obj
+
+
+class ElectionVerifier(object):
+    """
+    Load and verify a finished election from its proofs file, as
+    ZeusCoreElection.new_at_finished() and validate() would.
+    Election options, e.g. batch_verify, are given as keywords.
+    """
+
+    def __init__(self, teller=_teller, nr_parallel=0, no_verify=False,
+                 tmpdir=None, **kw):
+        self.teller = teller
+        self.nr_parallel = nr_parallel
+        self.no_verify = no_verify
+        self.tmpdir = tmpdir
+        self.options = kw
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def timed(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time() - start
+
+    def load(self, f):
+        """
+        Read the proofs file f and return the election, without mix
+        proofs and trustee factors, which are not kept.
+        Raise ZeusError or AssertionError if verification fails.
+        """
+        reader = CanonicalReader(f)
+        hasher = sha256()
+        self.data = data = {}
+        self.nr_mixes = 0
+        self.first_ciphers = None
+        self.last_mix = None
+        self.trustee_publics = set()
+        self.decryption_factors = None
+
+        def update(text):
+            hasher.update(text.encode())
+
+        sep = '{'
+        previous = None
+        for key in reader.items():
+            if previous is not None and key <= previous:
+                raise reader.error("keys not in canonical order")
+            previous = key
+            if key in UNHASHED_KEYS:
+                with self.timed('Reading election data'):
+                    data[key] = reader.read()
+                continue
+
+            update('%s%s: ' % (sep, json.dumps(key)))
+            sep = ', '
+            if key == 'mixes':
+                self.read_mixes(reader, update)
+            elif key == 'trustee_factors':
+                self.read_trustee_factors(reader, update)
+            else:
+                with self.timed('Reading election data'):
+                    data[key] = value = reader.read()
+                    if key == 'trustees':
+                        # keyed by int when exported, which sort
+                        # differently than strings
+                        value = dict((int(k), v) for k, v in value.items())
+                    for text in iter_canonical(value):
+                        update(text)
+            data.setdefault(key, None)
+        update('}')
+        reader.end()
+
+        for key in FINISHED_KEYS:
+            if key not in data:
+                m = "Invalid proofs file: '%s' is missing" % (key,)
+                raise ZeusError(m)
+
+        fingerprint = hasher.hexdigest()
+        if data.get('election_fingerprint') not in (None, fingerprint):
+            m = "Election fingerprint mismatch!"
+            raise AssertionError(m)
+
+        with self.timed('Reading election data'):
+            election = ZeusCoreElection.new_at_mixing(
+                data, teller=self.teller, nr_parallel=self.nr_parallel,
+                no_verify=self.no_verify, **self.options)
+        if not self.no_verify:
+            self.validate(election)
+
+        if self.last_mix is not None:
+            election.do_store_mix(self.last_mix)
+        election.do_store_results(data['results'])
+        election.election_fingerprint = fingerprint
+        election.do_set_stage('FINISHED')
+        self.data = None
+        return election
+
+    def read_mix(self, reader, update, directory=None):
+        """
+        Read a mix and return it without its proof collections, which
+        are only spooled to directory, if given, as nr_rounds files each.
+        """
+        mix = {}
+        sep = '{'
+        previous = None
+        for key in reader.items():
+            if key not in MIX_KEYS or (previous is not None and
+                                       key <= previous):
+                m = "Invalid cipher mix format"
+                raise ZeusError(m)
+            previous = key
+            update('%s%s: ' % (sep, json.dumps(key)))
+            sep = ', '
+            if key not in MIX_COLLECTIONS:
+                mix[key] = reader.read()
+                for text in iter_canonical(mix[key]):
+                    update(text)
+                continue
+
+            update('[')
+            nr_rounds = 0
+            for i in reader.elements():
+                collection = reader.read()
+                update(', ' if i else '')
+                for text in iter_canonical(collection):
+                    update(text)
+                if directory is not None:
+                    _spill(_spill_path(directory, key, i), collection)
+                nr_rounds += 1
+            update(']')
+            mix[key] = nr_rounds
+        update('}')
+
+        if len(mix) != len(MIX_KEYS):
+            m = "Invalid cipher mix format"
+            raise ZeusError(m)
+        if len(set(mix[key] for key in MIX_COLLECTIONS)) != 1:
+            m = "Invalid cipher mix format: collections not of the same size!"
+            raise ZeusError(m)
+        return mix
+
+    def get_read(self, key):
+        if key not in self.data:
+            m = "Invalid proofs file: '%s' is missing" % (key,)
+            raise ZeusError(m)
+        return self.data[key]
+
+    def read_mixes(self, reader, update):
+        crypto = self.get_read('cryptosystem')
+        verify = not self.no_verify
+        batch = bool(self.options.get('batch_verify'))
+
+        with self.timed('Verifying mixes'), \
+                TemporaryDirectory(prefix='zeus-verify-',
+                                   dir=self.tmpdir) as d:
+            update('[')
+            for i in reader.elements():
+                update(', ' if i else '')
+                mix = self.read_mix(reader, update, d if verify else None)
+                nr_rounds = mix['cipher_collections']
+
+                if [mix['modulus'], mix['generator'], mix['order']] != crypto:
+                    m = "Mix data corruption: Cryptosystem mismatch!"
+                    raise AssertionError(m)
+
+                if i == 0:
+                    self.first_ciphers = mix['original_ciphers']
+                elif mix['original_ciphers'] != self.last_mix['mixed_ciphers']:
+                    m = "Invalid mix %d: Does not mix previous one" % (i + 1,)
+                    raise AssertionError(m)
+
+                if verify:
+                    rounds = ([_unspill(_spill_path(d, key, j))
+                               for key in MIX_COLLECTIONS]
+                              for j in range(nr_rounds))
+                    path = os.path.join(d, 'mix')
+                    with open(path, 'wb') as f:
+                        dump_mix_rounds(mix, nr_rounds, rounds, f)
+                    if not verify_mix_file(path, teller=self.teller,
+                                           nr_parallel=self.nr_parallel,
+                                           batch=batch):
+                        m = "Invalid mix proof"
+                        raise AssertionError(m)
+                    os.unlink(path)
+
+                for key in MIX_COLLECTIONS + ('challenge', 'original_ciphers'):
+                    del mix[key]
+                self.last_mix = mix
+                self.nr_mixes += 1
+            update(']')
+
+        min_mixes = self.options.get('min_mixes') or 1
+        if verify and self.nr_mixes < min_mixes:
+            m = ("Not enough mixes: %d. Minimum %d."
+                 % (self.nr_mixes, min_mixes))
+            raise AssertionError(m)
+
+    def read_trustee_factors(self, reader, update):
+        modulus, generator, order = self.get_read('cryptosystem')
+        batch = bool(self.options.get('batch_verify_factors'))
+
+        with self.timed('Verifying trustee factors'):
+            update('[')
+            for i in reader.elements():
+                trustee_factors = reader.read()
+                update(', ' if i else '')
+                for text in iter_canonical(trustee_factors):
+                    update(text)
+
+                try:
+                    public = trustee_factors['trustee_public']
+                    factors = trustee_factors['decryption_factors']
+                except (KeyError, TypeError):
+                    m = "Invalid trustee factors format"
+                    raise ZeusError(m)
+                if public in self.trustee_publics:
+                    m = "Invalid decryption factors: duplicate trustee!"
+                    raise AssertionError(m)
+                self.trustee_publics.add(public)
+                if self.no_verify:
+                    continue
+
+                if self.last_mix is None:
+                    m = "Invalid proofs file: 'mixes' is missing"
+                    raise ZeusError(m)
+                mixed_ballots = self.last_mix['mixed_ciphers']
+                if not verify_decryption_factors(modulus, generator, order,
+                                                 public, mixed_ballots,
+                                                 factors, teller=self.teller,
+                                                 nr_parallel=self.nr_parallel,
+                                                 batch=batch):
+                    m = "Invalid trustee factors proof!"
+                    raise ZeusError(m)
+                self.add_decryption_factors(factors)
+            update(']')
+
+    def add_decryption_factors(self, factors):
+        modulus = self.data['cryptosystem'][0]
+        factors = combine_decryption_factors(modulus, [factors])
+        if self.decryption_factors is not None:
+            factors = [(a * b) % modulus
+                       for a, b in zip(self.decryption_factors, factors)]
+        self.decryption_factors = factors
+
+    def validate(self, election):
+        data = self.data
+        teller = self.teller
+        modulus, generator, order = election.do_get_cryptosystem()
+        mixed_ballots = self.last_mix['mixed_ciphers']
+
+        with self.timed("Validating stage 'CREATING'"):
+            election.validate_creating()
+
+        with self.timed("Validating stage 'VOTING'"):
+            election.validate_voting()
+
+        with self.timed('Validating votes for mixing'):
+            election.validate_votes_for_mixing(self.first_ciphers)
+
+        with self.timed('Validating decryption factors'):
+            trustees = election.do_get_trustees()
+            nr_trustees = len(trustees)
+            nr_factors = len(self.trustee_publics)
+            if nr_trustees != nr_factors:
+                m = ("There are %d trustees, but only %d factors!"
+                     % (nr_trustees, nr_factors))
+                raise ZeusError(m)
+            if self.trustee_publics != set(trustees):
+                m = "Invalid decryption factors: trustee mismatch!"
+                raise AssertionError(m)
+
+            zeus_factors = data['zeus_decryption_factors']
+            zeus_public = election.do_get_zeus_public()
+            batch = bool(self.options.get('batch_verify_factors'))
+            if not verify_decryption_factors(modulus, generator, order,
+                                             zeus_public, mixed_ballots,
+                                             zeus_factors, teller=teller,
+                                             nr_parallel=self.nr_parallel,
+                                             batch=batch):
+                m = "Invalid zeus factors proof!"
+                raise ZeusError(m)
+            self.add_decryption_factors(zeus_factors)
+
+        with self.timed('Validating results'), \
+                teller.task("Decrypting ballots", total=len(mixed_ballots)):
+            results = []
+            for ballot, factor in zip(mixed_ballots, self.decryption_factors):
+                results.append(decrypt_with_decryptor(modulus, generator,
+                                                      order, ballot[BETA],
+                                                      factor))
+                teller.advance()
+            if results != data['results']:
+                m = "Old results did not match new results!"
+                raise AssertionError(m)
+
+
+def expand_paths(paths):
+    """
+    Replace directories in paths with the files in them, sorted.
+    """
+    expanded = []
+    for path in paths:
+        if not os.path.isdir(path):
+            expanded.append(path)
+            continue
+        names = sorted(os.listdir(path))
+        expanded.extend(os.path.join(path, name) for name in names
+                        if os.path.isfile(os.path.join(path, name)))
+    return expanded
+
+
+def verify_signature_files(context, paths):
+    """
+    Read and verify the vote signature files at paths, as
+    verify_vote_signatures() does, which see.
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                signature = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            results.append(e)
+            continue
+        results.extend(verify_vote_signatures(context, [signature]))
+    return results
+
+
+def _verify_signature_files(data):
+    return verify_signature_files(*data)
+
+
+class SignatureBatch(object):
+    """
+    Verify vote signature files against a loaded election. Files are
+    verified in chunks over nr_parallel worker processes, which share
+    the signing context of the election, and each vote is then validated
+    against the votes of the election. Every finished chunk is appended
+    to the state file, one JSON line per file, so that an interrupted
+    batch resumes where it stopped.
+    """
+
+    def __init__(self, election, state_path=None, teller=_teller,
+                 nr_parallel=0, chunk_size=SIGNATURE_CHUNK):
+        self.election = election
+        self.state_path = state_path
+        self.teller = teller
+        self.nr_parallel = nr_parallel
+        self.chunk_size = chunk_size
+        self.fingerprint = election.election_fingerprint
+
+    def load_state(self):
+        """
+        Return the records of the state file by file path, and open it
+        for appending. A trailing partial line, left by an interrupted
+        write, is dropped.
+        """
+        records = OrderedDict()
+        path = self.state_path
+        if not path:
+            return records, None
+
+        header = {'election_fingerprint': self.fingerprint}
+        if not os.path.exists(path) or not os.path.getsize(path):
+            state = open(path, "w")
+            state.write(json.dumps(header, sort_keys=True) + '\n')
+            state.flush()
+            return records, state
+
+        with open(path, "r+") as f:
+            text = f.read()
+            lines = text.split('\n')
+            partial = lines.pop()
+            if partial:
+                # lines are ASCII JSON, so characters count bytes
+                f.truncate(len(text) - len(partial))
+        try:
+            first = json.loads(lines[0]) if lines else None
+        except ValueError:
+            first = None
+        if first != header:
+            m = ("State file '%s' does not belong to election [%s]"
+                 % (path, self.fingerprint))
+            raise ZeusError(m)
+        for line in lines[1:]:
+            record = json.loads(line)
+            records[record['file']] = record
+
+        return records, open(path, "a")
+
+    def check(self, path, result, counted):
+        record = {'file': path, 'fingerprint': None, 'valid': False,
+                  'counted': False, 'error': None}
+        try:
+            if isinstance(result, Exception):
+                raise result
+            record['fingerprint'] = result['fingerprint']
+            self.election.validate_vote(result)
+        except Exception as e:
+            record['error'] = str(e) or e.__class__.__name__
+            return record
+        record['valid'] = True
+        record['counted'] = result['fingerprint'] in counted
+        return record
+
+    def run(self, paths):
+        """
+        Verify the signature files at paths that the state file has no
+        record of and return the summary of all of them.
+        """
+        election = self.election
+        teller = self.teller
+        nr_parallel = self.nr_parallel
+        chunk_size = self.chunk_size
+
+        records, state = self.load_state()
+        pending = [path for path in paths if path not in records]
+        chunks = [pending[i:i + chunk_size]
+                  for i in range(0, len(pending), chunk_size)]
+        counted = set(election.extract_votes_for_mixing()[1])
+        context = election.get_signing_context().without_secret()
+        tasks = [(context, chunk) for chunk in chunks]
+
+        if nr_parallel > 0 and len(chunks) > 1:
+            executor = get_reusable_executor(max_workers=nr_parallel)
+            results = executor.map(_verify_signature_files, tasks)
+        else:
+            results = map(_verify_signature_files, tasks)
+
+        try:
+            with teller.task("Verifying signatures", total=len(paths),
+                             current=len(paths) - len(pending)):
+                for chunk, chunk_results in zip(chunks, results):
+                    lines = []
+                    for path, result in zip(chunk, chunk_results):
+                        record = self.check(path, result, counted)
+                        records[path] = record
+                        lines.append(json.dumps(record, sort_keys=True))
+                    if state is not None:
+                        state.write('\n'.join(lines) + '\n')
+                        state.flush()
+                        os.fsync(state.fileno())
+                    teller.advance(len(chunk))
+        finally:
+            if state is not None:
+                state.close()
+
+        return self.summary([records[path] for path in paths])
+
+    def summary(self, records):
+        failed = [record for record in records if not record['valid']]
+        return {
+            'election_fingerprint': self.fingerprint,
+            'total': len(records),
+            'valid': len(records) - len(failed),
+            'invalid': len(failed),
+            'counted': sum(1 for record in records if record['counted']),
+            'failed': failed,
+            'signatures': records,
+        }
@@ -7,12 +7,12 @@ import six.moves.urllib.request
 import six.moves.urllib.parse
 import six.moves.urllib.error
 import logging
+import hashlib
 
 from django.urls import reverse
 from django.forms import ValidationError
 from django.utils import translation
 from django.utils.translation import gettext_lazy as _
-from django.db import connection
 from django.db.models import Max
 from django.template.context_processors import csrf
 from django.views.decorators.csrf import csrf_exempt
@@ -37,6 +37,8 @@ from django.forms.models import modelformset_factory
 from django.template.loader import render_to_string
 from django.contrib import messages
 from django.views.decorators.http import require_http_methods
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control
 
 from helios.view_utils import render_template
 from helios.models import Poll, Voter, VoterFile, CastVote, \
@@ -914,10 +916,20 @@ def voter_booth_login(request, election, poll, voter_uuid, voter_secret):
 @auth.election_view(check_access=False)
 @require_http_methods(["GET"])
 def to_json(request, election, poll):
-    data = poll.get_booth_dict()
-    data['token'] = str(csrf(request)['csrf_token'])
-    return HttpResponse(json.dumps(data, default=common_json_handler),
-                        content_type="application/json")
+    data = poll.get_booth_json()
+    # a cached token stays valid as long as the csrf cookie is the same,
+    # the token itself is masked anew on each request so the etag is weak
+    lang = translation.get_language() or settings.LANGUAGE_CODE
+    cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    digest = hashlib.sha256(lang.encode() + b"\n" + cookie.encode() +
+                            b"\n" + data)
+    etag = 'W/"%s"' % digest.hexdigest()
+    token = json.dumps(str(csrf(request)['csrf_token'])).encode()
+    content = data[:-1] + b', "token": ' + token + b'}'
+    response = HttpResponse(content, content_type="application/json")
+    patch_cache_control(response, private=True, no_cache=True)
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
 
 
 @auth.poll_voter_required
@@ -961,14 +973,13 @@ def cast(request, election, poll):
         type_hint='phoebus/EncryptedVote').wrapped_obj
     audit_password = request.POST.get('audit_password', None)
 
-    cursor = connection.cursor()
-    try:
-        cursor.execute("SELECT pg_advisory_lock(1)")
-        with transaction.atomic():
-            cast_result = poll.cast_vote(voter, vote, audit_password)
-            poll.logger.info("Poll cast")
-    finally:
-        cursor.execute("SELECT pg_advisory_unlock(1)")
+    # the expensive proof check needs no lock
+    verified_fingerprint = poll.verify_vote_proof(voter, vote, audit_password)
+    with transaction.atomic():
+        poll.lock_for_casting()
+        cast_result = poll.cast_vote(voter, vote, audit_password,
+                                     verified_fingerprint=verified_fingerprint)
+        poll.logger.info("Poll cast")
 
     signature = {'signature': cast_result}
 
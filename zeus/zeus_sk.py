@@ -1,21 +1,40 @@
 
 from zeus.core import (
-        ZeusError, pow, sha256, ALPHA, BETA,
-        get_random_int, bit_iterator, get_random_permutation,
-        MIN_MIX_ROUNDS, _teller)
+        ZeusError, fixed_pow, multi_pow, sha256, ALPHA, BETA,
+        get_random_int, get_random_ints, bit_iterator, get_random_permutation,
+        MIN_MIX_ROUNDS, BATCH_EXPONENT_CEIL, _teller)
+from zeus.mixfile import (MixFile, dump_mix_rounds, pack_ciphers,
+                          pack_elements, unpack_elements)
 from loky import get_reusable_executor
 from Crypto import Random
+from gmpy2 import jacobi
+from tempfile import TemporaryDirectory
+from collections import deque
+from itertools import chain
+import json
+import mmap
+import os
+import struct
+
+
+MIX_MIN_RANGE = 64
 
 
 def reencrypt(modulus, generator, order, public, alpha, beta, secret=None):
     key = get_random_int(3, order) if secret is None else secret
-    alpha = (alpha * pow(generator, key, modulus)) % modulus
-    beta = (beta * pow(public, key, modulus)) % modulus
+    alpha = (alpha * fixed_pow(generator, key, modulus)) % modulus
+    beta = (beta * fixed_pow(public, key, modulus)) % modulus
     if secret is None:
         return [alpha, beta, key]
     return [alpha, beta]
 
 
+def update_mix_challenge(hasher, ciphers):
+    for cipher in ciphers:
+        hasher.update(("%x" % cipher[ALPHA]).encode())
+        hasher.update(("%x" % cipher[BETA]).encode())
+
+
 def compute_mix_challenge(cipher_mix):
     hasher = sha256()
 
@@ -27,37 +46,36 @@ def compute_mix_challenge(cipher_mix):
     update("%x" % cipher_mix['order'])
     update("%x" % cipher_mix['public'])
 
-    original_ciphers = cipher_mix['original_ciphers']
-    for cipher in original_ciphers:
-        update("%x" % cipher[ALPHA])
-        update("%x" % cipher[BETA])
-
-    mixed_ciphers = cipher_mix['mixed_ciphers']
-    for cipher in mixed_ciphers:
-        update("%x" % cipher[ALPHA])
-        update("%x" % cipher[BETA])
-
+    update_mix_challenge(hasher, cipher_mix['original_ciphers'])
+    update_mix_challenge(hasher, cipher_mix['mixed_ciphers'])
     for ciphers in cipher_mix['cipher_collections']:
-        for cipher in ciphers:
-            update("%x" % cipher[ALPHA])
-            update("%x" % cipher[BETA])
+        update_mix_challenge(hasher, ciphers)
 
     challenge = hasher.hexdigest()
     return challenge
 
 
 def shuffle_ciphers(modulus, generator, order, public, ciphers,
-                    teller=None, report_thresh=128):
+                    teller=None, report_thresh=128, factors=()):
     nr_ciphers = len(ciphers)
+    nr_factors = len(factors)
     mixed_offsets = get_random_permutation(nr_ciphers)
+    secrets = get_random_ints(max(nr_ciphers - nr_factors, 0), 3, order)
     mixed_ciphers = list([None]) * nr_ciphers
     mixed_randoms = list([None]) * nr_ciphers
     count = 0
 
     for i in range(nr_ciphers):
         alpha, beta = ciphers[i]
-        alpha, beta, secret = reencrypt(modulus, generator, order, public,
-                                        alpha, beta)
+        if i < nr_factors:
+            # precomputed (r, g^r, y^r), see zeus.mixpool
+            secret, alpha_factor, beta_factor = factors[i]
+            alpha = (alpha * alpha_factor) % modulus
+            beta = (beta * beta_factor) % modulus
+        else:
+            secret = secrets[i - nr_factors]
+            alpha, beta = reencrypt(modulus, generator, order,
+                                    public, alpha, beta, secret=secret)
         mixed_randoms[i] = secret
         o = mixed_offsets[i]
         mixed_ciphers[o] = [alpha, beta]
@@ -73,12 +91,175 @@ def shuffle_ciphers(modulus, generator, order, public, ciphers,
     return [mixed_ciphers, mixed_offsets, mixed_randoms]
 
 
-def _shuffle_ciphers(data):
-    return shuffle_ciphers(*data)
+def answer_round(q, offsets, randoms, mixed_offsets, mixed_randoms):
+    # The image is given. We now have to prove we know
+    # both this image's and mixed_ciphers' offsets/randoms
+    # by providing new offsets/randoms so one can reencode
+    # this image to end up with mixed_ciphers.
+    # original_ciphers -> image
+    # original_ciphers -> mixed_ciphers
+    # Provide image -> mixed_ciphers
+    nr_ciphers = len(offsets)
+    new_offsets = list([None]) * nr_ciphers
+    new_randoms = list([None]) * nr_ciphers
+
+    for j in range(nr_ciphers):
+        cipher_random = randoms[j]
+        cipher_offset = offsets[j]
+        mixed_random = mixed_randoms[j]
+        mixed_offset = mixed_offsets[j]
+
+        new_offsets[cipher_offset] = mixed_offset
+        new_random = (mixed_random - cipher_random) % q
+        new_randoms[cipher_offset] = new_random
+
+    return [new_offsets, new_randoms]
+
+
+# Shared files mapped or loaded by a pool worker, by path.
+# Only the files of the mix in progress are kept.
+_worker_files = {}
+WORKER_FILES_MAX = 2
+
+
+def _worker_file(path, load, *args):
+    obj = _worker_files.get(path)
+    if obj is None:
+        while len(_worker_files) >= WORKER_FILES_MAX:
+            del _worker_files[next(iter(_worker_files))]
+        obj = load(path, *args)
+        _worker_files[path] = obj
+    return obj
+
+
+def _map_file(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _load_answers(path, size, nr_ciphers):
+    with open(path, 'rb') as f:
+        offsets = list(struct.unpack('>%dI' % nr_ciphers,
+                                     f.read(4 * nr_ciphers)))
+        randoms = unpack_elements(f.read(), size)
+    return offsets, randoms
+
+
+def _reencrypt_range(data):
+    p, g, q, y, path, size, start, end = data
+    shared = _worker_file(path, _map_file)
+    elements = unpack_elements(shared[start * 2 * size:end * 2 * size], size)
+    ciphers = []
+    randoms = []
+    for alpha, beta in zip(elements[0::2], elements[1::2]):
+        alpha, beta, secret = reencrypt(p, g, q, y, alpha, beta)
+        ciphers.append([alpha, beta])
+        randoms.append(secret)
+    return ciphers, randoms
+
+
+def _answer_round(data):
+    q, path, size, offsets, randoms = data
+    nr_ciphers = len(offsets)
+    mixed_offsets, mixed_randoms = _worker_file(path, _load_answers,
+                                                size, nr_ciphers)
+    return answer_round(q, offsets, randoms, mixed_offsets, mixed_randoms)
+
+
+def _cipher_ranges(nr_ciphers, nr_parallel):
+    size = max(-(-nr_ciphers // nr_parallel), MIX_MIN_RANGE)
+    return [(start, min(start + size, nr_ciphers))
+            for start in range(0, nr_ciphers, size)]
+
+
+def share_ciphers(path, ciphers, size):
+    with open(path, 'wb') as f:
+        f.write(pack_ciphers(ciphers, size))
+
+
+def shuffle_rounds(executor, p, g, q, y, path, nr_ciphers, nr_rounds,
+                   nr_parallel, teller=None):
+    """
+    Yield nr_rounds shuffles of the ciphers shared in the file at path,
+    as shuffle_ciphers() would return them. Every shuffle is split into
+    cipher ranges, so that both small and large polls keep all workers
+    busy, and only a bounded number of rounds is in flight.
+    """
+    size = (p.bit_length() + 7) // 8
+    ranges = _cipher_ranges(nr_ciphers, nr_parallel)
+    window = max(2, -(-nr_parallel // len(ranges))) if ranges else 1
+    pending = deque()
+    rounds = iter(range(nr_rounds))
+
+    def submit():
+        for _ in rounds:
+            pending.append([
+                executor.submit(_reencrypt_range,
+                                (p, g, q, y, path, size, start, end))
+                for start, end in ranges
+            ])
+            return
+
+    for _ in range(window):
+        submit()
+
+    while pending:
+        futures = pending.popleft()
+        submit()
+        ciphers = []
+        randoms = []
+        for future in futures:
+            c, r = future.result()
+            ciphers.extend(c)
+            randoms.extend(r)
+            if teller:
+                teller.advance(len(c))
+
+        offsets = get_random_permutation(nr_ciphers)
+        mixed_ciphers = list([None]) * nr_ciphers
+        for j in range(nr_ciphers):
+            mixed_ciphers[offsets[j]] = ciphers[j]
+        del ciphers
+        yield [mixed_ciphers, offsets, randoms]
+
+
+def make_shuffles(p, g, q, y, ciphers, nr_shuffles, directory,
+                  teller=None, nr_parallel=0, pool=None):
+    """
+    Return an iterator over nr_shuffles shuffles of ciphers. Shuffles
+    are first made with factors from the re-encryption pool, if any,
+    and then computed, in parallel by cipher ranges if nr_parallel > 0,
+    sharing the ciphers through a file in directory.
+    """
+    nr_ciphers = len(ciphers)
+    nr_pooled = 0
+    if pool is not None and nr_ciphers:
+        nr_pooled = min(nr_shuffles, pool.available() // nr_ciphers)
+
+    # the pool may be drained concurrently, shuffle_ciphers() then
+    # computes the missing factors
+    pooled = (shuffle_ciphers(p, g, q, y, ciphers, teller=teller,
+                              factors=pool.take(nr_ciphers))
+              for _ in range(nr_pooled))
+
+    nr_computed = nr_shuffles - nr_pooled
+    if nr_parallel > 0 and nr_computed:
+        executor = get_reusable_executor(max_workers=nr_parallel,
+                                         initializer=Random.atfork)
+        ciphers_path = os.path.join(directory, 'ciphers')
+        share_ciphers(ciphers_path, ciphers, (p.bit_length() + 7) // 8)
+        computed = shuffle_rounds(executor, p, g, q, y, ciphers_path,
+                                  nr_ciphers, nr_computed, nr_parallel,
+                                  teller=teller)
+    else:
+        computed = (shuffle_ciphers(p, g, q, y, ciphers, teller=teller)
+                    for _ in range(nr_computed))
+
+    return chain(pooled, computed)
 
 
 def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
-                teller=_teller, nr_parallel=0):
+                teller=_teller, nr_parallel=0, pool=None):
     p = ciphers_for_mixing['modulus']
     g = ciphers_for_mixing['generator']
     q = ciphers_for_mixing['order']
@@ -92,81 +273,207 @@ def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
     cipher_mix = {'modulus': p, 'generator': g, 'order': q, 'public': y}
     cipher_mix['original_ciphers'] = original_ciphers
 
-    with teller.task('Producing final mixed ciphers', total=nr_ciphers):
-        shuffled = shuffle_ciphers(p, g, q, y, original_ciphers, teller=teller)
-        mixed_ciphers, mixed_offsets, mixed_randoms = shuffled
-        cipher_mix['mixed_ciphers'] = mixed_ciphers
+    with TemporaryDirectory(prefix='zeus-mix-') as d:
+        # The final mix is just the first of the shuffles
+        shuffles = make_shuffles(p, g, q, y, original_ciphers,
+                                 nr_rounds + 1, d, teller=teller,
+                                 nr_parallel=nr_parallel, pool=pool)
+
+        with teller.task('Producing final mixed ciphers', total=nr_ciphers):
+            shuffled = next(shuffles)
+            mixed_ciphers, mixed_offsets, mixed_randoms = shuffled
+            cipher_mix['mixed_ciphers'] = mixed_ciphers
+
+        total = nr_ciphers * nr_rounds
+        with teller.task('Producing ciphers for proof', total=total):
+            collections = list(shuffles)
+            unzipped = [list(x) for x in zip(*collections)] or [[], [], []]
+            cipher_collections, offset_collections, random_collections = \
+                unzipped
+            del collections
+            cipher_mix['cipher_collections'] = cipher_collections
+            cipher_mix['random_collections'] = random_collections
+            cipher_mix['offset_collections'] = offset_collections
+
+        with teller.task('Producing cryptographic hash challenge'):
+            challenge = compute_mix_challenge(cipher_mix)
+            cipher_mix['challenge'] = challenge
+
+        bits = list(zip(range(nr_rounds), bit_iterator(int(challenge, 16))))
+        for i, bit in bits:
+            if bit not in (0, 1):
+                m = "This should be impossible. Something is broken."
+                raise AssertionError(m)
 
-    total = nr_ciphers * nr_rounds
-    with teller.task('Producing ciphers for proof', total=total):
-        if nr_parallel > 0:
-            executor = get_reusable_executor(max_workers=nr_parallel,
-                                             initializer=Random.atfork)
-            data = [
-                (p, g, q, y, original_ciphers)
-                for _ in range(nr_rounds)
-            ]
-            collections = []
-            for r in executor.map(_shuffle_ciphers, data):
+        # Nothing to do for bit 0 rounds,
+        # we just publish our offsets and randoms
+        answered = [i for i, bit in bits if bit == 1]
+
+        with teller.task('Answering according to challenge',
+                         total=nr_rounds):
+            teller.advance(nr_rounds - len(answered))
+            if nr_parallel > 0:
+                executor = get_reusable_executor(max_workers=nr_parallel,
+                                                 initializer=Random.atfork)
+                size = (p.bit_length() + 7) // 8
+                answers_path = os.path.join(d, 'answers')
+                with open(answers_path, 'wb') as f:
+                    f.write(struct.pack('>%dI' % nr_ciphers, *mixed_offsets))
+                    f.write(pack_elements(mixed_randoms, size))
+                data = [(q, answers_path, size,
+                         offset_collections[i], random_collections[i])
+                        for i in answered]
+                answers = executor.map(_answer_round, data)
+            else:
+                answers = (answer_round(q, offset_collections[i],
+                                        random_collections[i],
+                                        mixed_offsets, mixed_randoms)
+                           for i in answered)
+
+            for i, answer in zip(answered, answers):
+                offset_collections[i], random_collections[i] = answer
                 teller.advance()
-                collections.append(r)
-        else:
-            collections = [shuffle_ciphers(p, g, q, y,
-                                           original_ciphers, teller=teller)
-                           for _ in range(nr_rounds)]
 
-        unzipped = [list(x) for x in zip(*collections)]
-        cipher_collections, offset_collections, random_collections = unzipped
-        cipher_mix['cipher_collections'] = cipher_collections
-        cipher_mix['random_collections'] = random_collections
-        cipher_mix['offset_collections'] = offset_collections
+    teller.finish('Mixing')
+
+    return cipher_mix
 
-    with teller.task('Producing cryptographic hash challenge'):
-        challenge = compute_mix_challenge(cipher_mix)
-        cipher_mix['challenge'] = challenge
 
-    bits = bit_iterator(int(challenge, 16))
+def _spill(path, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f)
+
+
+def _unspill(path):
+    with open(path, "r") as f:
+        return json.load(f)
 
-    with teller.task('Answering according to challenge', total=nr_rounds):
-        for i, bit in zip(range(nr_rounds), bits):
-            offsets = offset_collections[i]
-            randoms = random_collections[i]
 
+def mix_ciphers_to_file(ciphers_for_mixing, out, nr_rounds=MIN_MIX_ROUNDS,
+                        teller=_teller, nr_parallel=0, spill_dir=None,
+                        pool=None, binary=False):
+    """
+    Like mix_ciphers(), but write the cipher mix to the text file out,
+    in canonical form, instead of returning it. If binary, write it to
+    the binary file out as a mix file, see zeus.mixfile.
+
+    Each proof round is spilled to files under spill_dir as soon as it
+    is produced and the challenge is hashed incrementally, so that only
+    a few rounds of ciphers are ever held in memory, instead of all of
+    them. Returns the challenge.
+    """
+    p = ciphers_for_mixing['modulus']
+    g = ciphers_for_mixing['generator']
+    q = ciphers_for_mixing['order']
+    y = ciphers_for_mixing['public']
+
+    original_ciphers = ciphers_for_mixing['mixed_ciphers']
+    nr_ciphers = len(original_ciphers)
+
+    teller.task('Mixing %d ciphers for %d rounds' % (nr_ciphers, nr_rounds))
+
+    hasher = sha256()
+    for number in (p, g, q, y):
+        hasher.update(("%x" % number).encode())
+    update_mix_challenge(hasher, original_ciphers)
+
+    with TemporaryDirectory(prefix='zeus-mix-', dir=spill_dir) as d:
+        # The final mix is just the first of the shuffles
+        shuffles = make_shuffles(p, g, q, y, original_ciphers,
+                                 nr_rounds + 1, d, teller=teller,
+                                 nr_parallel=nr_parallel, pool=pool)
+
+        with teller.task('Producing final mixed ciphers', total=nr_ciphers):
+            shuffled = next(shuffles)
+            mixed_ciphers, mixed_offsets, mixed_randoms = shuffled
+            update_mix_challenge(hasher, mixed_ciphers)
+
+        def spill_path(kind, i):
+            return os.path.join(d, '%s-%d' % (kind, i))
+
+        def spill_round(i, collection):
+            ciphers, offsets, randoms = collection
+            update_mix_challenge(hasher, ciphers)
+            _spill(spill_path('ciphers', i), ciphers)
+            _spill(spill_path('offsets', i), offsets)
+            _spill(spill_path('randoms', i), randoms)
+
+        total = nr_ciphers * nr_rounds
+        with teller.task('Producing ciphers for proof', total=total):
+            # shuffle_rounds() keeps only a few rounds in flight, so
+            # that finished rounds do not pile up in memory
+            for i, shuffled in enumerate(shuffles):
+                spill_round(i, shuffled)
+
+        with teller.task('Producing cryptographic hash challenge'):
+            challenge = hasher.hexdigest()
+
+        bits = list(zip(range(nr_rounds),
+                        bit_iterator(int(challenge, 16))))
+
+        def spilled_ciphers(i, bit):
+            return _unspill(spill_path('ciphers', i))
+
+        def answer_offsets(i, bit):
+            offsets = _unspill(spill_path('offsets', i))
             if bit == 0:
-                # Nothing to do, we just publish our offsets and randoms
-                pass
-            elif bit == 1:
-                # The image is given. We now have to prove we know
-                # both this image's and mixed_ciphers' offsets/randoms
-                # by providing new offsets/randoms so one can reencode
-                # this image to end up with mixed_ciphers.
-                # original_ciphers -> image
-                # original_ciphers -> mixed_ciphers
-                # Provide image -> mixed_ciphers
-                new_offsets = list([None]) * nr_ciphers
-                new_randoms = list([None]) * nr_ciphers
-
-                for j in range(nr_ciphers):
-                    cipher_random = randoms[j]
-                    cipher_offset = offsets[j]
-                    mixed_random = mixed_randoms[j]
-                    mixed_offset = mixed_offsets[j]
-
-                    new_offsets[cipher_offset] = mixed_offset
-                    new_random = (mixed_random - cipher_random) % q
-                    new_randoms[cipher_offset] = new_random
-
-                offset_collections[i] = new_offsets
-                random_collections[i] = new_randoms
-                del offsets, randoms
-            else:
-                m = "This should be impossible. Something is broken."
-                raise AssertionError(m)
+                return offsets
+            new_offsets = list([None]) * nr_ciphers
+            for j in range(nr_ciphers):
+                new_offsets[offsets[j]] = mixed_offsets[j]
+            return new_offsets
+
+        def answer_randoms(i, bit):
+            randoms = _unspill(spill_path('randoms', i))
+            if bit == 0:
+                return randoms
+            offsets = _unspill(spill_path('offsets', i))
+            new_randoms = list([None]) * nr_ciphers
+            for j in range(nr_ciphers):
+                new_randoms[offsets[j]] = (mixed_randoms[j] - randoms[j]) % q
+            return new_randoms
+
+        def write_collection(key, rounds):
+            out.write(', "%s": [' % (key,))
+            for i, bit in bits:
+                if i:
+                    out.write(', ')
+                json.dump(rounds(i, bit), out)
+            out.write(']')
+
+        if binary:
+            mix = {'modulus': p, 'generator': g, 'order': q, 'public': y,
+                   'original_ciphers': original_ciphers,
+                   'mixed_ciphers': mixed_ciphers, 'challenge': challenge}
+            rounds = ((spilled_ciphers(i, bit), answer_offsets(i, bit),
+                       answer_randoms(i, bit)) for i, bit in bits)
+            with teller.task('Answering according to challenge',
+                             total=nr_rounds):
+                dump_mix_rounds(mix, nr_rounds, rounds, out)
+                teller.advance(nr_rounds)
+            teller.finish('Mixing')
+            return challenge
+
+        # Write the keys sorted, as to_canonical() would
+        with teller.task('Answering according to challenge',
+                         total=nr_rounds):
+            out.write('{"challenge": %s' % (json.dumps(challenge),))
+            write_collection('cipher_collections', spilled_ciphers)
+            out.write(', "generator": %d' % (g,))
+            out.write(', "mixed_ciphers": ')
+            json.dump(mixed_ciphers, out)
+            out.write(', "modulus": %d' % (p,))
+            write_collection('offset_collections', answer_offsets)
+            out.write(', "order": %d' % (q,))
+            out.write(', "original_ciphers": ')
+            json.dump(original_ciphers, out)
+            out.write(', "public": %d' % (y,))
+            write_collection('random_collections', answer_randoms)
+            out.write('}')
+            teller.advance(nr_rounds)
 
-            teller.advance()
     teller.finish('Mixing')
-
-    return cipher_mix
+    return challenge
 
 
 def verify_mix_round(p, g, q, y, i, bit, original_ciphers, mixed_ciphers,
@@ -227,7 +534,89 @@ def _verify_mix_round(data):
     return verify_mix_round(*data)
 
 
-def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0):
+def _batch_check_round(p, g, y, sources, targets, randoms, offsets,
+                       nr_ciphers):
+    # Every source cipher re-encrypted with its random must equal its
+    # target cipher. Raise both sides of each equality to a small random
+    # exponent and compare the two products instead. The Jacobi symbol
+    # checks confine the quotients to the prime order subgroup, where a
+    # single wrong cipher survives with probability 1/BATCH_EXPONENT_CEIL.
+    jacobi_g = jacobi(g, p)
+    jacobi_y = jacobi(y, p)
+    source_bases = []
+    target_bases = []
+    exponents = []
+    alpha_exponent = 0
+    beta_exponent = 0
+    batch_exponents = get_random_ints(2 * nr_ciphers, 1, BATCH_EXPONENT_CEIL)
+
+    for j in range(nr_ciphers):
+        source = sources[j]
+        target = targets[offsets[j]]
+        r = randoms[j]
+        alpha = source[ALPHA]
+        beta = source[BETA]
+        new_alpha = target[ALPHA]
+        new_beta = target[BETA]
+        if not (0 < new_alpha < p and 0 < new_beta < p):
+            return False
+
+        odd = r & 1
+        if jacobi(new_alpha, p) != jacobi(alpha, p) * (jacobi_g if odd else 1):
+            return False
+        if jacobi(new_beta, p) != jacobi(beta, p) * (jacobi_y if odd else 1):
+            return False
+
+        c = batch_exponents[2 * j]
+        d = batch_exponents[2 * j + 1]
+        source_bases.extend((alpha, beta))
+        target_bases.extend((new_alpha, new_beta))
+        exponents.extend((c, d))
+        alpha_exponent += c * r
+        beta_exponent += d * r
+
+    left = multi_pow(target_bases, exponents, p)
+    right = multi_pow(source_bases, exponents, p)
+    right = (right * fixed_pow(g, alpha_exponent % (p - 1), p)) % p
+    right = (right * fixed_pow(y, beta_exponent % (p - 1), p)) % p
+    return left == right
+
+
+def batch_verify_mix_round(p, g, q, y, i, bit, original_ciphers,
+                           mixed_ciphers, ciphers, randoms, offsets,
+                           teller=None, report_thresh=128):
+    nr_ciphers = len(original_ciphers)
+    if bit == 0:
+        sources, targets = original_ciphers, ciphers
+    elif bit == 1:
+        sources, targets = ciphers, mixed_ciphers
+    else:
+        m = "This should be impossible. Something is broken."
+        raise AssertionError(m)
+
+    try:
+        verified = _batch_check_round(p, g, y, sources, targets,
+                                      randoms, offsets, nr_ciphers)
+    except (IndexError, TypeError, ValueError):
+        verified = False
+
+    if not verified:
+        # Let the per-cipher check find and report the failing cipher
+        return verify_mix_round(p, g, q, y, i, bit, original_ciphers,
+                                mixed_ciphers, ciphers, randoms, offsets,
+                                teller=teller, report_thresh=report_thresh)
+
+    if teller:
+        teller.advance(nr_ciphers)
+    return nr_ciphers
+
+
+def _batch_verify_mix_round(data):
+    return batch_verify_mix_round(*data)
+
+
+def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0,
+                      batch=False):
     try:
         p = cipher_mix['modulus']
         g = cipher_mix['generator']
@@ -274,14 +663,86 @@ def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0):
                          mixed_ciphers, ciphers,
                          randoms, offsets))
 
+        if batch:
+            verify_round = batch_verify_mix_round
+            _verify_round = _batch_verify_mix_round
+        else:
+            verify_round = verify_mix_round
+            _verify_round = _verify_mix_round
+
+        if nr_parallel <= 0:
+            for args in data:
+                verify_round(*args, teller=teller)
+
+        else:
+            executor = get_reusable_executor(max_workers=nr_parallel,
+                                             initializer=Random.atfork)
+            for count in executor.map(_verify_round, data):
+                teller.advance(count)
+
+    teller.finish('Verifying mixing')
+    return 1
+
+
+def verify_mix_file_round(path, i, bit, batch=False, teller=None):
+    with MixFile(path) as mix_file:
+        ciphers, offsets, randoms = mix_file.round(i)
+        verify_round = batch_verify_mix_round if batch else verify_mix_round
+        return verify_round(mix_file.modulus, mix_file.generator,
+                            mix_file.order, mix_file.public, i, bit,
+                            mix_file.original_ciphers(),
+                            mix_file.mixed_ciphers(),
+                            ciphers, randoms, offsets, teller=teller)
+
+
+def _verify_mix_file_round(data):
+    return verify_mix_file_round(*data)
+
+
+def verify_mix_file(path, teller=_teller, nr_parallel=0, batch=False):
+    """
+    Like verify_cipher_mix(), for the mix in the binary mix file at path.
+    Proof rounds are read one at a time, by the workers themselves if
+    nr_parallel > 0, so that the mix is never loaded as a whole.
+    """
+    with MixFile(path) as mix_file:
+        p = mix_file.modulus
+        g = mix_file.generator
+        q = mix_file.order
+        y = mix_file.public
+        nr_ciphers = mix_file.nr_ciphers
+        nr_rounds = mix_file.nr_rounds
+        challenge = mix_file.challenge
+
+        hasher = sha256()
+        for number in (p, g, q, y):
+            hasher.update(("%x" % number).encode())
+        update_mix_challenge(hasher, mix_file.original_ciphers())
+        update_mix_challenge(hasher, mix_file.mixed_ciphers())
+        for i in range(nr_rounds):
+            update_mix_challenge(hasher, mix_file.round_ciphers(i))
+
+    if hasher.hexdigest() != challenge:
+        m = "Invalid challenge"
+        raise ZeusError(m)
+
+    teller.task('Verifying mixing of %d ciphers for %d rounds'
+                 % (nr_ciphers, nr_rounds))
+
+    total = nr_rounds * nr_ciphers
+    with teller.task('Verifying ciphers', total=total):
+        data = [(path, i, bit, batch)
+                for i, bit in zip(range(nr_rounds),
+                                  bit_iterator(int(challenge, 16)))]
+
         if nr_parallel <= 0:
             for args in data:
-                verify_mix_round(*args, teller=teller)
+                verify_mix_file_round(*args, teller=teller)
 
         else:
             executor = get_reusable_executor(max_workers=nr_parallel,
                                              initializer=Random.atfork)
-            for count in executor.map(_verify_mix_round, data):
+            for count in executor.map(_verify_mix_file_round, data):
                 teller.advance(count)
 
     teller.finish('Verifying mixing')